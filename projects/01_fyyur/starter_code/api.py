@@ -0,0 +1,275 @@
+#----------------------------------------------------------------------------#
+# JSON API: /api/v1/<venues|artists|shows>[/<id>]
+#----------------------------------------------------------------------------#
+
+# ?fields=id,name,... picks the fields returned (all by default) and only
+# those columns are selected. Lists are keyset-paginated: each page carries
+# "next", a cursor to pass back as ?after= (null on the last page), and
+# ?limit= sets the page size. Venues and artists take ?genre=, shows take
+# ?upcoming=1.
+#
+# Each (resource, fields) pair is compiled once into a Serializer holding
+# the columns to select and how to turn a row into JSON. Bodies are cached
+# like pages (and invalidated by the same tags) and carry an ETag, so a
+# client revalidating with If-None-Match gets a 304 without a database hit.
+
+import json
+from datetime import datetime
+from functools import lru_cache
+
+from flask import Blueprint, Response, request
+from sqlalchemy import tuple_
+
+from listings import with_genre, genre_names
+from models import db, cache, Venue, Artist, Show, venue_genres, artist_genres
+
+try:
+  import orjson
+
+  def dumps(value):
+    return orjson.dumps(value).decode('utf-8')
+except ImportError:
+  def dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class Schema(object):
+  # The fields of one resource: name -> column (or GENRES for the genre
+  # names), the columns lists are ordered by, and the joins other tables'
+  # columns need
+
+  __slots__ = ('model', 'fields', 'order', 'joins', 'link', 'tags')
+
+  def __init__(self, model, fields, order, joins=None, link=None, tags=()):
+    self.model = model
+    self.fields = fields
+    self.order = order
+    self.joins = joins or {}
+    self.link = link
+    self.tags = tags
+
+
+# Stands in for a column: the genre names, looked up once per page
+GENRES = object()
+
+
+class Serializer(object):
+  # A schema compiled for one selection of fields
+
+  __slots__ = ('schema', 'names', 'columns', 'joins', 'datetimes', 'genres')
+
+  def __init__(self, schema, names):
+    self.schema = schema
+    self.names = [name for name in names if schema.fields[name] is not GENRES]
+    self.genres = len(self.names) < len(names)
+
+    # Selected columns first, then the ordering ones the cursor needs
+    self.columns = [schema.fields[name] for name in self.names]
+    self.columns += schema.order
+    self.joins = [
+      (table, onclause) for table, onclause in schema.joins.items()
+      if any(column.table is table for column in self.columns)
+    ]
+    self.datetimes = [
+      i for i, column in enumerate(self.columns[:len(self.names)])
+      if column.type.python_type is datetime
+    ]
+
+  def query(self):
+    query = db.session.query(*self.columns)
+    for table, onclause in self.joins:
+      query = query.join(table, onclause)
+    return query
+
+  def dump(self, row):
+    values = list(row[:len(self.names)])
+    for i in self.datetimes:
+      if values[i] is not None:
+        values[i] = values[i].isoformat()
+    return dict(zip(self.names, values))
+
+  def dump_all(self, rows):
+    data = [self.dump(row) for row in rows]
+    if self.genres and rows:
+      # The id is the last ordering column of venues and artists
+      ids = [row[-1] for row in rows]
+      genres = genre_names(self.schema.link, ids)
+      for item, id in zip(data, ids):
+        item['genres'] = genres.get(id, [])
+    return data
+
+  def cursor(self, row):
+    # Same format as the /shows page cursors: values joined by '_'
+    return '_'.join(
+      value.isoformat() if isinstance(value, datetime) else str(value)
+      for value in row[len(self.names):]
+    )
+
+
+SCHEMAS = {
+  'venues': Schema(
+    Venue,
+    fields=dict(
+      [(name, getattr(Venue, name)) for name in (
+        'id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+        'website_link', 'seeking_talent', 'seeking_description', 'latitude', 'longitude',
+        'upcoming_shows_count', 'past_shows_count', 'updated_at'
+      )] + [('genres', GENRES)]
+    ),
+    order=[Venue.id],
+    link=venue_genres.c.venue_id,
+    # shows: the show counts
+    tags=('venues', 'shows')
+  ),
+  'artists': Schema(
+    Artist,
+    fields=dict(
+      [(name, getattr(Artist, name)) for name in (
+        'id', 'name', 'city', 'state', 'phone', 'image_link', 'facebook_link',
+        'website_link', 'seeking_venue', 'seeking_description',
+        'upcoming_shows_count', 'past_shows_count', 'updated_at'
+      )] + [('genres', GENRES)]
+    ),
+    order=[Artist.id],
+    link=artist_genres.c.artist_id,
+    tags=('artists', 'shows')
+  ),
+  'shows': Schema(
+    Show,
+    fields={
+      'id': Show.id,
+      'start_time': Show.start_time,
+      'end_time': Show.end_time,
+      'venue_id': Show.venue_id,
+      'venue_name': Venue.name,
+      'artist_id': Show.artist_id,
+      'artist_name': Artist.name,
+      'artist_image_link': Artist.image_link
+    },
+    order=[Show.start_time, Show.id],
+    joins={
+      Venue.__table__: Show.venue_id == Venue.id,
+      Artist.__table__: Show.artist_id == Artist.id
+    },
+    tags=('shows', 'venues', 'artists')
+  )
+}
+
+
+@lru_cache(maxsize=128)
+def serializer(resource, fields):
+  # fields is a tuple of names, or None for all of them
+  schema = SCHEMAS[resource]
+  return Serializer(schema, fields or list(schema.fields))
+
+
+def decode_cursor(schema, cursor):
+  # Raises ValueError for anything Serializer.cursor() didn't produce
+  parts = cursor.rsplit('_', len(schema.order) - 1)
+  if len(parts) != len(schema.order):
+    raise ValueError(cursor)
+  return [
+    datetime.fromisoformat(part) if column.type.python_type is datetime else int(part)
+    for part, column in zip(parts, schema.order)
+  ]
+
+
+def error(status, message):
+  return Response(dumps({'error': message}), status=status, mimetype='application/json')
+
+
+def respond(body):
+  # JSON response with an ETag; a matching If-None-Match gets a 304
+  response = Response(body, mimetype='application/json')
+  response.add_etag()
+  return response.make_conditional(request)
+
+
+def _serializer():
+  # The serializer for this request's resource and ?fields=, or an error
+  schema = SCHEMAS[request.view_args['resource']]
+  fields = request.args.get('fields')
+  if not fields:
+    return serializer(request.view_args['resource'], None)
+
+  names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+  unknown = [name for name in names if name not in schema.fields]
+  if unknown:
+    return error(400, 'Unknown fields: %s' % ', '.join(unknown))
+  return serializer(request.view_args['resource'], names)
+
+
+def _page(schema):
+  # (limit, decoded ?after= cursor) of a list request, or an error
+  limit = min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE)
+  if limit < 1:
+    return error(400, 'limit must be positive')
+
+  after = request.args.get('after')
+  if not after:
+    return limit, None
+  try:
+    return limit, decode_cursor(schema, after)
+  except ValueError:
+    return error(400, 'Invalid cursor')
+
+
+def _list_body(compiled, limit, after):
+  schema = compiled.schema
+  query = compiled.query()
+
+  if after is not None:
+    if len(schema.order) == 1:
+      query = query.filter(schema.order[0] > after[0])
+    else:
+      query = query.filter(tuple_(*schema.order) > tuple_(*after))
+
+  if schema.model is Show:
+    query = query.filter(Show.start_time.isnot(None))
+    if request.args.get('upcoming', type=int) == 1:
+      query = query.filter(Show.start_time > datetime.now())
+  elif request.args.get('genre'):
+    query = with_genre(query, schema.link, schema.model.id, request.args['genre'])
+
+  rows = query.order_by(*schema.order).limit(limit + 1).all()
+  next_cursor = compiled.cursor(rows[limit - 1]) if len(rows) > limit else None
+
+  return dumps({'data': compiled.dump_all(rows[:limit]), 'next': next_cursor})
+
+
+def _detail_body(compiled, id):
+  row = compiled.query().filter(compiled.schema.model.id == id).first()
+  if row is None:
+    return None
+  return dumps(compiled.dump_all([row])[0])
+
+
+@api.route('/<any(venues, artists, shows):resource>')
+def index(resource):
+  compiled = _serializer()
+  if isinstance(compiled, Response):
+    return compiled
+  page = _page(compiled.schema)
+  if isinstance(page, Response):
+    return page
+
+  body = cache.fragment('api:' + request.full_path, lambda: _list_body(compiled, *page), compiled.schema.tags)
+  return respond(body)
+
+
+@api.route('/<any(venues, artists, shows):resource>/<int:id>')
+def detail(resource, id):
+  compiled = _serializer()
+  if isinstance(compiled, Response):
+    return compiled
+
+  tags = compiled.schema.tags + ('%s:%d' % (resource[:-1], id),)
+  body = cache.fragment('api:' + request.full_path, lambda: _detail_body(compiled, id), tags)
+  if body is None:
+    return error(404, 'Not found')
+  return respond(body)
@@ -3,53 +3,75 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
+import click
 from werkzeug import datastructures
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import FlaskForm
 from forms import *
 from flask_migrate import Migrate
-from datetime import date
-from models import Venue, Artist, Show, db, app
-import sys
+from datetime import date, datetime, timedelta
+from models import Venue, Artist, Show, db, app, cache, metrics, logs, genres_named
+from listings import venue_areas, recent_venues, artist_rows, show_page, decode_show_cursor
+from details import load_venue, load_artist, detail_version
+from http_cache import http_cache
+import search
+from formatting import format_datetime
+from engine import pool_stats
+from importer import fyyur_cli
+from export import export, FORMATS, KINDS
+import counters
+import scheduling
+import geo
+import facets
+from api import api
 
 # TODO: connect to a local postgresql database
 
-# Fix turn genres into list
-def string_to_list(record):
-  parsed = record.replace("{", "")
-  parsed = parsed.replace("}", "")
-  parsed = parsed.split(',')
-
-  return parsed
+#----------------------------------------------------------------------------#
+# Filters.
+#----------------------------------------------------------------------------#
 
+# Takes datetimes as they come from the database; patterns are compiled once
+# and repeat timestamps are served from an LRU cache (see formatting.py)
+app.jinja_env.filters['datetime'] = format_datetime
 
 #----------------------------------------------------------------------------#
-# Filters.
+# Commands.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  value = str(value)
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+# flask fyyur import --venues venues.jsonl --artists artists.csv --shows shows.csv
+app.cli.add_command(fyyur_cli)
+
+@fyyur_cli.command('reconcile-counts')
+@click.option('--full', is_flag=True, help='Recount every venue and artist from scratch.')
+def reconcile_counts(full):
+  """Move shows that have started from the upcoming to the past counters."""
+  # Run this periodically (e.g. from cron every few minutes): the listing
+  # pages count shows as upcoming until it has run past their start time
+  if full:
+    counters.recount()
+    click.echo('Recounted all venues and artists.')
+  else:
+    click.echo('%d shows moved to past.' % counters.reconcile())
+  cache.invalidate('venues', 'artists')
 
-app.jinja_env.filters['datetime'] = format_datetime
+#----------------------------------------------------------------------------#
+# JSON API.
+#----------------------------------------------------------------------------#
+
+# /api/v1/venues, /api/v1/artists, /api/v1/shows (see api.py)
+app.register_blueprint(api)
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
+@http_cache()
+@cache.cached('venues')
 def index():
-  venues = Venue.query.order_by(Venue.id.desc()).limit(3)
+  venues = recent_venues()
 
   return render_template('pages/home.html', venues=venues)
 
@@ -58,113 +80,84 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@http_cache()
+@cache.cached('venues', 'shows')
 def venues():
+  # Areas are keyed by (city, state) and grouped in SQL along with the number
+  # of upcoming shows per venue; the template consumes them as they stream in.
+  # ?state=, ?genre= and ?seeking= narrow the listing (facets.py).
+  filters = facets.parse(request.args)
+  areas = venue_areas(filters=filters)
 
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  #cities = Venue.query.distinct(Venue.city, Venue.state).all()
- 
-  # Get all venues back from the database
-  venues = Venue.query.all()
-
-  # Create empty cities and areas lists
-  cities = []
-  areas = []
-
-  # Create distinct list of cities
-  for venue in venues:
-    cities.append((venue.city, venue.state))
-    cities = list(set(cities))
-
-  #Return a list of city objects called areas
-  for city in cities:
-    # Create a list item for each distinct city
-    city_obj = {
-      'city': city[0], 
-      'state': city[1],
-      'venues': []
-    }
-
-    areas.append(city_obj)  
-
-    # Add venue object to the venues item
-    for venue in venues:
-      if city[0] == venue.city:
-        
-        venue_obj = {
-          'id': venue.id, 
-          'name': venue.name
-        }
-
-        city_obj['venues'].append(venue_obj)
-
-  return render_template('pages/venues.html', areas=areas)
+  return render_template('pages/venues.html', areas=areas, facets=facets.browse('venues', filters))
 
 @app.route('/venues/search', methods=['POST', 'GET'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # Case-insensitive partial match on the venue name, ranked by similarity.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
 
   # Get search term from form
   search_term = request.form.get('search_term', '')
 
-  # Query the database for results that ilike the search term
-  venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-
-  # Add query results along with count
-  response = {
-    "count": len(venues), 
-    "data": venues
-  }
+  # Matching venues along with the total count
+  response = search.search_venues(search_term)
 
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@http_cache(version=lambda venue_id: detail_version('venue', venue_id))
+@cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
+  # Venue, upcoming shows and past shows are loaded in a fixed three queries
+  data = load_venue(venue_id)
 
-  # Get the venue
-  # If no shows and inner join is empty, ignore the joins
-  if Venue.query.filter_by(id=venue_id).join(Show).join(Artist).first():
-    venue = Venue.query.filter_by(id=venue_id).join(Show).join(Artist).first()
-  else:
-    venue = Venue.query.filter_by(id=venue_id).first()
+  if data is None:
+    abort(404)
 
-  data = venue
+  # The page also shows the names of the artists playing there
+  cache.tag(*('artist:%d' % show['artist_id'] for show in data['upcoming_shows'] + data['past_shows']))
 
-  # Function defined in below models logic in app.py
-  data.genres = string_to_list(data.genres)
+  return render_template('pages/show_venue.html', venue=data)
 
-  today = datetime.now()
-  
-  data.upcoming_shows = []
-  data.past_shows = []
-
-  for show in data.shows:
-    if show.start_time>today:
-      upcoming_show = {
-        "artist_id": show.artist.id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": show.start_time
-      }
-      data.upcoming_shows.append(upcoming_show)  
-    else:
-      past_show = {
-        "artist_id": show.artist.id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": show.start_time
-      }
-      data.past_shows.append(past_show)
-  
-  data.upcoming_shows_count = len(data.upcoming_shows)
-  data.past_shows_count = len(data.past_shows)
+@app.route('/venues/nearby')
+def nearby_venues():
+  # Venues within ?radius= km of (?lat=, ?lon=), or the ?limit= nearest
+  # without a radius, nearest first (see geo.py)
+  try:
+    latitude = float(request.args['lat'])
+    longitude = float(request.args['lon'])
+    radius = float(request.args['radius']) if request.args.get('radius') else None
+    limit = int(request.args.get('limit', geo.NEARBY_LIMIT))
+    found = geo.nearby(latitude, longitude, radius, limit)
+  except (KeyError, ValueError) as error:
+    return jsonify({'error': 'lat and lon are required' if isinstance(error, KeyError) else str(error)}), 400
+
+  return jsonify({'venues': [
+    dict(venue._asdict(), distance_km=round(distance, 3)) for distance, venue in found
+  ]})
+
+@app.route('/venues/<int:venue_id>/availability')
+def venue_availability(venue_id):
+  # Free slots between ?from= and ?to= (ISO 8601; now and a week later by
+  # default), around the venue's booked shows
+  if Venue.query.get(venue_id) is None:
+    abort(404)
 
-  return render_template('pages/show_venue.html', venue=data)
-  #return render_template('pages/home.html')
+  try:
+    start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else datetime.now()
+    end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else start + timedelta(weeks=1)
+    free = scheduling.availability(venue_id, start, end)
+  except ValueError as error:
+    return jsonify({'error': str(error)}), 400
+
+  return jsonify({
+    'venue_id': venue_id,
+    'from': start.isoformat(),
+    'to': end.isoformat(),
+    'free': [{'start': slot_start.isoformat(), 'end': slot_end.isoformat()} for slot_start, slot_end in free]
+  })
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -188,7 +181,7 @@ def create_venue_submission():
       state=form.state.data,
       address=form.address.data,
       phone=form.phone.data,
-      genres=form.genres.data,
+      genres=genres_named(form.genres.data),
       facebook_link=form.facebook_link.data,
       image_link=form.image_link.data, 
       website_link=form.website_link.data, 
@@ -198,6 +191,7 @@ def create_venue_submission():
 
     db.session.add(venue)
     db.session.commit()
+    cache.invalidate('venues')
 
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
@@ -206,11 +200,7 @@ def create_venue_submission():
     db.session.rollback()
     # Error message
     flash('Venue ' + request.form['name'] + ' encountered an error and could not be listed. Crikey!')
-    print(sys.exc_info())
-
-  finally: 
-    db.session.close()
-
+    app.logger.exception('Venue could not be created')
 
   # TODO: on unsuccessful db insert, flash an error instead.
   # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
@@ -222,16 +212,21 @@ def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   venue = Venue.query.get(venue_id)
+  if venue is None:
+    abort(404)
+
+  # Its shows go with it (ON DELETE CASCADE), and off these artists' pages
+  artist_ids = [id for (id,) in db.session.query(Show.artist_id).filter_by(venue_id=venue.id).distinct()]
   try:
     db.session.delete(venue)
     db.session.commit()
+    cache.invalidate('venues', 'shows', 'venue:%s' % venue_id, *['artist:%d' % id for id in artist_ids])
     flash('Venue ' + venue.name + ' has been deleted. Good riddance.')
   except:
     db.session.rollback()
      # Error message
     flash('We encountered an error and ' + venue.name + ' could not be deleted. Saved by the database')
-  finally:
-    db.session.close()
+    app.logger.exception('Venue %s could not be deleted', venue_id)
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
@@ -240,65 +235,41 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@http_cache()
+@cache.cached('artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
+  # ?state=, ?genre= and ?seeking= narrow the listing (facets.py)
+  filters = facets.parse(request.args)
+  data = artist_rows(filters=filters)
 
-  data = Artist.query.all()
-
-  return render_template('pages/artists.html', artists=data)
+  return render_template('pages/artists.html', artists=data, facets=facets.browse('artists', filters))
 
 @app.route('/artists/search', methods=['POST', 'GET'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # Case-insensitive partial match on the artist name, ranked by similarity.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  
-  search_term=request.form.get('search_term', '')
-  #Venue.query.filter_by(id=venue_id).join(Show).join(Artist).first()
+  search_term = request.form.get('search_term', '')
 
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).join(Show, isouter=True).all()
-  
-  response = {
-    "count": len(artists),
-    "data": artists
-  }
+  # One row per artist, however many shows it has
+  response = search.search_artists(search_term)
 
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@http_cache(version=lambda artist_id: detail_version('artist', artist_id))
+@cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-  if Artist.query.filter_by(id=artist_id).join(Show).join(Venue).first():
-    artist = Artist.query.filter_by(id=artist_id).join(Show).join(Venue).first()
-  else:
-    artist = Artist.query.get(artist_id)
-
-  artist.past_shows = []
-  artist.upcoming_shows = []
+  # Artist, upcoming shows and past shows are loaded in a fixed three queries
+  artist = load_artist(artist_id)
 
-  now = datetime.now()
+  if artist is None:
+    abort(404)
 
-  artist.genres = string_to_list(artist.genres)
-
-  for show in artist.shows:
-    show_to_add = {
-      "venue_id": show.venue_id,
-      "start_time": show.start_time,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link
-    }
-    
-    if show.start_time > now:
-      artist.upcoming_shows.append(show_to_add)
-    else:
-      artist.past_shows.append(show_to_add)
-  
-  artist.upcoming_shows_count = len(artist.upcoming_shows)
-  artist.past_shows_count = len(artist.past_shows)
-  
+  # The page also shows the names of the venues played
+  cache.tag(*('venue:%d' % show['venue_id'] for show in artist['upcoming_shows'] + artist['past_shows']))
 
-  #return redirect(url_for('index'))
   return render_template('pages/show_artist.html', artist=artist)
 
 #  Update
@@ -326,19 +297,22 @@ def edit_artist_submission(artist_id):
         if form[field].data:
           setattr(artist, field, form[field].data)
 
-    update_if_there(['name', 'phone', 'city', 'state', 'genres', 'facebook_link', 'image_link', 'website_link', 'seeking_venue', 'seeking_description'])
+    update_if_there(['name', 'phone', 'city', 'state', 'facebook_link', 'image_link', 'website_link', 'seeking_venue', 'seeking_description'])
+
+    if form.genres.data:
+      artist.genres = genres_named(form.genres.data)
+    artist.updated_at = datetime.utcnow()
 
     db.session.add(artist)
     db.session.commit()
+    cache.invalidate('artists', 'artist:%d' % artist_id)
 
     flash('Artist ' + artist.name + ' has been updated. Times are changing!')
 
   except:
     db.session.rollback()
     flash('Artist ' + artist.name + ' has NOT been updated. What did you do?')
-
-  finally:
-    db.session.close()
+    app.logger.exception('Artist %d could not be updated', artist_id)
 
   return redirect(url_for('show_artist', artist_id=artist_id))
 
@@ -366,19 +340,22 @@ def edit_venue_submission(venue_id):
         if form[field].data:
           setattr(venue, field, form[field].data)
 
-    update_if_there(['name', 'phone', 'city', 'state', 'address', 'genres', 'facebook_link', 'image_link', 'website_link', 'seeking_talent', 'seeking_description'])
+    update_if_there(['name', 'phone', 'city', 'state', 'address', 'facebook_link', 'image_link', 'website_link', 'seeking_talent', 'seeking_description'])
+
+    if form.genres.data:
+      venue.genres = genres_named(form.genres.data)
+    venue.updated_at = datetime.utcnow()
 
     db.session.add(venue)
     db.session.commit()
+    cache.invalidate('venues', 'venue:%d' % venue_id)
 
     flash('Venue ' + venue.name + ' has been updated. Times are changing!')
 
   except:
     db.session.rollback()
     flash('Venue ' + venue.name + ' has NOT been updated. What did you do?')
-
-  finally:
-    db.session.close()
+    app.logger.exception('Venue %d could not be updated', venue_id)
 
   return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -404,7 +381,7 @@ def create_artist_submission():
       city=form.city.data,
       state=form.state.data,
       phone=form.phone.data,
-      genres=form.genres.data,
+      genres=genres_named(form.genres.data),
       facebook_link=form.facebook_link.data,
       image_link=form.image_link.data,
       website_link=form.website_link.data, 
@@ -414,6 +391,7 @@ def create_artist_submission():
 
     db.session.add(artist)
     db.session.commit()
+    cache.invalidate('artists')
 
     # on successful db insert, flash success
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
@@ -423,7 +401,7 @@ def create_artist_submission():
 
     # TODO: on unsuccessful db insert, flash an error instead.
     flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed. Bummer dude')
-    print(sys.exc_info())
+    app.logger.exception('Artist could not be created')
 
   return render_template('pages/home.html')
 
@@ -432,29 +410,25 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@http_cache()
+@cache.cached('shows')
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
+  # displays list of shows at /shows, one keyset-paginated page at a time
+  upcoming = request.args.get('upcoming', type=int, default=0) == 1
 
-  shows = Show.query.join(Venue).join(Artist).all()
-
-  data = []
+  try:
+    after = request.args.get('after')
+    after = decode_show_cursor(after) if after else None
+  except ValueError:
+    abort(400)
 
-  for show in shows:
-    obj = {
-      "venue_id": show.venue.id,
-      "venue_name": show.venue.name,
-      "artist_id": show.artist.id,
-      'artist_name': show.artist.name,
-      'artist_image_link': show.artist.image_link,
-      'start_time': show.start_time
-    }
-    data.append(obj)
+  data, next_cursor = show_page(after=after, upcoming=upcoming)
 
-    print(data)
+  # Venue and artist names on the page go stale when those are edited
+  cache.tag(*('venue:%d' % show.venue_id for show in data))
+  cache.tag(*('artist:%d' % show.artist_id for show in data))
 
-  return render_template('pages/shows.html', shows=data)
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor, upcoming=upcoming)
 
 @app.route('/shows/create')
 def create_shows():
@@ -465,31 +439,87 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
-  try:
-    form = ShowForm()
+  # The venue and artist must exist and be free for every show of the run;
+  # nothing is listed otherwise (see scheduling.py)
+  form = ShowForm()
+  if not form.validate():
+    flash('Show could not be listed: ' + '; '.join(
+      '%s: %s' % (name, ' '.join(errors)) for name, errors in form.errors.items()))
+    return render_template('pages/home.html')
 
-    show = Show(
-      artist_id=form.artist_id.data,
-      venue_id=form.venue_id.data,
-      start_time=form.start_time.data
+  try:
+    shows = scheduling.book(
+      int(form.venue_id.data),
+      int(form.artist_id.data),
+      form.start_time.data,
+      form.end_time.data,
+      repeat=form.repeat.data or 1
     )
+    cache.invalidate('shows', 'venue:%d' % shows[0].venue_id, 'artist:%d' % shows[0].artist_id)
 
-    db.session.add(show)
-    db.session.commit()
-
-      # on successful db insert, flash success
-    flash('Show was successfully listed!')
+    # on successful db insert, flash success
+    if len(shows) > 1:
+      flash('%d shows were successfully listed!' % len(shows))
+    else:
+      flash('Show was successfully listed!')
 
+  except scheduling.SchedulingError as error:
+    flash('Show could not be listed: %s.' % error)
+  except ValueError:
+    flash('Show could not be listed: venue and artist IDs are numbers.')
   except:
-    # TODO: on unsuccessful db insert, flash an error instead.
+    db.session.rollback()
     flash('An error occurred. Show could not be listed.')
-
-  finally:
-    db.session.close()
+    app.logger.exception('Show could not be created')
 
   return render_template('pages/home.html')
 
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<kind>.<format>')
+def export_data(kind, format):
+  # Streamed CSV/NDJSON dump; ?after=<id> for rows added since a previous one
+  if kind not in KINDS or format not in FORMATS:
+    abort(404)
+  try:
+    after = int(request.args.get('after', 0))
+  except ValueError:
+    abort(400)
+
+  return Response(
+    stream_with_context(export(kind, format, after)),
+    mimetype=FORMATS[format],
+    headers={'Content-Disposition': 'attachment; filename=%s.%s' % (kind, format)}
+  )
+
+#  Debug
+#  ----------------------------------------------------------------
+
+@app.route('/_debug/pool')
+def pool_statistics():
+  # Connection pool state, for tuning the DB_POOL_* settings
+  if not app.config['DEBUG_ENDPOINTS']:
+    abort(404)
+
+  return jsonify(pool_stats(db.engine))
+
+@app.route('/_debug/metrics')
+def request_metrics():
+  # Request, SQL and template timings in the Prometheus text format
+  if not app.config['DEBUG_ENDPOINTS'] or not metrics.enabled:
+    abort(404)
+
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/_debug/logging')
+def logging_statistics():
+  # Log queue depth and the records dropped because it was full
+  if not app.config['DEBUG_ENDPOINTS']:
+    abort(404)
+
+  return jsonify(logs.stats())
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -498,17 +528,6 @@ def not_found_error(error):
 def server_error(error):
     return render_template('errors/500.html'), 500
 
-
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,489 @@
+#----------------------------------------------------------------------------#
+# ASGI entry point: uvicorn asgi:application
+#----------------------------------------------------------------------------#
+
+# Serves the read-heavy routes (home, venues, artists, shows, search and the
+# detail pages) with async handlers, so a slow query holds a coroutine rather
+# than a worker thread. Every other request, including all writes, goes to
+# the Flask app unchanged, run on a worker thread (ASGI_THREADS).
+#
+# On Postgres with asyncpg installed, the handlers build the same SQLAlchemy
+# queries as the WSGI routes and run them on an asyncpg pool (sized from
+# DB_POOL_SIZE + DB_MAX_OVERFLOW). Anywhere else they run those queries on
+# the SQLAlchemy engine in worker threads, which keeps the behaviour but
+# not the concurrency win.
+#
+# Pages share the page cache, keys and tags of the WSGI routes, and get the
+# same caching headers and 304s (http_cache.py). Flask's request hooks don't
+# run for them, so the request ID (logs.py) and metrics (metrics.py) are
+# handled here, in context variables that the worker threads inherit.
+# Requests carrying flashed messages, unknown ids and malformed cursors are
+# handed to Flask, which renders them exactly as it would in WSGI mode.
+
+import asyncio
+import contextvars
+import io
+import time
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import Response, render_template
+from sqlalchemy.dialects.postgresql import psycopg2 as pg_dialect
+
+from app import app
+from models import db, cache, metrics, Venue, Artist
+from metrics import current_record
+from logs import current_request_id, new_request_id
+from cache import page_key
+from listings import venue_rows, group_areas, recent_venues, artist_rows, \
+  show_page_query, paginate_shows, decode_show_cursor
+from details import detail_queries, build_detail, version_query
+from http_cache import not_modified, finish, validators
+from engine import numbered
+import facets
+import search
+
+POSTGRES = pg_dialect.dialect()
+
+_executor = None
+_database = None
+
+
+def executor():
+  global _executor
+  if _executor is None:
+    _executor = ThreadPoolExecutor(app.config['ASGI_THREADS'], thread_name_prefix='fyyur-asgi')
+  return _executor
+
+
+async def in_thread(fn, *args):
+  # fn(*args) on a worker thread, seeing this task's context variables
+  context = contextvars.copy_context()
+  return await asyncio.get_event_loop().run_in_executor(executor(), context.run, fn, *args)
+
+
+@lru_cache(maxsize=256)
+def _row_type(keys):
+  return namedtuple('Row', keys, rename=True)
+
+
+def _rows(keys, rows):
+  # Attribute- and index-addressable rows, whichever driver produced them
+  row = _row_type(tuple(keys))
+  return [row(*values) for values in rows]
+
+
+#  Databases
+#  ----------------------------------------------------------------
+
+class ThreadedDatabase(object):
+  # Runs queries on the app's SQLAlchemy engine in worker threads
+
+  # Search through search.py, which picks the index for the backend
+  sql_search = False
+
+  async def fetch(self, *queries):
+    # The rows of each query, in one trip to a worker thread
+    return await self.call(self._fetch, queries)
+
+  def _fetch(self, queries):
+    results = []
+    for query in queries:
+      result = db.session.execute(getattr(query, 'statement', query))
+      results.append(_rows(result.keys(), result))
+    return results
+
+  async def call(self, fn, *args):
+    # fn(*args) in a worker thread with an app context
+    def run():
+      with app.app_context():
+        return fn(*args)
+    return await in_thread(run)
+
+  async def close(self):
+    pass
+
+
+class AsyncpgDatabase(ThreadedDatabase):
+  # Runs queries on an asyncpg pool, compiled for Postgres
+
+  sql_search = True
+
+  def __init__(self, url):
+    self.url = url
+    self.pool = None
+
+  async def _pool(self):
+    import asyncpg
+
+    if self.pool is None:
+      config = app.config
+      settings = {}
+      if config['DB_STATEMENT_TIMEOUT']:
+        settings['statement_timeout'] = str(config['DB_STATEMENT_TIMEOUT'])
+
+      self.pool = await asyncpg.create_pool(
+        re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://', self.url),
+        min_size=1,
+        max_size=(config['DB_POOL_SIZE'] or 5) + (config['DB_MAX_OVERFLOW'] or 10),
+        server_settings=settings
+      )
+    return self.pool
+
+  async def fetch(self, *queries):
+    pool = await self._pool()
+    results = []
+    record = current_record.get()
+    async with pool.acquire() as connection:
+      for query in queries:
+        statement, args = compile_query(query)
+        started = time.perf_counter()
+        records = await connection.fetch(statement, *args)
+        if record is not None:
+          # No engine events on this path; count the statement here
+          record.sql_time += time.perf_counter() - started
+          record.statements[statement] += 1
+        results.append(_rows(records[0].keys() if records else (), records))
+    return results
+
+  async def close(self):
+    if self.pool is not None:
+      await self.pool.close()
+      self.pool = None
+
+
+def compile_query(query):
+  # A Query or Core statement as asyncpg SQL ($n placeholders) and arguments
+  compiled = getattr(query, 'statement', query).compile(dialect=POSTGRES)
+  statement, names = numbered(str(compiled))
+  return statement, [compiled.params[name] for name in names]
+
+
+def database():
+  # Chosen on first use, once the database URI is final
+  global _database
+  if _database is None:
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    _database = ThreadedDatabase()
+    if url.startswith('postgres'):
+      try:
+        import asyncpg  # noqa
+        _database = AsyncpgDatabase(url)
+      except ImportError:
+        pass
+  return _database
+
+
+#  Read routes
+#  ----------------------------------------------------------------
+
+# Each returns (template, context, extra cache tags), or None to let Flask
+# answer the request instead
+
+async def index(request):
+  with app.app_context():
+    query = recent_venues()
+  venues, = await database().fetch(query)
+
+  return 'pages/home.html', {'venues': venues}, ()
+
+
+async def venues(request):
+  filters = facets.parse(request.args)
+  with app.app_context():
+    query = venue_rows(filters=filters)
+  rows, = await database().fetch(query)
+  counts = await database().call(facets.browse, 'venues', filters)
+
+  return 'pages/venues.html', {'areas': group_areas(rows), 'facets': counts}, ()
+
+
+async def artists(request):
+  filters = facets.parse(request.args)
+  with app.app_context():
+    query = artist_rows(filters=filters)
+  rows, = await database().fetch(query)
+  counts = await database().call(facets.browse, 'artists', filters)
+
+  return 'pages/artists.html', {'artists': rows, 'facets': counts}, ()
+
+
+async def shows(request):
+  upcoming = request.args.get('upcoming', type=int, default=0) == 1
+  try:
+    after = request.args.get('after')
+    after = decode_show_cursor(after) if after else None
+  except ValueError:
+    return None
+
+  with app.app_context():
+    query = show_page_query(after=after, upcoming=upcoming)
+  rows, = await database().fetch(query)
+  data, next_cursor = paginate_shows(rows)
+
+  tags = ['venue:%d' % show.venue_id for show in data] + ['artist:%d' % show.artist_id for show in data]
+  return 'pages/shows.html', {'shows': data, 'next_cursor': next_cursor, 'upcoming': upcoming}, tags
+
+
+async def _detail(kind, entity_id):
+  with app.app_context():
+    queries = detail_queries(kind, entity_id)
+  entity, genres, upcoming, past = await database().fetch(*queries)
+  if not entity:
+    return None
+
+  return build_detail(kind, entity[0]._asdict(), [row.name for row in genres], upcoming, past)
+
+
+async def show_venue(request, venue_id):
+  data = await _detail('venue', int(venue_id))
+  if data is None:
+    return None
+
+  tags = ['artist:%d' % show['artist_id'] for show in data['upcoming_shows'] + data['past_shows']]
+  return 'pages/show_venue.html', {'venue': data}, tags
+
+
+async def show_artist(request, artist_id):
+  data = await _detail('artist', int(artist_id))
+  if data is None:
+    return None
+
+  tags = ['venue:%d' % show['venue_id'] for show in data['upcoming_shows'] + data['past_shows']]
+  return 'pages/show_artist.html', {'artist': data}, tags
+
+
+async def _search(model, search_term):
+  if not database().sql_search:
+    find = search.search_venues if model is Venue else search.search_artists
+    return await database().call(find, search_term)
+
+  with app.app_context():
+    queries = search.search_queries(model, search_term.strip())
+  count, rows = await database().fetch(*queries)
+  return {'count': count[0][0], 'data': rows}
+
+
+async def search_venues(request):
+  search_term = request.form.get('search_term', '')
+  response = await _search(Venue, search_term)
+
+  return 'pages/search_venues.html', {'results': response, 'search_term': search_term}, ()
+
+
+async def search_artists(request):
+  search_term = request.form.get('search_term', '')
+  response = await _search(Artist, search_term)
+
+  return 'pages/search_artists.html', {'results': response, 'search_term': search_term}, ()
+
+
+# (methods, path, handler, page cache tags or None for uncached pages,
+# version query or None); tags may name path arguments like cache.cached()'s
+ROUTES = [
+  (('GET',), r'/', index, ('venues',), None),
+  (('GET',), r'/venues', venues, ('venues', 'shows'), None),
+  (('GET', 'POST'), r'/venues/search', search_venues, None, None),
+  (('GET',), r'/venues/(?P<venue_id>\d+)', show_venue, ('venue:{venue_id}',),
+    lambda venue_id: version_query('venue', int(venue_id))),
+  (('GET',), r'/artists', artists, ('artists',), None),
+  (('GET', 'POST'), r'/artists/search', search_artists, None, None),
+  (('GET',), r'/artists/(?P<artist_id>\d+)', show_artist, ('artist:{artist_id}',),
+    lambda artist_id: version_query('artist', int(artist_id))),
+  (('GET',), r'/shows', shows, ('shows',), None),
+]
+
+ROUTES = [(methods, re.compile(path + '$'), handler, tags, version) for methods, path, handler, tags, version in ROUTES]
+
+
+async def render_page(environ, request, handler, kwargs, tags, version=None):
+  # The page's HTML, from the page cache when possible (under its version's
+  # ETag, as in cache.cached()); None to defer to Flask
+  key = page_key(request.full_path, validators(version)[0] if version is not None else None)
+  if tags is not None:
+    page = cache.backend.get(key)
+    if page is not None:
+      return page
+
+  result = await handler(request, **kwargs)
+  if result is None:
+    return None
+
+  template, context, more_tags = result
+  with app.request_context(environ):
+    page = render_template(template, **context)
+
+  if tags is not None:
+    tags = set(tag.format(**kwargs) for tag in tags) | set(more_tags)
+    cache.backend.set(key, page, app.config['CACHE_DEFAULT_TTL'], tags)
+  return page
+
+
+#  ASGI <-> WSGI
+#  ----------------------------------------------------------------
+
+async def read_body(receive):
+  body = []
+  more = True
+  while more:
+    message = await receive()
+    body.append(message.get('body', b''))
+    more = message.get('more_body', False)
+  return b''.join(body)
+
+
+def wsgi_environ(scope, body):
+  server = scope.get('server') or ('localhost', 80)
+  client = scope.get('client') or ('', 0)
+  environ = {
+    'REQUEST_METHOD': scope['method'],
+    'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+    'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+    'QUERY_STRING': scope['query_string'].decode('latin-1'),
+    'SERVER_NAME': server[0],
+    'SERVER_PORT': str(server[1]),
+    'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+    'REMOTE_ADDR': client[0],
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': scope.get('scheme', 'http'),
+    'wsgi.input': io.BytesIO(body),
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': True,
+    'wsgi.multiprocess': True,
+    'wsgi.run_once': False
+  }
+
+  for name, value in scope.get('headers', ()):
+    name = name.decode('latin-1').upper().replace('-', '_')
+    if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+      name = 'HTTP_' + name
+    value = value.decode('latin-1')
+    environ[name] = environ[name] + ',' + value if name in environ else value
+
+  # The body has been read in full, whether or not the client said how long
+  environ['CONTENT_LENGTH'] = str(len(body))
+  return environ
+
+
+def _start(status, headers):
+  return {
+    'type': 'http.response.start',
+    'status': int(status.split(' ', 1)[0]),
+    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+  }
+
+
+async def send_response(response, send):
+  body = response.get_data()
+  await send(_start(response.status, response.headers.to_wsgi_list()))
+  await send({'type': 'http.response.body', 'body': body})
+
+
+async def call_wsgi(environ, send):
+  # Run the Flask app on a worker thread, streaming its body back as the
+  # iterable yields it (exports stay streamed)
+  loop = asyncio.get_event_loop()
+
+  def emit(message):
+    asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+  def run():
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+      response[:] = [status, headers]
+
+    body = app(environ, start_response)
+    try:
+      started = False
+      for chunk in body:
+        if not started:
+          emit(_start(*response))
+          started = True
+        if chunk:
+          emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+      if not started:
+        emit(_start(*response))
+      emit({'type': 'http.response.body', 'body': b''})
+    finally:
+      if hasattr(body, 'close'):
+        body.close()
+
+  await loop.run_in_executor(executor(), run)
+
+
+async def lifespan(receive, send):
+  while True:
+    message = await receive()
+    if message['type'] == 'lifespan.startup':
+      await send({'type': 'lifespan.startup.complete'})
+    elif message['type'] == 'lifespan.shutdown':
+      if _database is not None:
+        await _database.close()
+      await send({'type': 'lifespan.shutdown.complete'})
+      return
+
+
+async def application(scope, receive, send):
+  if scope['type'] == 'lifespan':
+    return await lifespan(receive, send)
+  if scope['type'] != 'http':
+    return
+
+  environ = wsgi_environ(scope, await read_body(receive))
+
+  for methods, pattern, handler, tags, version in ROUTES:
+    match = pattern.match(scope['path'])
+    if match is None or scope['method'] not in methods:
+      continue
+
+    request = app.request_class(environ)
+    # Flashed messages live in the session and are rendered by Flask
+    session = app.session_interface.open_session(app, request)
+    if session and '_flashes' in session:
+      break
+
+    # What Flask's request hooks would do: the request ID and metrics
+    request_id = new_request_id(request.headers.get('X-Request-ID', ''))
+    current_request_id.set(request_id)
+    record = metrics.begin()
+    current_record.set(record)
+
+    def finish_request(response):
+      response.headers['X-Request-ID'] = request_id
+      if record is None:
+        return response
+      current_record.set(None)
+      return metrics.finish(record, handler.__name__, scope['method'], response)
+
+    # Versioned pages are revalidated before they are looked up or rendered
+    current = None
+    if version is not None and scope['method'] == 'GET':
+      with app.app_context():
+        query = version(**match.groupdict())
+      rows, = await database().fetch(query)
+      current = rows[0] if rows else None
+      if current is not None:
+        response = not_modified(request, current)
+        if response is not None:
+          await send_response(finish_request(response), send)
+          return
+
+    page = await render_page(environ, request, handler, match.groupdict(), tags, current)
+    if page is None:
+      # Flask answers, with its own request ID and metrics
+      current_request_id.set(None)
+      current_record.set(None)
+      break
+
+    response = Response(page, mimetype='text/html')
+    if scope['method'] == 'GET':
+      with app.app_context():
+        response = finish(response, request, current)
+    await send_response(finish_request(response), send)
+    return
+
+  await call_wsgi(environ, send)
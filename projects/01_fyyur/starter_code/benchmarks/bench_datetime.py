@@ -0,0 +1,68 @@
+# Micro-benchmark the Jinja `datetime` filter.
+#
+#   python benchmarks/bench_datetime.py [--calls 20000]
+#
+# "legacy" is the previous filter (str() -> dateutil -> babel with a pattern
+# string), "babel" is the babel.dates.format_datetime() call on its own and
+# "compiled" is formatting.format_datetime(). Each is timed over distinct
+# timestamps (cold) and over a page's worth of repeats (warm).
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import synthetic  # noqa: puts the app modules on sys.path
+import babel.dates
+import dateutil.parser
+
+import formatting
+
+
+def legacy_format_datetime(value, format='medium'):
+  value = str(value)
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format)
+
+
+def babel_format_datetime(value, format='medium'):
+  return babel.dates.format_datetime(value, formatting.PATTERNS[format])
+
+
+def per_call_us(fn, values):
+  start = time.perf_counter()
+  for value in values:
+    fn(value, 'full')
+  return (time.perf_counter() - start) / len(values) * 1e6
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Micro-benchmark the datetime filter')
+  parser.add_argument('--calls', type=int, default=20000)
+  args = parser.parse_args()
+
+  base = datetime(2035, 4, 1, 20, 0)
+  cold = [base + timedelta(minutes=i) for i in range(args.calls)]
+  warm = [base + timedelta(days=i % 30) for i in range(args.calls)]
+
+  print('%10s %14s %14s' % ('', 'cold (us/call)', 'warm (us/call)'))
+
+  try:
+    legacy = (per_call_us(legacy_format_datetime, cold), per_call_us(legacy_format_datetime, warm))
+    print('%10s %14.2f %14.2f' % (('legacy',) + legacy))
+  except Exception as e:
+    print('%10s %29s' % ('legacy', 'failed: %s' % type(e).__name__))
+
+  plain = (per_call_us(babel_format_datetime, cold), per_call_us(babel_format_datetime, warm))
+  print('%10s %14.2f %14.2f' % (('babel',) + plain))
+
+  formatting._format.cache_clear()
+  compiled = (per_call_us(formatting.format_datetime, cold), per_call_us(formatting.format_datetime, warm))
+  print('%10s %14.2f %14.2f' % (('compiled',) + compiled))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,65 @@
+# Benchmark the streaming exports over 1M synthetic shows, tracking peak RSS.
+#
+#   python benchmarks/bench_export.py [--shows 1000000] [--legacy]
+#
+# Each format is streamed through the /export route and drained chunk by
+# chunk, the way a client downloading it would. Peak RSS is the process
+# high-water mark, so it only ever grows: a flat column means the export ran
+# in constant memory. --legacy finishes with Show.query.all(), the
+# materialize-everything approach, for comparison.
+
+import argparse
+import resource
+import time
+
+from synthetic import use_database, seed
+from models import app, db, Show
+import app as routes  # registers the /export routes
+
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def drain(path):
+  size = 0
+  with app.test_client() as client:
+    response = client.get(path, buffered=False)
+    for chunk in response.response:
+      size += len(chunk)
+    response.close()
+  return size
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the streaming exports')
+  parser.add_argument('--shows', type=int, default=1000000)
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--legacy', action='store_true')
+  args = parser.parse_args()
+
+  use_database()
+  seed(venues=args.venues, artists=args.venues, shows=args.shows)
+  db.session.remove()
+
+  print('seeded %d shows, peak RSS %.1f MB' % (args.shows, peak_rss_mb()))
+  print('%-26s %10s %10s %12s %14s' % ('export', 'time (s)', 'MB out', 'rows/s', 'peak RSS (MB)'))
+
+  for path in ('/export/shows.csv', '/export/shows.ndjson', '/export/shows.ndjson?after=%d' % (args.shows // 2)):
+    start = time.perf_counter()
+    size = drain(path)
+    elapsed = time.perf_counter() - start
+    rows = args.shows - args.shows // 2 if 'after' in path else args.shows
+    print('%-26s %10.2f %10.1f %12.0f %14.1f' % (
+      path.split('/')[-1], elapsed, size / 1e6, rows / elapsed, peak_rss_mb()))
+
+  if args.legacy:
+    start = time.perf_counter()
+    rows = len(Show.query.all())
+    elapsed = time.perf_counter() - start
+    print('%-26s %10.2f %10s %12.0f %14.1f' % ('Show.query.all()', elapsed, '-', rows / elapsed, peak_rss_mb()))
+
+
+if __name__ == '__main__':
+  main()
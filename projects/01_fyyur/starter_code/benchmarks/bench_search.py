@@ -0,0 +1,49 @@
+# Benchmark venue name search latency.
+#
+#   python benchmarks/bench_search.py [--sizes 10000 100000 1000000]
+#
+# On SQLite this measures the in-process trigram index in search.py; with
+# BENCH_DATABASE_URL pointing at Postgres it measures the pg_trgm indexes
+# (run the migrations against that database first).
+
+import argparse
+import time
+
+from synthetic import use_database, seed
+from models import db
+import search
+
+TERMS = ['Venue 4242', 'enue 99', 'Venue 1', '777', 'no such venue']
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark venue name search')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+  parser.add_argument('--repeat', type=int, default=20)
+  args = parser.parse_args()
+
+  print('%10s %16s %10s %12s %12s' % ('venues', 'term', 'matches', 'first (ms)', 'median (ms)'))
+
+  for size in args.sizes:
+    use_database()
+    seed(venues=size)
+
+    for term in TERMS:
+      start = time.perf_counter()
+      result = search.search_venues(term)
+      first = time.perf_counter() - start
+
+      timings = []
+      for _ in range(args.repeat):
+        start = time.perf_counter()
+        search.search_venues(term)
+        timings.append(time.perf_counter() - start)
+        db.session.remove()
+      timings.sort()
+
+      print('%10d %16s %10d %12.2f %12.2f' % (
+        size, repr(term), result['count'], first * 1000, timings[len(timings) // 2] * 1000))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,83 @@
+# Benchmark the /venues area listing at 1k, 10k and 100k venues.
+#
+#   python benchmarks/bench_venues.py [--sizes 1000 10000 100000] [--legacy-max 10000]
+#
+# "legacy" is the previous implementation (load every venue, then rescan the
+# list once per city in Python); "grouped" is listings.venue_areas().
+
+import argparse
+import time
+
+from synthetic import use_database, seed
+from models import app, db, Venue
+from listings import venue_areas
+import app as routes  # registers the Fyyur routes for the render column
+
+
+def legacy_areas():
+  venues = Venue.query.all()
+
+  cities = []
+  areas = []
+
+  for venue in venues:
+    cities.append((venue.city, venue.state))
+    cities = list(set(cities))
+
+  for city in cities:
+    city_obj = {'city': city[0], 'state': city[1], 'venues': []}
+    areas.append(city_obj)
+
+    for venue in venues:
+      if city[0] == venue.city:
+        city_obj['venues'].append({'id': venue.id, 'name': venue.name})
+
+  return areas
+
+
+def timed(fn, repeat):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+    db.session.remove()
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark the /venues area listing')
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+  parser.add_argument('--legacy-max', type=int, default=10000,
+    help='skip the legacy implementation above this many venues')
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  print('%10s %10s %12s %12s %10s' % ('venues', 'areas', 'legacy (s)', 'grouped (s)', 'render (s)'))
+
+  for size in args.sizes:
+    use_database()
+    seed(venues=size, artists=max(1, size // 10), shows=size)
+
+    areas = sum(1 for _ in venue_areas())
+    grouped = timed(lambda: list(venue_areas()), args.repeat)
+
+    legacy = None
+    if size <= args.legacy_max:
+      legacy = timed(legacy_areas, args.repeat)
+
+    with app.test_client() as client:
+      render = timed(lambda: client.get('/venues').data, args.repeat)
+
+    print('%10d %10d %12s %12.4f %10.4f' % (
+      size,
+      areas,
+      '%.4f' % legacy if legacy is not None else 'skipped',
+      grouped,
+      render
+    ))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,148 @@
+# Load-test Fyyur's read routes with N concurrent clients.
+#
+#   python benchmarks/load_test.py [--clients 1 8 32] [--duration 10]
+#   python benchmarks/load_test.py --mode both   # WSGI vs ASGI (needs uvicorn)
+#   python benchmarks/load_test.py --url http://localhost:5000 --clients 16
+#
+# Without --url the app is served in-process over synthetic data (SQLite, or
+# BENCH_DATABASE_URL), with the page cache off so every request reaches the
+# database: on a threaded WSGI server (--mode wsgi), on uvicorn through
+# asgi.py (--mode asgi), or both in turn on the same data. The async driver
+# is only used on Postgres with asyncpg installed; on SQLite the ASGI mode
+# runs its queries in threads. The DB_POOL_* environment settings apply as
+# usual. Reports throughput, latency percentiles and pool stats.
+
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from synthetic import use_database, seed
+from models import app, db
+
+PATHS = ['/', '/venues', '/artists', '/shows', '/venues/1', '/artists/1']
+
+
+def percentile(timings, p):
+  if not timings:
+    return 0.0
+  return timings[min(len(timings) - 1, int(len(timings) * p / 100.0))]
+
+
+def run(base_url, clients, duration, paths):
+  timings = []
+  errors = [0]
+  lock = threading.Lock()
+  deadline = time.perf_counter() + duration
+
+  def client(offset):
+    mine = []
+    failed = 0
+    i = offset
+    while time.perf_counter() < deadline:
+      path = paths[i % len(paths)]
+      i += 1
+      start = time.perf_counter()
+      try:
+        urlopen(base_url + path).read()
+      except (HTTPError, OSError):
+        failed += 1
+        continue
+      mine.append(time.perf_counter() - start)
+    with lock:
+      timings.extend(mine)
+      errors[0] += failed
+
+  threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+  started = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.perf_counter() - started
+
+  timings.sort()
+  return {
+    'requests': len(timings),
+    'errors': errors[0],
+    'rps': len(timings) / elapsed,
+    'p50': percentile(timings, 50) * 1000,
+    'p99': percentile(timings, 99) * 1000
+  }
+
+
+def serve():
+  # Threaded WSGI server on a free local port; returns its base URL
+  from werkzeug.serving import make_server
+  import app as routes  # registers the Fyyur routes
+
+  logging.getLogger('werkzeug').setLevel(logging.ERROR)
+  server = make_server('127.0.0.1', 0, app, threaded=True)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return 'http://127.0.0.1:%d' % server.server_port
+
+
+def serve_asgi():
+  # uvicorn running asgi.application on a free local port; returns its base URL
+  try:
+    import uvicorn
+  except ImportError:
+    raise SystemExit('--mode asgi needs uvicorn (pip install uvicorn)')
+  import asgi
+
+  with socket.socket() as probe:
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+
+  server = uvicorn.Server(uvicorn.Config(asgi.application, host='127.0.0.1', port=port, log_level='error'))
+  thread = threading.Thread(target=server.run)
+  thread.daemon = True
+  thread.start()
+  while not server.started:
+    time.sleep(0.05)
+  return 'http://127.0.0.1:%d' % port
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Load-test the Fyyur read routes')
+  parser.add_argument('--url', help='test an already running server instead')
+  parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='wsgi')
+  parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+  parser.add_argument('--duration', type=float, default=10)
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--paths', nargs='+', default=PATHS)
+  args = parser.parse_args()
+
+  if args.url:
+    servers = [('url', args.url)]
+  else:
+    app.config['CACHE_TYPE'] = 'null'
+    app.config['DEBUG_ENDPOINTS'] = True
+    use_database()
+    seed(venues=args.venues, artists=args.venues, shows=args.venues * 5)
+    db.session.remove()
+
+    modes = ['wsgi', 'asgi'] if args.mode == 'both' else [args.mode]
+    servers = [(mode, serve() if mode == 'wsgi' else serve_asgi()) for mode in modes]
+
+  print('%6s %8s %10s %8s %10s %10s %10s' % ('mode', 'clients', 'requests', 'errors', 'req/s', 'p50 (ms)', 'p99 (ms)'))
+  for mode, base_url in servers:
+    for clients in args.clients:
+      result = run(base_url, clients, args.duration, args.paths)
+      print('%6s %8d %10d %8d %10.1f %10.2f %10.2f' % (
+        mode, clients, result['requests'], result['errors'], result['rps'], result['p50'], result['p99']))
+
+    try:
+      print('%6s pool: %s' % (mode, json.loads(urlopen(base_url + '/_debug/pool').read().decode('utf-8'))))
+    except (HTTPError, OSError):
+      pass
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,113 @@
+# Synthetic Fyyur data shared by the benchmark scripts in this folder.
+#
+# Benchmarks run against BENCH_DATABASE_URL when it is set (e.g. a scratch
+# Postgres database) and against a throwaway SQLite file otherwise.
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from itertools import islice
+
+# Let `python benchmarks/<script>.py` import the app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import app, db, Venue, Artist, Show, Genre, venue_genres, artist_genres
+import counters
+
+STATES = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'MA', 'CO', 'OR', 'GA']
+GENRES = ['Jazz', 'Reggae', 'Swing', 'Classical', 'Folk', 'R&B', 'Hip-Hop', 'Rock n Roll']
+
+INSERT_BATCH_SIZE = 10000
+
+
+def use_database(uri=None):
+  # Point the app at a fresh, empty benchmark database
+  if uri is None:
+    uri = os.environ.get('BENCH_DATABASE_URL')
+  if uri is None:
+    path = os.path.join(tempfile.mkdtemp(prefix='fyyur-bench-'), 'fyyur.db')
+    uri = 'sqlite:///' + path
+
+  app.config['SQLALCHEMY_DATABASE_URI'] = uri
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+  db.drop_all()
+  db.create_all()
+
+  return uri
+
+
+def _insert(table, rows):
+  # rows may be a generator; only one batch is held in memory at a time
+  rows = iter(rows)
+  batch = list(islice(rows, INSERT_BATCH_SIZE))
+  while batch:
+    db.session.execute(table.insert(), batch)
+    batch = list(islice(rows, INSERT_BATCH_SIZE))
+  db.session.commit()
+
+
+def seed(venues=0, artists=0, shows=0, cities=None, seed=0):
+  # Insert the requested number of rows with ids 1..n, spread over roughly
+  # sqrt(venues) cities and half past / half upcoming shows
+  rng = random.Random(seed)
+  cities = cities or max(1, int(venues ** 0.5))
+  now = datetime.now()
+
+  _insert(Genre.__table__, (
+    {'id': i, 'name': name} for i, name in enumerate(GENRES, 1)
+  ))
+
+  _insert(Venue.__table__, (
+    {
+      'id': i,
+      'name': 'Venue %d' % i,
+      'city': 'City %d' % (i % cities),
+      'state': STATES[i % len(STATES)],
+      'address': '%d Main Street' % i,
+      'phone': '555-000-%04d' % (i % 10000),
+      'seeking_talent': i % 2 == 0
+    }
+    for i in range(1, venues + 1)
+  ))
+
+  _insert(Artist.__table__, (
+    {
+      'id': i,
+      'name': 'Artist %d' % i,
+      'city': 'City %d' % (i % cities),
+      'state': STATES[i % len(STATES)],
+      'phone': '555-100-%04d' % (i % 10000),
+      'seeking_venue': i % 3 == 0
+    }
+    for i in range(1, artists + 1)
+  ))
+
+  # Two genres per venue and artist
+  _insert(venue_genres, (
+    {'venue_id': i, 'genre_id': genre_id}
+    for i in range(1, venues + 1)
+    for genre_id in rng.sample(range(1, len(GENRES) + 1), 2)
+  ))
+
+  _insert(artist_genres, (
+    {'artist_id': i, 'genre_id': genre_id}
+    for i in range(1, artists + 1)
+    for genre_id in rng.sample(range(1, len(GENRES) + 1), 2)
+  ))
+
+  if shows:
+    _insert(Show.__table__, (
+      {
+        'id': i,
+        'artist_id': rng.randint(1, artists),
+        'venue_id': rng.randint(1, venues),
+        'start_time': now + timedelta(hours=rng.randint(-24 * 365, 24 * 365))
+      }
+      for i in range(1, shows + 1)
+    ))
+
+  # Core inserts bypass the ORM events that maintain the show counters
+  counters.recount()
@@ -0,0 +1,227 @@
+#----------------------------------------------------------------------------#
+# Page and fragment cache.
+#----------------------------------------------------------------------------#
+
+# Rendered read pages are cached under their path and query string, and
+# every entry is tagged with the entities it shows ('venue:3', 'artists',
+# ...). Write handlers invalidate the tags they touch, which drops exactly
+# the pages that depend on them.
+#
+# CACHE_TYPE picks the backend: 'memory' (per process, LRU with TTL),
+# 'redis' (shared; CACHE_REDIS_URL, or any Redis-compatible client passed to
+# init_app) or 'null' (disabled).
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, session
+
+
+def page_key(full_path, version=None):
+  # Page cache key of a path and query string, at a version (an ETag)
+  key = 'page:' + full_path
+  return key + '@' + version if version else key
+
+
+class NullBackend(object):
+  # Caches nothing
+
+  def get(self, key):
+    return None
+
+  def set(self, key, value, ttl, tags=()):
+    pass
+
+  def invalidate(self, tags):
+    pass
+
+  def clear(self):
+    pass
+
+
+class MemoryBackend(object):
+  # In-process LRU cache with per-entry expiry and a tag -> keys index
+
+  def __init__(self, max_entries=1024):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.tags = {}
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+
+      expires, value, tags = entry
+      if expires is not None and expires <= time.time():
+        self._remove(key)
+        return None
+
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl, tags=()):
+    with self.lock:
+      if key in self.entries:
+        self._remove(key)
+
+      expires = time.time() + ttl if ttl else None
+      self.entries[key] = (expires, value, tuple(tags))
+      for tag in tags:
+        self.tags.setdefault(tag, set()).add(key)
+
+      while len(self.entries) > self.max_entries:
+        self._remove(next(iter(self.entries)))
+
+  def invalidate(self, tags):
+    with self.lock:
+      for tag in tags:
+        for key in list(self.tags.get(tag, ())):
+          self._remove(key)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.tags.clear()
+
+  def _remove(self, key):
+    _, _, tags = self.entries.pop(key)
+    for tag in tags:
+      keys = self.tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self.tags[tag]
+
+
+class RedisBackend(object):
+  # Shared cache on a Redis-compatible client (get/set/delete/sadd/smembers/
+  # expire). Tag sets live next to the entries and expire with them.
+
+  def __init__(self, client, prefix='fyyur:'):
+    self.client = client
+    self.prefix = prefix
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    if value is None:
+      return None
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+  def set(self, key, value, ttl, tags=()):
+    key = self.prefix + key
+    self.client.set(key, value, ex=ttl or None)
+    for tag in tags:
+      tag = self.prefix + 'tag:' + tag
+      self.client.sadd(tag, key)
+      if ttl:
+        self.client.expire(tag, ttl)
+
+  def invalidate(self, tags):
+    for tag in tags:
+      tag = self.prefix + 'tag:' + tag
+      keys = list(self.client.smembers(tag))
+      self.client.delete(tag, *keys)
+
+  def clear(self):
+    keys = list(self.client.scan_iter(self.prefix + '*'))
+    if keys:
+      self.client.delete(*keys)
+
+
+def _redis_client(url):
+  try:
+    import redis
+  except ImportError:
+    raise RuntimeError("CACHE_TYPE = 'redis' needs the redis package (pip install redis)")
+  return redis.from_url(url)
+
+
+class Cache(object):
+
+  def __init__(self, app=None, client=None):
+    self.app = None
+    self.client = client
+    self._backend = None
+    if app is not None:
+      self.init_app(app, client)
+
+  def init_app(self, app, client=None):
+    app.config.setdefault('CACHE_TYPE', 'memory')
+    app.config.setdefault('CACHE_DEFAULT_TTL', 300)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+    app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    self.app = app
+    self.client = client or self.client
+    self._backend = None
+
+  @property
+  def backend(self):
+    # Built on first use so settings changed after import still apply
+    if self._backend is None:
+      config = self.app.config
+      kind = config['CACHE_TYPE']
+      if kind == 'memory':
+        self._backend = MemoryBackend(config['CACHE_MAX_ENTRIES'])
+      elif kind == 'redis':
+        self._backend = RedisBackend(self.client or _redis_client(config['CACHE_REDIS_URL']))
+      elif kind == 'null':
+        self._backend = NullBackend()
+      else:
+        raise ValueError('Unknown CACHE_TYPE %r' % kind)
+    return self._backend
+
+  def tag(self, *tags):
+    # Add tags to the page being rendered by a @cached view
+    if 'cache_tags' in g:
+      g.cache_tags.update(tags)
+
+  def invalidate(self, *tags):
+    self.backend.invalidate(tags)
+
+  def clear(self):
+    self.backend.clear()
+
+  def fragment(self, key, render, tags=(), ttl=None):
+    # Cached result of render() under key, e.g. a rendered template fragment
+    # (None results aren't cached)
+    value = self.backend.get('fragment:' + key)
+    if value is None:
+      value = render()
+      if value is not None:
+        self.backend.set('fragment:' + key, value, ttl or self.app.config['CACHE_DEFAULT_TTL'], tags)
+    return value
+
+  def cached(self, *tags, **options):
+    # Cache a GET view's rendered page under its path and query string, and
+    # its version when @http_cache has one (g.page_version), so a page whose
+    # version moved on is rendered again rather than served under the new
+    # ETag. tags may name view arguments, e.g. 'venue:{venue_id}'; the view
+    # can add more while rendering with cache.tag().
+    ttl = options.get('ttl')
+
+    def decorator(view):
+      @wraps(view)
+      def wrapper(*args, **kwargs):
+        # Pages carrying a flashed message are one-off
+        if request.method != 'GET' or '_flashes' in session:
+          return view(*args, **kwargs)
+
+        key = page_key(request.full_path, g.get('page_version'))
+        page = self.backend.get(key)
+        if page is not None:
+          return page
+
+        g.cache_tags = set(tag.format(**kwargs) for tag in tags)
+        page = view(*args, **kwargs)
+        if isinstance(page, str):
+          self.backend.set(key, page, ttl or self.app.config['CACHE_DEFAULT_TTL'], g.cache_tags)
+        return page
+
+      return wrapper
+
+    return decorator
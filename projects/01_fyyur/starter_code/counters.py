@@ -0,0 +1,155 @@
+#----------------------------------------------------------------------------#
+# Upcoming/past show counters on Venue and Artist.
+#----------------------------------------------------------------------------#
+
+# Venue/Artist.upcoming_shows_count and past_shows_count let the listing and
+# search pages show counts without touching Shows. They are exact as of
+# ShowCounter.reconciled_at: a show counts as upcoming if it starts after
+# that time and as past otherwise.
+#
+# ORM writes to Show keep the counters current in the same flush (and so
+# the same transaction) through mapper events below; deleting a venue or
+# artist first discounts the shows the database is about to cascade away.
+# Bulk loads that bypass the ORM call count_shows() themselves.
+#
+# reconcile() (flask fyyur reconcile-counts, run periodically) then moves
+# the shows that have started since the last run from upcoming to past and
+# advances reconciled_at; recount() rebuilds every counter from scratch.
+
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import attributes
+
+from models import db, Venue, Artist, Show, ShowCounter
+
+shows = Show.__table__
+counter = ShowCounter.__table__
+
+# (counted table, its Shows foreign key)
+SIDES = [(Venue.__table__, shows.c.venue_id), (Artist.__table__, shows.c.artist_id)]
+
+
+def reconciled_at(connection, for_update=False):
+  # The counters' cut-off time. Writers lock it for share so a reconcile
+  # can't move it between classifying a show and counting it.
+  query = select([counter.c.reconciled_at]).where(counter.c.id == 1)
+  value = connection.execute(query.with_for_update(read=not for_update)).scalar()
+
+  if value is None:
+    # Nothing has been counted yet, so any cut-off is consistent
+    value = datetime.now()
+    connection.execute(counter.insert().values(id=1, reconciled_at=value))
+  return value
+
+
+def count_shows(connection, rows, delta=1):
+  # Add delta to the counters of the venues and artists of rows, given as
+  # (venue_id, artist_id, start_time). Shows without a start time are
+  # neither upcoming nor past.
+  since = reconciled_at(connection)
+  totals = Counter()
+
+  for venue_id, artist_id, start_time in rows:
+    if start_time is None:
+      continue
+    for (table, _), id in zip(SIDES, (venue_id, artist_id)):
+      totals[(table, id, start_time > since)] += delta
+
+  for (table, id, upcoming), n in totals.items():
+    if n:
+      column = table.c.upcoming_shows_count if upcoming else table.c.past_shows_count
+      connection.execute(table.update().where(table.c.id == id).values({column: column + n}))
+
+
+def reconcile(now=None):
+  # Move shows that started since the last run from upcoming to past, in
+  # one UPDATE per table; returns how many shows moved
+  now = now or datetime.now()
+  connection = db.session.connection()
+  since = reconciled_at(connection, for_update=True)
+  if now <= since:
+    return 0
+
+  started = and_(shows.c.start_time > since, shows.c.start_time <= now)
+  moved = connection.execute(select([func.count()]).select_from(shows).where(started)).scalar()
+
+  if moved:
+    for table, show_fk in SIDES:
+      n = select([func.count()]).where(and_(show_fk == table.c.id, started)).as_scalar()
+      connection.execute(
+        table.update()
+          .where(table.c.id.in_(select([show_fk]).where(started)))
+          .values(
+            upcoming_shows_count=table.c.upcoming_shows_count - n,
+            past_shows_count=table.c.past_shows_count + n
+          )
+      )
+
+  connection.execute(counter.update().where(counter.c.id == 1).values(reconciled_at=now))
+  db.session.commit()
+  return moved
+
+
+def recount(now=None):
+  # Rebuild every counter from Shows, as of now
+  now = now or datetime.now()
+  connection = db.session.connection()
+  reconciled_at(connection, for_update=True)
+
+  for table, show_fk in SIDES:
+    def n(when):
+      return select([func.count()]).where(and_(show_fk == table.c.id, when)).as_scalar()
+
+    connection.execute(table.update().values(
+      upcoming_shows_count=n(shows.c.start_time > now),
+      past_shows_count=n(shows.c.start_time <= now)
+    ))
+
+  connection.execute(counter.update().where(counter.c.id == 1).values(reconciled_at=now))
+  db.session.commit()
+
+
+#  Maintenance on ORM writes
+#  ----------------------------------------------------------------
+
+def _key(show):
+  return show.venue_id, show.artist_id, show.start_time
+
+
+@event.listens_for(Show, 'after_insert')
+def _show_inserted(mapper, connection, show):
+  count_shows(connection, [_key(show)])
+
+
+@event.listens_for(Show, 'after_delete')
+def _show_deleted(mapper, connection, show):
+  count_shows(connection, [_key(show)], -1)
+
+
+@event.listens_for(Show, 'after_update')
+def _show_updated(mapper, connection, show):
+  # The values before the flush, for the attributes it changed
+  before = []
+  for name, value in zip(('venue_id', 'artist_id', 'start_time'), _key(show)):
+    history = attributes.get_history(show, name)
+    before.append(history.deleted[0] if history.deleted else value)
+
+  if tuple(before) != _key(show):
+    count_shows(connection, [tuple(before)], -1)
+    count_shows(connection, [_key(show)])
+
+
+def _discount_cascade(show_fk):
+  # Before a venue/artist row goes, take its shows off the other side's
+  # counters; ON DELETE CASCADE removes them without ORM events
+  def before_delete(mapper, connection, target):
+    rows = connection.execute(
+      select([shows.c.venue_id, shows.c.artist_id, shows.c.start_time]).where(show_fk == target.id))
+    count_shows(connection, rows, -1)
+  return before_delete
+
+
+event.listen(Venue, 'before_delete', _discount_cascade(shows.c.venue_id))
+event.listen(Artist, 'before_delete', _discount_cascade(shows.c.artist_id))
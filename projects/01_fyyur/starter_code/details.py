@@ -0,0 +1,137 @@
+#----------------------------------------------------------------------------#
+# Detail page queries.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres
+
+
+def _columns(entity):
+  # Copy the column values into a plain dict so nothing is ever set on the
+  # ORM instance itself (and accidentally flushed back to the database)
+  return {column.key: getattr(entity, column.key) for column in entity.__table__.columns}
+
+
+# kind -> (model, genre association link, Shows foreign key, the other side
+# of its shows, that side's columns, and the keys they get on the page)
+DETAILS = {
+  'venue': (
+    Venue,
+    venue_genres.c.venue_id,
+    Show.venue_id,
+    Artist,
+    (Artist.id, Artist.name, Artist.image_link),
+    ('start_time', 'artist_id', 'artist_name', 'artist_image_link')
+  ),
+  'artist': (
+    Artist,
+    artist_genres.c.artist_id,
+    Show.artist_id,
+    Venue,
+    (Venue.id, Venue.name, Venue.image_link),
+    ('start_time', 'venue_id', 'venue_name', 'venue_image_link')
+  )
+}
+
+
+def _shows_query(kind, owner_id, upcoming, now):
+  # Shows for one venue/artist joined with the other side, split on
+  # start_time in SQL rather than in Python
+  _, _, owner, counterpart, columns, _ = DETAILS[kind]
+  when = Show.start_time > now if upcoming else Show.start_time <= now
+
+  return db.session.query(Show.start_time, *columns) \
+    .join(counterpart) \
+    .filter(owner == owner_id, when) \
+    .order_by(Show.start_time)
+
+
+def detail_queries(kind, entity_id, now=None):
+  # The page's queries run separately, for callers that execute them
+  # themselves: (entity, genre names, upcoming shows, past shows)
+  model, link, _, _, _, _ = DETAILS[kind]
+  now = now or datetime.now()
+
+  genres = db.session.query(Genre.name) \
+    .join(link.table, link.table.c.genre_id == Genre.id) \
+    .filter(link == entity_id) \
+    .order_by(Genre.name)
+
+  return (
+    model.query.filter(model.id == entity_id),
+    genres,
+    _shows_query(kind, entity_id, True, now),
+    _shows_query(kind, entity_id, False, now)
+  )
+
+
+def version_query(kind, entity_id, now=None):
+  # One row that changes whenever the page would: the entity's updated_at,
+  # its show and upcoming show counts (off the owner/start_time index) and
+  # the newest updated_at of the other side's names and images it shows
+  model, _, owner, counterpart, _, _ = DETAILS[kind]
+  now = now or datetime.now()
+
+  def shows(column, *criteria):
+    return db.session.query(column).select_from(Show).join(counterpart) \
+      .filter(owner == entity_id, *criteria).as_scalar()
+
+  return db.session.query(
+    model.updated_at,
+    shows(func.count(Show.id)),
+    shows(func.count(Show.id), Show.start_time > now),
+    shows(func.max(counterpart.updated_at))
+  ).filter(model.id == entity_id)
+
+
+def detail_version(kind, entity_id, now=None):
+  # The page's version row, or None if the entity doesn't exist
+  return version_query(kind, entity_id, now).first()
+
+
+def build_detail(kind, data, genres, upcoming_rows, past_rows):
+  # Page data from the entity's column values, its genre names and the
+  # rows of its upcoming and past shows
+  labels = DETAILS[kind][-1]
+  data['genres'] = genres
+
+  for key, rows in (('upcoming_shows', upcoming_rows), ('past_shows', past_rows)):
+    shows = [dict(zip(labels, row)) for row in rows]
+    data[key] = shows
+    data[key + '_count'] = len(shows)
+
+  return data
+
+
+def _load(kind, entity_id, now):
+  # The entity with its genres, then its upcoming and past shows each joined
+  # with the other side: three queries. None if it doesn't exist.
+  model = DETAILS[kind][0]
+  entity = model.query.options(joinedload(model.genres)).get(entity_id)
+  if entity is None:
+    return None
+
+  now = now or datetime.now()
+  return build_detail(
+    kind,
+    _columns(entity),
+    [genre.name for genre in entity.genres],
+    _shows_query(kind, entity.id, True, now).all(),
+    _shows_query(kind, entity.id, False, now).all()
+  )
+
+
+def load_venue(venue_id, now=None):
+  # Venue page data in exactly three queries: the venue with its genres,
+  # then its upcoming and past shows each joined with their artist.
+  # None if it doesn't exist.
+  return _load('venue', venue_id, now)
+
+
+def load_artist(artist_id, now=None):
+  # Artist page data in exactly three queries, mirroring load_venue()
+  return _load('artist', artist_id, now)
@@ -0,0 +1,100 @@
+#----------------------------------------------------------------------------#
+# Database engine and connection pool tuning.
+#----------------------------------------------------------------------------#
+
+# The settings come from the app config (see config.py, which reads them
+# from the environment) and are applied when Flask-SQLAlchemy creates the
+# engine, so a database URI changed after import (tests, benchmarks) still
+# gets options that suit it. In-memory and file SQLite databases keep
+# Flask-SQLAlchemy's own pool choice.
+
+import re
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
+# pyformat placeholders as written by SQLAlchemy for psycopg2
+PARAMETER = re.compile(r'%\(([^)]+)\)s')
+
+
+def pool_options(config):
+  options = {
+    'pool_pre_ping': config['DB_POOL_PRE_PING']
+  }
+  if config['DB_POOL_SIZE'] is not None:
+    options['pool_size'] = config['DB_POOL_SIZE']
+  if config['DB_MAX_OVERFLOW'] is not None:
+    options['max_overflow'] = config['DB_MAX_OVERFLOW']
+  if config['DB_POOL_RECYCLE'] is not None:
+    options['pool_recycle'] = config['DB_POOL_RECYCLE']
+  if config['DB_POOL_TIMEOUT'] is not None:
+    options['pool_timeout'] = config['DB_POOL_TIMEOUT']
+  return options
+
+
+def pool_stats(engine):
+  # Checked-in/out counts for QueuePool; other pools only describe themselves
+  pool = engine.pool
+  stats = {
+    'pool': type(pool).__name__,
+    'status': pool.status()
+  }
+  for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+    if hasattr(pool, name):
+      stats[name] = getattr(pool, name)()
+  return stats
+
+
+def numbered(statement):
+  # Rewrite a pyformat statement with Postgres' $1, $2, ... placeholders,
+  # as asyncpg takes them (see asgi.py). Returns (statement, parameter names
+  # in placeholder order).
+  names = []
+
+  def placeholder(match):
+    if match.group(1) not in names:
+      names.append(match.group(1))
+    return '$%d' % (names.index(match.group(1)) + 1)
+
+  return PARAMETER.sub(placeholder, statement).replace('%%', '%'), names
+
+
+def enforce_foreign_keys(engine):
+  # SQLite ignores REFERENCES (and so ON DELETE CASCADE) unless this pragma
+  # is set on every new connection
+  @event.listens_for(engine, 'connect')
+  def connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+class Database(SQLAlchemy):
+  # Flask-SQLAlchemy with the pool and timeout settings
+
+  def init_app(self, app):
+    app.config.setdefault('DB_POOL_SIZE', None)
+    app.config.setdefault('DB_MAX_OVERFLOW', None)
+    app.config.setdefault('DB_POOL_RECYCLE', None)
+    app.config.setdefault('DB_POOL_TIMEOUT', None)
+    app.config.setdefault('DB_POOL_PRE_PING', False)
+    app.config.setdefault('DB_STATEMENT_TIMEOUT', None)
+    super(Database, self).init_app(app)
+
+  def apply_driver_hacks(self, app, sa_url, options):
+    if sa_url.drivername != 'sqlite':
+      options.update(pool_options(app.config))
+
+    if sa_url.drivername.startswith('postgresql') and app.config['DB_STATEMENT_TIMEOUT']:
+      connect_args = options.setdefault('connect_args', {})
+      connect_args['options'] = '-c statement_timeout=%d' % app.config['DB_STATEMENT_TIMEOUT']
+
+    super(Database, self).apply_driver_hacks(app, sa_url, options)
+
+  def create_engine(self, sa_url, engine_opts):
+    engine = super(Database, self).create_engine(sa_url, engine_opts)
+
+    if engine.dialect.name == 'sqlite':
+      enforce_foreign_keys(engine)
+
+    return engine
@@ -0,0 +1,127 @@
+#----------------------------------------------------------------------------#
+# Streaming export: /export/<kind>.<csv|ndjson> and flask fyyur export.
+#----------------------------------------------------------------------------#
+
+# Rows are read in id order from a server-side cursor (stream_results),
+# EXPORT_BATCH_SIZE at a time, encoded and written out as they arrive, so
+# memory stays flat however large the table is. ?after=<id> (--after) exports
+# only rows with a greater id, for incremental exports: pass the last id of
+# the previous export.
+#
+# The output uses the same field names as the import files (see importer.py),
+# with genres as a list in NDJSON and ';'-separated in CSV.
+
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+import click
+from sqlalchemy import select
+
+from importer import fyyur_cli
+from listings import genre_names
+from models import db, Venue, Artist, Show, venue_genres, artist_genres
+
+# Rows fetched per round trip, and per genre lookup
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {
+  'csv': 'text/csv',
+  'ndjson': 'application/x-ndjson'
+}
+
+# kind -> (table, genre association link column or None)
+KINDS = {
+  'venues': (Venue.__table__, venue_genres.c.venue_id),
+  'artists': (Artist.__table__, artist_genres.c.artist_id),
+  'shows': (Show.__table__, None)
+}
+
+
+def export_columns(kind):
+  table, link = KINDS[kind]
+  columns = [column.key for column in table.columns]
+  if link is not None:
+    columns.append('genres')
+  return columns
+
+
+def export_rows(kind, after=0):
+  # Dicts for every row of kind with id > after, in id order
+  table, link = KINDS[kind]
+  query = select([table]).where(table.c.id > after).order_by(table.c.id)
+
+  result = db.session.connection() \
+    .execution_options(stream_results=True) \
+    .execute(query)
+
+  try:
+    batch = result.fetchmany(EXPORT_BATCH_SIZE)
+    while batch:
+      genres = genre_names(link, [row.id for row in batch]) if link is not None else {}
+
+      for row in batch:
+        record = dict(row)
+        if link is not None:
+          record['genres'] = genres.get(row.id, [])
+        yield record
+
+      batch = result.fetchmany(EXPORT_BATCH_SIZE)
+  finally:
+    result.close()
+
+
+def _value(value):
+  if isinstance(value, datetime):
+    return value.isoformat(sep=' ')
+  return value
+
+
+def encode_csv(kind, records):
+  # Header, then one CSV line per record
+  columns = export_columns(kind)
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+
+  def line(values):
+    writer.writerow(values)
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
+  yield line(columns)
+  for record in records:
+    values = [_value(record[column]) for column in columns]
+    if 'genres' in record:
+      values[-1] = ';'.join(record['genres'])
+    yield line(values)
+
+
+def encode_ndjson(kind, records):
+  for record in records:
+    yield json.dumps(dict((key, _value(value)) for key, value in record.items())) + '\n'
+
+
+def export(kind, format, after=0):
+  # The export as a stream of text chunks of up to EXPORT_BATCH_SIZE lines
+  encode = {'csv': encode_csv, 'ndjson': encode_ndjson}[format]
+  lines = encode(kind, export_rows(kind, after))
+
+  chunk = ''.join(islice(lines, EXPORT_BATCH_SIZE))
+  while chunk:
+    yield chunk
+    chunk = ''.join(islice(lines, EXPORT_BATCH_SIZE))
+
+
+@fyyur_cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.option('--format', 'format', type=click.Choice(sorted(FORMATS)), default='ndjson', show_default=True)
+@click.option('--after', type=int, default=0, help='Only export rows with a greater id.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write to (default: stdout).')
+def export_command(kind, format, after, output):
+  """Stream every venue, artist or show as CSV or NDJSON."""
+  for chunk in export(kind, format, after):
+    output.write(chunk)
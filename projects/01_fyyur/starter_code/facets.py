@@ -0,0 +1,255 @@
+#----------------------------------------------------------------------------#
+# Faceted browse: state, genre and seeking filters with option counts.
+#----------------------------------------------------------------------------#
+
+# /venues and /artists take ?state=, ?genre= and ?seeking= (1 or 0), each
+# repeatable: values of one facet are alternatives, different facets must
+# all match. Next to every option the page shows how many entities it would
+# leave, given the other facets' selections.
+#
+# The counts come from an in-process index per kind: for every facet value,
+# a bitmap (a Python int, bit n set for id n) of the entities having it.
+# Combining filters is OR within a facet and AND across facets, and an
+# option's count is the popcount of its bitmap ANDed with the other facets'
+# matches, all word-level operations with no database round trip. The rows
+# themselves are still read with the equivalent SQL (filter_query()), which
+# streams and uses the (genre_id, entity_id), state and seeking predicates
+# directly rather than feeding large id sets back as IN lists.
+#
+# Each index is built on first use with two queries and then updated as
+# ORM writes to venues and artists commit. Writes made by other processes
+# or outside the ORM (the bulk import) are picked up when it is rebuilt,
+# FACETS_MAX_AGE seconds after it was built or after invalidate().
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session
+
+from models import db, Venue, Artist, Genre, venue_genres, artist_genres
+
+# kind -> (model, genre association link, column of the seeking facet)
+KINDS = {
+  'venues': (Venue, venue_genres.c.venue_id, Venue.seeking_talent),
+  'artists': (Artist, artist_genres.c.artist_id, Artist.seeking_venue)
+}
+
+# (facet, label), in display order
+FACETS = [('state', 'State'), ('genre', 'Genre'), ('seeking', 'Seeking')]
+
+SEEKING = {'1': True, 'yes': True, 'true': True, '0': False, 'no': False, 'false': False}
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _bitmap(ids):
+  # An int with the bits of ids set, built in one pass
+  ids = list(ids)
+  if not ids:
+    return 0
+  bits = bytearray(max(ids) // 8 + 1)
+  for id in ids:
+    bits[id >> 3] |= 1 << (id & 7)
+  return int.from_bytes(bytes(bits), 'little')
+
+
+def _popcount(bitmap):
+  return bin(bitmap).count('1')
+
+
+def _values(kind, entity):
+  # facet -> the values an entity has
+  seeking = getattr(entity, KINDS[kind][2].key)
+  return {
+    'state': [entity.state] if entity.state else [],
+    'genre': [genre.name for genre in entity.genres],
+    'seeking': [bool(seeking)]
+  }
+
+
+class FacetIndex(object):
+  # facet -> value -> bitmap of the ids having it, plus every id
+
+  def __init__(self, postings, universe):
+    self.postings = postings
+    self.universe = universe
+    self.built_at = time.time()
+
+  @classmethod
+  def build(cls, kind):
+    model, link, seeking = KINDS[kind]
+    grouped = {'state': {}, 'genre': {}, 'seeking': {}}
+    ids = []
+
+    for id, state, wants in db.session.query(model.id, model.state, seeking):
+      ids.append(id)
+      if state:
+        grouped['state'].setdefault(state, []).append(id)
+      grouped['seeking'].setdefault(bool(wants), []).append(id)
+
+    names = db.session.query(link, Genre.name).join(Genre, Genre.id == link.table.c.genre_id)
+    for id, name in names:
+      grouped['genre'].setdefault(name, []).append(id)
+
+    postings = dict(
+      (facet, dict((value, _bitmap(members)) for value, members in values.items()))
+      for facet, values in grouped.items()
+    )
+    return cls(postings, _bitmap(ids))
+
+  def remove(self, id):
+    bit = 1 << id
+    self.universe &= ~bit
+    for values in self.postings.values():
+      for value, bitmap in values.items():
+        if bitmap & bit:
+          values[value] = bitmap ^ bit
+
+  def add(self, id, values):
+    bit = 1 << id
+    self.universe |= bit
+    for facet, members in values.items():
+      postings = self.postings[facet]
+      for value in members:
+        postings[value] = postings.get(value, 0) | bit
+
+  def match(self, filters, skip=None):
+    # Bitmap of the ids matching every facet of filters but skip
+    matched = self.universe
+    for facet, values in filters.items():
+      if facet != skip:
+        postings = self.postings[facet]
+        union = 0
+        for value in values:
+          union |= postings.get(value, 0)
+        matched &= union
+    return matched
+
+
+def index(kind):
+  # The kind's index, built (again) if missing or too old
+  current = _indexes.get(kind)
+  if current is None or time.time() - current.built_at > current_app.config['FACETS_MAX_AGE']:
+    current = FacetIndex.build(kind)
+    with _lock:
+      _indexes[kind] = current
+  return current
+
+
+def invalidate(*kinds):
+  # Rebuild on next use, e.g. after writes that bypass the ORM
+  with _lock:
+    for kind in kinds or list(_indexes):
+      _indexes.pop(kind, None)
+
+
+def parse(args):
+  # facet -> selected values from request arguments; unknown values of
+  # ?seeking= are ignored
+  filters = {}
+  for facet, _ in FACETS:
+    values = [value for value in args.getlist(facet) if value]
+    if facet == 'seeking':
+      values = [SEEKING[value.lower()] for value in values if value.lower() in SEEKING]
+    if values:
+      filters[facet] = list(dict.fromkeys(values))
+  return filters
+
+
+def _arg(facet, value):
+  if facet == 'seeking':
+    return '1' if value else '0'
+  return value
+
+
+def browse(kind, filters):
+  # How many entities match filters, and each facet's options with their
+  # counts and the request arguments that toggle them
+  current = index(kind)
+  facets = []
+
+  for facet, label in FACETS:
+    base = current.match(filters, skip=facet)
+    selected = filters.get(facet, [])
+    options = []
+
+    postings = current.postings[facet]
+    for value in list(postings) + [value for value in selected if value not in postings]:
+      count = _popcount(base & postings.get(value, 0))
+      if not count and value not in selected:
+        continue
+
+      toggled = dict(filters)
+      toggled[facet] = [v for v in selected if v != value] if value in selected else selected + [value]
+      options.append({
+        'value': value,
+        'label': ('Yes' if value else 'No') if facet == 'seeking' else value,
+        'count': count,
+        'selected': value in selected,
+        'args': dict((name, [_arg(name, v) for v in values]) for name, values in toggled.items() if values)
+      })
+
+    if facet == 'seeking':
+      options.sort(key=lambda option: not option['value'])
+    else:
+      options.sort(key=lambda option: option['value'])
+    facets.append({'name': facet, 'label': label, 'options': options})
+
+  return {'total': _popcount(current.match(filters)), 'facets': facets}
+
+
+def filter_query(kind, query, filters):
+  # Restrict a query over the kind's model to the entities matching filters
+  model, link, seeking = KINDS[kind]
+  for facet, values in filters.items():
+    if facet == 'state':
+      query = query.filter(model.state.in_(values))
+    elif facet == 'seeking':
+      if True in values and False in values:
+        continue
+      query = query.filter(seeking.is_(True) if values[0] else or_(seeking.is_(False), seeking.is_(None)))
+    elif facet == 'genre':
+      tagged = db.session.query(link) \
+        .join(Genre, Genre.id == link.table.c.genre_id) \
+        .filter(Genre.name.in_(values))
+      query = query.filter(model.id.in_(tagged))
+  return query
+
+
+#  Incremental updates on ORM writes
+#  ----------------------------------------------------------------
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+  # Note what this flush changed, applied once the transaction commits
+  changes = session.info.setdefault('facet_changes', [])
+  for entity in list(session.new) + list(session.dirty):
+    for kind, (model, _, _) in KINDS.items():
+      if isinstance(entity, model):
+        changes.append((kind, entity.id, _values(kind, entity)))
+  for entity in session.deleted:
+    for kind, (model, _, _) in KINDS.items():
+      if isinstance(entity, model):
+        changes.append((kind, entity.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply(session):
+  changes = session.info.pop('facet_changes', None)
+  if not changes:
+    return
+  with _lock:
+    for kind, id, values in changes:
+      current = _indexes.get(kind)
+      if current is not None:
+        current.remove(id)
+        if values is not None:
+          current.add(id, values)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+  session.info.pop('facet_changes', None)
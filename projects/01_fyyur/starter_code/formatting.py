@@ -0,0 +1,57 @@
+#----------------------------------------------------------------------------#
+# Date formatting for the Jinja `datetime` filter.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+# Named formats used by the templates
+PATTERNS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# Babel's own named formats, which are built per locale rather than parsed
+BABEL_FORMATS = ('long', 'short')
+
+# Distinct (timestamp, format, locale) results remembered between calls
+FORMAT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=64)
+def compile_pattern(format, locale):
+  # Parse the pattern and locale once per (format, locale)
+  return babel.dates.parse_pattern(PATTERNS.get(format, format)), Locale.parse(locale)
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format(value, format, locale):
+  pattern, locale = compile_pattern(format, locale)
+  return pattern.apply(value, locale)
+
+
+def to_datetime(value):
+  # Only values that aren't datetimes already (e.g. strings) get parsed
+  if isinstance(value, datetime):
+    return value
+  try:
+    return datetime.fromisoformat(str(value))
+  except ValueError:
+    return dateutil.parser.parse(str(value))
+
+
+def format_datetime(value, format='medium', locale=babel.dates.LC_TIME):
+  value = to_datetime(value)
+
+  # Like babel.dates.format_datetime(), treat naive values as UTC
+  if value.tzinfo is None:
+    value = value.replace(tzinfo=babel.dates.UTC)
+
+  if format in BABEL_FORMATS:
+    return babel.dates.format_datetime(value, format, locale=locale)
+
+  return _format(value, format, locale)
@@ -1,9 +1,9 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
 from wtforms.fields.core import BooleanField
 from wtforms.fields.simple import TextAreaField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange
 
 class ShowForm(FlaskForm):
     artist_id = StringField(
@@ -19,6 +19,17 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # Defaults to SHOW_LENGTH_MINUTES after the start
+    end_time = DateTimeField(
+        'end_time',
+        validators=[Optional()]
+    )
+    # Book the same slot this many weeks in a row
+    repeat = IntegerField(
+        'repeat',
+        validators=[Optional(), NumberRange(min=1, max=52)],
+        default=1
+    )
 
 class VenueForm(FlaskForm):
     name = StringField(
@@ -0,0 +1,220 @@
+#----------------------------------------------------------------------------#
+# Venue coordinates: offline geocoding and nearby search.
+#----------------------------------------------------------------------------#
+
+# Venues carry latitude/longitude, set by flask fyyur geocode from a local
+# gazetteer (city-level: a CSV/JSONL file of city, state, latitude,
+# longitude records), and the geohash of that point. Geohashes of nearby
+# points share prefixes, so the B-tree index on Venue.geohash is the spatial
+# index: the venues in a geohash cell are one index range scan.
+#
+# A point is inside one cell, so the 3x3 block of cells around it covers
+# every point closer than the cell's smaller side. nearby() picks the finest
+# precision whose cells are at least the radius across and filters the
+# block's venues by their exact distance; for the k nearest it widens the
+# block until the k-th venue found is within that covered distance.
+#
+# ORM writes keep geohash in step with the coordinates, and a venue whose
+# city or state is edited loses its coordinates until it is geocoded again.
+
+import math
+
+import click
+from sqlalchemy import and_, event, inspect, or_
+
+from importer import fyyur_cli, read_records
+from models import db, cache, Venue
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 12
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+NEARBY_LIMIT = 20
+MAX_NEARBY_LIMIT = 100
+MAX_RADIUS_KM = 500
+
+
+def encode(latitude, longitude, precision=PRECISION):
+  # The geohash of a point
+  lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+  chars, bits, value, even = [], 0, 0, True
+
+  while len(chars) < precision:
+    span, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+    middle = (span[0] + span[1]) / 2
+    value <<= 1
+    if coordinate >= middle:
+      value |= 1
+      span[0] = middle
+    else:
+      span[1] = middle
+    even = not even
+
+    bits += 1
+    if bits == 5:
+      chars.append(BASE32[value])
+      bits, value = 0, 0
+
+  return ''.join(chars)
+
+
+def cell_size(precision):
+  # (height, width) of a cell in degrees
+  lat_bits = 5 * precision // 2
+  lon_bits = 5 * precision - lat_bits
+  return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covered_km(precision, latitude):
+  # How far from a point its 3x3 block of cells is guaranteed to reach: the
+  # smaller cell side, east-west measured where the block is narrowest
+  height, width = cell_size(precision)
+  widest_lat = min(abs(latitude) + 2 * height, 90.0)
+  return min(height * KM_PER_DEGREE, width * KM_PER_DEGREE * math.cos(math.radians(widest_lat)))
+
+
+def block(latitude, longitude, precision):
+  # The geohashes of the point's cell and its eight neighbours
+  height, width = cell_size(precision)
+  cells = set()
+  for dy in (-1, 0, 1):
+    lat = latitude + dy * height
+    if not -90.0 <= lat <= 90.0:
+      continue
+    for dx in (-1, 0, 1):
+      lon = (longitude + dx * width + 180.0) % 360.0 - 180.0
+      cells.add(encode(lat, lon, precision))
+  return cells
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+  # Great-circle (haversine) distance
+  phi1, phi2 = math.radians(lat1), math.radians(lat2)
+  a = math.sin((phi2 - phi1) / 2) ** 2 + \
+    math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _candidates(latitude, longitude, precision):
+  # (distance, venue row) for the venues in the point's block, nearest first
+  columns = (Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude)
+  query = db.session.query(*columns).filter(Venue.geohash.isnot(None))
+
+  if precision:
+    # A prefix is a range of the index: [prefix, prefix + highest character)
+    query = query.filter(or_(*(
+      and_(Venue.geohash >= cell, Venue.geohash < cell + '~')
+      for cell in block(latitude, longitude, precision)
+    )))
+
+  rows = [(distance_km(latitude, longitude, row.latitude, row.longitude), row) for row in query]
+  rows.sort(key=lambda pair: (pair[0], pair[1].id))
+  return rows
+
+
+def nearby(latitude, longitude, radius_km=None, limit=NEARBY_LIMIT):
+  # Up to limit (distance in km, venue row) pairs, nearest first: those
+  # within radius_km, or the limit nearest at any distance
+  if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+    raise ValueError('lat must be within [-90, 90] and lon within [-180, 180]')
+  if radius_km is not None and not 0 < radius_km <= MAX_RADIUS_KM:
+    raise ValueError('radius must be within (0, %d] km' % MAX_RADIUS_KM)
+  if not 1 <= limit <= MAX_NEARBY_LIMIT:
+    raise ValueError('limit must be within [1, %d]' % MAX_NEARBY_LIMIT)
+
+  if radius_km is not None:
+    precision = 0
+    for p in range(PRECISION, 0, -1):
+      if covered_km(p, latitude) >= radius_km:
+        precision = p
+        break
+    rows = _candidates(latitude, longitude, precision)
+    return [(distance, row) for distance, row in rows if distance <= radius_km][:limit]
+
+  # k nearest: from street-sized cells outwards until the block is known to
+  # hold them
+  for precision in range(8, 0, -1):
+    rows = _candidates(latitude, longitude, precision)
+    if len(rows) >= limit and rows[limit - 1][0] <= covered_km(precision, latitude):
+      return rows[:limit]
+  return _candidates(latitude, longitude, 0)[:limit]
+
+
+#  Geocoding
+#  ----------------------------------------------------------------
+
+def _place(city, state):
+  return ' '.join((city or '').lower().split()), (state or '').strip().upper()
+
+
+def read_gazetteer(path):
+  # (city, state) -> (latitude, longitude) from a CSV/JSONL file of city,
+  # state, latitude (or lat) and longitude (or lon) records
+  places = {}
+  for _, record in read_records(path):
+    try:
+      latitude = float(record.get('latitude', record.get('lat')))
+      longitude = float(record.get('longitude', record.get('lon')))
+    except (TypeError, ValueError):
+      continue
+    places.setdefault(_place(record.get('city'), record.get('state')), (latitude, longitude))
+  return places
+
+
+def geocode(places, redo=False):
+  # Set the coordinates of the venues whose (city, state) is in places, one
+  # UPDATE per place; returns (venues geocoded, (city, state)s not found)
+  query = db.session.query(Venue.city, Venue.state).distinct()
+  if not redo:
+    query = query.filter(Venue.latitude.is_(None))
+
+  geocoded, missing = 0, []
+  table = Venue.__table__
+  for city, state in query.all():
+    point = places.get(_place(city, state))
+    if point is None:
+      missing.append((city, state))
+      continue
+
+    latitude, longitude = point
+    criteria = [table.c.city == city, table.c.state == state]
+    if not redo:
+      criteria.append(table.c.latitude.is_(None))
+    result = db.session.execute(table.update().where(and_(*criteria)).values(
+      latitude=latitude, longitude=longitude, geohash=encode(latitude, longitude)))
+    geocoded += result.rowcount
+
+  db.session.commit()
+  return geocoded, missing
+
+
+@fyyur_cli.command('geocode')
+@click.argument('gazetteer', type=click.Path(exists=True, dir_okay=False))
+@click.option('--all', 'redo', is_flag=True, help='Also redo venues that already have coordinates.')
+def geocode_command(gazetteer, redo):
+  """Set venue coordinates from a gazetteer of city, state, latitude, longitude."""
+  geocoded, missing = geocode(read_gazetteer(gazetteer), redo)
+  click.echo('%d venues geocoded' % geocoded)
+  for city, state in missing:
+    click.echo('Not in the gazetteer: %s, %s' % (city, state), err=True)
+  cache.invalidate('venues')
+
+
+#  Keeping geohash current on ORM writes
+#  ----------------------------------------------------------------
+
+@event.listens_for(Venue, 'before_insert')
+@event.listens_for(Venue, 'before_update')
+def _set_geohash(mapper, connection, venue):
+  history = inspect(venue).attrs
+  moved = history.city.history.has_changes() or history.state.history.has_changes()
+  located = history.latitude.history.has_changes() or history.longitude.history.has_changes()
+  if moved and not located and venue.id is not None:
+    # Somewhere else now; geocode it again
+    venue.latitude = venue.longitude = None
+
+  if venue.latitude is None or venue.longitude is None:
+    venue.geohash = None
+  else:
+    venue.geohash = encode(venue.latitude, venue.longitude)
@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------#
+# HTTP caching headers and conditional GETs.
+#----------------------------------------------------------------------------#
+
+# Read pages carry Cache-Control and an ETag so browsers and the CDN can
+# revalidate instead of downloading them again:
+#
+# - Pages with a version (the venue and artist pages, see
+#   details.detail_version) derive their ETag from one small row: the
+#   entity's updated_at, its show counts and the newest updated_at of the
+#   venues/artists it lists. A matching If-None-Match gets a 304 before the
+#   page cache is consulted or the template rendered. The page cache keys
+#   them by that ETag too, so a version change (a show starting) renders
+#   the page again rather than serving the old body under the new ETag.
+#   They are marked no-cache, i.e. stored but revalidated on every use.
+# - Other pages are cached for HTTP_CACHE_MAX_AGE seconds and get an ETag
+#   hashed from the body, which saves the transfer but not the render.
+#
+# Last-Modified is sent for information only: updated_at doesn't move when
+# a show is added or starts, so 304s are decided on the ETag alone.
+# Pages carrying flashed messages are one-off and marked no-store.
+
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from werkzeug.wrappers import Response
+
+
+def validators(row):
+  # (ETag, Last-Modified) of a version row
+  etag = hashlib.md5('|'.join(str(value) for value in row).encode('utf-8')).hexdigest()
+  times = [value for value in row if isinstance(value, datetime)]
+  return etag, max(times) if times else None
+
+
+def _cache_control(response, validated):
+  if validated:
+    response.cache_control.no_cache = True
+  else:
+    response.cache_control.max_age = current_app.config['HTTP_CACHE_MAX_AGE']
+  response.cache_control.public = True
+
+
+def not_modified(request, version):
+  # A 304 for a request whose If-None-Match matches version, else None
+  etag, last_modified = validators(version)
+  if etag not in request.if_none_match:
+    return None
+
+  response = Response(status=304)
+  response.set_etag(etag)
+  response.last_modified = last_modified
+  _cache_control(response, True)
+  return response
+
+
+def finish(response, request, version=None):
+  # Add the caching headers to a page's 200 response, turning it into a 304
+  # if the client's copy is still current
+  if response.status_code != 200:
+    return response
+
+  if version is not None:
+    etag, response.last_modified = validators(version)
+    response.set_etag(etag)
+  else:
+    response.add_etag()
+  _cache_control(response, version is not None)
+  return response.make_conditional(request)
+
+
+def http_cache(version=None):
+  # Caching headers for a GET view. version(**view_args) returns the page's
+  # version row, or None when there is no such page (the view then answers,
+  # typically with a 404). Goes above @cache.cached so a 304 skips it.
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      if request.method != 'GET' or '_flashes' in session:
+        response = make_response(view(*args, **kwargs))
+        response.cache_control.no_store = True
+        return response
+
+      current = version(**kwargs) if version is not None else None
+      if current is not None:
+        response = not_modified(request, current)
+        if response is not None:
+          return response
+        # Keys the page cache, so the body always matches the ETag
+        g.page_version = validators(current)[0]
+
+      return finish(make_response(view(*args, **kwargs)), request, current)
+
+    return wrapper
+
+  return decorator
@@ -0,0 +1,257 @@
+#----------------------------------------------------------------------------#
+# Bulk import: flask fyyur import --venues ... --artists ... --shows ...
+#----------------------------------------------------------------------------#
+
+# Streams CSV or JSONL files in chunks, validates every record with the same
+# WTForms the web handlers use, and loads each valid chunk with a single
+# COPY (Postgres) or executemany (other backends) before reading the next,
+# so memory stays bounded by the chunk size.
+#
+# Records may carry their own "id". Venues and artists get new database ids,
+# reserved from the table's sequence a chunk at a time on Postgres (so web
+# inserts running alongside never draw the same ones), and the source -> database id map is kept for the rest of the run so the
+# shows file can refer to venues and artists by their source ids. Show ids
+# that aren't in the map are taken as existing database ids.
+#
+# Shows aren't checked for double bookings (scheduling.py) row by row; on
+# Postgres the exclusion constraints reject a chunk holding one.
+
+import csv
+import io
+import json
+import re
+import time
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, text
+from werkzeug.datastructures import MultiDict
+
+import facets
+from counters import count_shows
+from scheduling import show_length
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, cache, Venue, Artist, Show, genres_named, venue_genres, artist_genres
+
+CHUNK_SIZE = 5000
+
+# Rejections printed in full before only being counted
+MAX_REPORTED_ERRORS = 20
+
+fyyur_cli = AppGroup('fyyur', help='Fyyur data tools.')
+
+
+def read_records(path):
+  # (line number, dict) for each record of a .csv or .jsonl/.ndjson file
+  with open(path, newline='', encoding='utf-8') as source:
+    if path.endswith('.csv'):
+      reader = csv.DictReader(source)
+      for record in reader:
+        yield reader.line_num, record
+    else:
+      for line_num, line in enumerate(source, 1):
+        if line.strip():
+          yield line_num, json.loads(line)
+
+
+def to_formdata(record):
+  # Flatten a record into what a browser would have posted for it
+  formdata = MultiDict()
+  for key, value in record.items():
+    if value is None:
+      continue
+    if key == 'genres' and isinstance(value, str):
+      value = [genre for genre in re.split(r'[;,]', value.strip('{}')) if genre.strip()]
+    if isinstance(value, list):
+      for item in value:
+        formdata.add(key, str(item).strip().strip('"'))
+    elif isinstance(value, bool):
+      formdata.add(key, 'y' if value else 'false')
+    elif key.startswith('seeking_') and key != 'seeking_description':
+      if str(value).strip().lower() not in ('', '0', 'false', 'no', 'n', 'f'):
+        formdata.add(key, 'y')
+    elif key in ('start_time', 'end_time'):
+      formdata.add(key, _form_datetime(str(value)))
+    else:
+      formdata.add(key, str(value))
+  return formdata
+
+
+def _form_datetime(value):
+  # ShowForm expects '%Y-%m-%d %H:%M:%S'; also accept ISO 8601 timestamps
+  try:
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+  except ValueError:
+    return value
+  return parsed.replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def copy_rows(table, rows):
+  # Load rows (dicts with the same keys) into table: COPY on
+  # Postgres/psycopg2, else executemany
+  if not rows:
+    return
+
+  columns = list(rows[0])
+  bind = db.session.connection()
+  if bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2':
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+      writer.writerow([row.get(column) for column in columns])
+    buffer.seek(0)
+
+    cursor = bind.connection.cursor()
+    cursor.copy_expert('COPY "%s" (%s) FROM STDIN WITH (FORMAT csv)' % (
+      table.name, ', '.join('"%s"' % column for column in columns)), buffer)
+  else:
+    db.session.execute(table.insert(), rows)
+
+
+class Importer(object):
+
+  def __init__(self, chunk_size=CHUNK_SIZE):
+    self.chunk_size = chunk_size
+    # kind -> {source id: database id}
+    self.ids = {'venues': {}, 'artists': {}}
+    self.genre_ids = {}
+
+  def _reserve_ids(self, model, count):
+    # count new ids for model
+    if not count:
+      return []
+    if db.session.connection().dialect.name == 'postgresql':
+      # Drawn from the sequence, as the web inserts' ids are
+      return [id for (id,) in db.session.execute(
+        text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+        {'table': '"%s"' % model.__table__.name, 'count': count})]
+    # No sequences (SQLite): past the largest id, as its own inserts are
+    start = (db.session.query(func.max(model.id)).scalar() or 0) + 1
+    return list(range(start, start + count))
+
+  def _genre_ids(self, names):
+    missing = [name for name in names if name not in self.genre_ids]
+    if missing:
+      for genre in genres_named(missing):
+        db.session.flush()
+        self.genre_ids[genre.name] = genre.id
+    return [self.genre_ids[name] for name in names]
+
+  def _resolve(self, kind, model, values):
+    # Map source ids to database ids; unknown ones must already exist
+    ids = self.ids[kind]
+    unknown = set(value for value in values if value not in ids)
+    existing = set()
+    numeric = [int(value) for value in unknown if value.isdigit()]
+    if numeric:
+      existing = set(str(id) for (id,) in db.session.query(model.id).filter(model.id.in_(numeric)))
+    return dict(
+      (value, ids[value] if value in ids else int(value))
+      for value in values
+      if value in ids or value in existing
+    )
+
+  def entity_rows(self, kind, model, form_class, link_column, chunk):
+    # (entity rows, genre link rows, errors) for one chunk of venues/artists
+    rows, genre_links, errors, valid = [], [], [], []
+    columns = [column.key for column in model.__table__.columns if column.key != 'id']
+
+    for line_num, record in chunk:
+      form = form_class(formdata=to_formdata(record), meta={'csrf': False})
+      if form.validate():
+        valid.append((record, form))
+      else:
+        errors.append((line_num, form.errors))
+
+    for id, (record, form) in zip(self._reserve_ids(model, len(valid)), valid):
+      row = dict((column, form[column].data) for column in columns if column in form)
+      row['id'] = id
+      if record.get('id') not in (None, ''):
+        self.ids[kind][str(record['id'])] = id
+
+      rows.append(row)
+      for genre_id in self._genre_ids(form.genres.data):
+        genre_links.append({'genre_id': genre_id, link_column: id})
+
+    return rows, genre_links, errors
+
+  def show_rows(self, chunk):
+    rows, errors, valid = [], [], []
+
+    for line_num, record in chunk:
+      form = ShowForm(formdata=to_formdata(record), meta={'csrf': False})
+      if form.validate():
+        valid.append((line_num, form))
+      else:
+        errors.append((line_num, form.errors))
+
+    venues = self._resolve('venues', Venue, set(form.venue_id.data.strip() for _, form in valid))
+    artists = self._resolve('artists', Artist, set(form.artist_id.data.strip() for _, form in valid))
+
+    for line_num, form in valid:
+      venue_id = venues.get(form.venue_id.data.strip())
+      artist_id = artists.get(form.artist_id.data.strip())
+      if venue_id is None or artist_id is None:
+        errors.append((line_num, {'venue_id' if venue_id is None else 'artist_id': ['Unknown id.']}))
+        continue
+      start_time = form.start_time.data
+      end_time = form.end_time.data or start_time + show_length()
+      rows.append({'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time, 'end_time': end_time})
+
+    return rows, errors
+
+  def run(self, kind, path):
+    model = {'venues': Venue, 'artists': Artist, 'shows': Show}[kind]
+    table = model.__table__
+    loaded = rejected = 0
+    started = time.time()
+
+    records = read_records(path)
+    chunk = list(islice(records, self.chunk_size))
+    while chunk:
+      if kind == 'shows':
+        rows, errors = self.show_rows(chunk)
+        copy_rows(table, rows)
+        # COPY/executemany skip the ORM events that keep these current
+        count_shows(db.session.connection(), [(row['venue_id'], row['artist_id'], row['start_time']) for row in rows])
+      else:
+        form_class, links, link_column = {
+          'venues': (VenueForm, venue_genres, 'venue_id'),
+          'artists': (ArtistForm, artist_genres, 'artist_id')
+        }[kind]
+        rows, genre_links, errors = self.entity_rows(kind, model, form_class, link_column, chunk)
+        copy_rows(table, rows)
+        copy_rows(links, genre_links)
+      db.session.commit()
+
+      for line_num, error in errors:
+        if rejected < MAX_REPORTED_ERRORS:
+          click.echo('%s line %d rejected: %s' % (path, line_num, error), err=True)
+        rejected += 1
+      loaded += len(rows)
+
+      elapsed = max(time.time() - started, 1e-9)
+      click.echo('%s: %d loaded, %d rejected, %.0f rows/s' % (kind, loaded, rejected, (loaded + rejected) / elapsed))
+
+      chunk = list(islice(records, self.chunk_size))
+
+    return loaded, rejected
+
+
+@fyyur_cli.command('import')
+@click.option('--venues', type=click.Path(exists=True, dir_okay=False), help='CSV/JSONL file of venues.')
+@click.option('--artists', type=click.Path(exists=True, dir_okay=False), help='CSV/JSONL file of artists.')
+@click.option('--shows', type=click.Path(exists=True, dir_okay=False), help='CSV/JSONL file of shows.')
+@click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='Records validated and loaded per batch.')
+def import_command(venues, artists, shows, chunk_size):
+  """Bulk load venues, artists and shows, in that order."""
+  importer = Importer(chunk_size)
+
+  for kind, path in (('venues', venues), ('artists', artists), ('shows', shows)):
+    if path:
+      importer.run(kind, path)
+
+  cache.clear()
+  facets.invalidate()
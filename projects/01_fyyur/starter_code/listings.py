@@ -0,0 +1,165 @@
+#----------------------------------------------------------------------------#
+# Listing queries.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import tuple_
+
+from facets import filter_query
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres
+
+# Rows pulled from the cursor at a time when walking large listings
+LISTING_BATCH_SIZE = 1000
+
+# Shows per /shows page
+SHOWS_PER_PAGE = 30
+
+
+def with_genre(query, link, entity_id, genre):
+  # Restrict query to entities tagged with the named genre. link is the
+  # entity column of the association table, whose (genre_id, entity_id)
+  # primary key serves the lookup.
+  association = link.table
+
+  return query \
+    .join(association, link == entity_id) \
+    .join(Genre, Genre.id == association.c.genre_id) \
+    .filter(Genre.name == genre)
+
+
+def genre_names(link, ids):
+  # entity id -> [genre names] for a batch of entities, in one query. link
+  # is the entity column of the association table.
+  association = link.table
+  rows = db.session.query(link, Genre.name) \
+    .join(Genre, Genre.id == association.c.genre_id) \
+    .filter(link.in_(ids)) \
+    .order_by(link, Genre.name)
+
+  return dict(
+    (id, [name for _, name in group])
+    for id, group in groupby(rows, key=itemgetter(0))
+  )
+
+
+def venue_rows(genre=None, filters=None):
+  # Every venue with its number of upcoming shows (from the counters, so
+  # Shows isn't read), ordered by the (city, state) index so that venues of
+  # the same area are adjacent. filters narrows it as in facets.py.
+  query = db.session.query(
+      Venue.city,
+      Venue.state,
+      Venue.id,
+      Venue.name,
+      Venue.upcoming_shows_count.label('num_upcoming_shows')
+    )
+
+  if genre:
+    query = with_genre(query, venue_genres.c.venue_id, Venue.id, genre)
+  if filters:
+    query = filter_query('venues', query, filters)
+
+  return query \
+    .order_by(Venue.city, Venue.state, Venue.name, Venue.id) \
+    .yield_per(LISTING_BATCH_SIZE)
+
+
+def venue_areas(genre=None, filters=None):
+  # Lazily yield one area per distinct (city, state) in a single pass over
+  # venue_rows(), so the template can render while rows are still arriving
+  return group_areas(venue_rows(genre, filters))
+
+
+def group_areas(rows):
+  # Areas from venue_rows()-shaped rows, however they were fetched
+  for (city, state), rows in groupby(rows, key=itemgetter(0, 1)):
+    venues = [
+      {
+        'id': row.id,
+        'name': row.name,
+        'num_upcoming_shows': row.num_upcoming_shows
+      }
+      for row in rows
+    ]
+
+    yield {
+      'city': city,
+      'state': state,
+      'num_upcoming_shows': sum(venue['num_upcoming_shows'] for venue in venues),
+      'venues': venues
+    }
+
+
+def recent_venues(limit=3):
+  # The newest venues, for the home page
+  return Venue.query.order_by(Venue.id.desc()).limit(limit)
+
+
+def artist_rows(genre=None, filters=None):
+  # id and name of every artist (optionally of one genre, or matching
+  # facets.py filters), in id order
+  query = db.session.query(Artist.id, Artist.name)
+
+  if genre:
+    query = with_genre(query, artist_genres.c.artist_id, Artist.id, genre)
+  if filters:
+    query = filter_query('artists', query, filters)
+
+  return query.order_by(Artist.id).yield_per(LISTING_BATCH_SIZE)
+
+
+def encode_show_cursor(start_time, show_id):
+  # Keyset cursor for /shows: the (start_time, id) of the last row on a page
+  return '%s_%d' % (start_time.isoformat(), show_id)
+
+
+def decode_show_cursor(cursor):
+  # Raises ValueError for anything encode_show_cursor() didn't produce
+  start_time, show_id = cursor.rsplit('_', 1)
+  return datetime.fromisoformat(start_time), int(show_id)
+
+
+def show_page_query(after=None, upcoming=False, limit=SHOWS_PER_PAGE, now=None):
+  # One page of shows ordered by (start_time, id), projected to exactly the
+  # columns the template uses. Seeks past the `after` cursor through the
+  # (start_time, id) index, so every page costs the same however deep it is.
+  # Asks for one extra row to learn whether there's a next page.
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+    ) \
+    .join(Venue, Show.venue_id == Venue.id) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .filter(Show.start_time.isnot(None))
+
+  if upcoming:
+    query = query.filter(Show.start_time > (now or datetime.now()))
+
+  if after is not None:
+    query = query.filter(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+  return query.order_by(Show.start_time, Show.id).limit(limit + 1)
+
+
+def paginate_shows(rows, limit=SHOWS_PER_PAGE):
+  # (shows, cursor of the next page or None) from show_page_query() rows
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_cursor = encode_show_cursor(rows[-1].start_time, rows[-1].id)
+
+  return rows, next_cursor
+
+
+def show_page(after=None, upcoming=False, limit=SHOWS_PER_PAGE, now=None):
+  # Returns (shows, cursor of the next page or None)
+  rows = show_page_query(after, upcoming, limit, now).all()
+  return paginate_shows(rows, limit)
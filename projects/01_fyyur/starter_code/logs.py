@@ -0,0 +1,179 @@
+#----------------------------------------------------------------------------#
+# Application logging: request IDs and a non-blocking, buffered log file.
+#----------------------------------------------------------------------------#
+
+# Every request gets an ID (the client's X-Request-ID when it sends a sane
+# one), echoed in the response's X-Request-ID header and attached to the
+# records it logs. The ASGI read routes (asgi.py) do the same, keeping the
+# ID in a context variable since they don't run Flask's request hooks.
+#
+# With LOG_FILE set, app.logger's records go through a bounded queue
+# (LOG_QUEUE_SIZE) to a listener thread that writes them to the file as
+# JSON lines, rotating it by size (LOG_MAX_BYTES) or, with LOG_ROTATE_WHEN,
+# by time. A request only ever formats its message and enqueues it: when
+# the queue is full the record is dropped and counted rather than waiting
+# for the disk. /_debug/logging reports the queue and the drop count.
+
+import atexit
+import json
+import logging
+import queue
+import re
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from flask import g, has_request_context, request
+
+REQUEST_ID = re.compile(r'^[\w.:-]{1,64}$')
+
+# The ID of the ASGI request being served, for its task and worker threads
+current_request_id = ContextVar('fyyur_request_id', default=None)
+
+
+def new_request_id(sent):
+  # The client's X-Request-ID if it is sane, else a fresh one
+  return sent if REQUEST_ID.match(sent or '') else uuid.uuid4().hex
+
+
+def request_id():
+  # The current request's ID, or None outside of requests
+  if has_request_context() and 'request_id' in g:
+    return g.request_id
+  return current_request_id.get()
+
+
+class RequestFilter(logging.Filter):
+  # Copies the request's details onto the record while still on its thread
+
+  def filter(self, record):
+    record.request_id = request_id()
+    if has_request_context():
+      record.method = request.method
+      record.path = request.path
+      record.remote_addr = request.remote_addr
+    return True
+
+
+class JsonFormatter(logging.Formatter):
+  # One JSON object per record
+
+  FIELDS = ('request_id', 'method', 'path', 'remote_addr')
+
+  def format(self, record):
+    entry = {
+      'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+      'source': '%s:%d' % (record.pathname, record.lineno)
+    }
+    for field in self.FIELDS:
+      value = getattr(record, field, None)
+      if value is not None:
+        entry[field] = value
+    if record.exc_info and not record.exc_text:
+      record.exc_text = self.formatException(record.exc_info)
+    if record.exc_text:
+      entry['exception'] = record.exc_text
+    return json.dumps(entry, ensure_ascii=False)
+
+
+class BoundedQueueHandler(QueueHandler):
+  # Enqueues without blocking; drops (and counts) records when full
+
+  def __init__(self, capacity):
+    super(BoundedQueueHandler, self).__init__(queue.Queue(capacity))
+    self.capacity = capacity
+    self.dropped = 0
+    self.addFilter(RequestFilter())
+
+  def prepare(self, record):
+    # Resolve the message and traceback here, where the arguments are still
+    # live, and drop what can't safely cross threads
+    record.message = record.getMessage()
+    if record.exc_info:
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+    record.msg = record.message
+    record.args = None
+    record.exc_info = None
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      with self.lock:
+        self.dropped += 1
+
+  def stats(self):
+    return {'queued': self.queue.qsize(), 'capacity': self.capacity, 'dropped': self.dropped}
+
+
+def file_handler(config):
+  # Where the listener writes: a size- or time-rotated JSON lines file
+  if config['LOG_ROTATE_WHEN']:
+    handler = TimedRotatingFileHandler(
+      config['LOG_FILE'], when=config['LOG_ROTATE_WHEN'], backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8')
+  else:
+    handler = RotatingFileHandler(
+      config['LOG_FILE'], maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8')
+  handler.setFormatter(JsonFormatter())
+  return handler
+
+
+class Logs(object):
+
+  def __init__(self, app=None):
+    self.app = None
+    self.handler = None
+    self.listener = None
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('LOG_FILE', None)
+    app.config.setdefault('LOG_LEVEL', 'INFO')
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+    app.config.setdefault('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('LOG_BACKUP_COUNT', 5)
+    app.config.setdefault('LOG_ROTATE_WHEN', None)
+    self.app = app
+
+    app.before_request(self._assign_request_id)
+    app.after_request(self._echo_request_id)
+
+    if app.config['LOG_FILE']:
+      self.start()
+
+  def start(self):
+    # Route app.logger through the queue to the rotating file
+    config = self.app.config
+    self.handler = BoundedQueueHandler(config['LOG_QUEUE_SIZE'])
+    self.listener = QueueListener(self.handler.queue, file_handler(config), respect_handler_level=True)
+    self.listener.start()
+    atexit.register(self.stop)
+
+    self.app.logger.setLevel(config['LOG_LEVEL'])
+    self.app.logger.addHandler(self.handler)
+
+  def stop(self):
+    # Flush what is queued and stop the listener thread
+    if self.listener is not None:
+      self.app.logger.removeHandler(self.handler)
+      self.listener.stop()
+      self.listener = None
+
+  def stats(self):
+    if self.handler is None:
+      return {'enabled': False}
+    return dict(self.handler.stats(), enabled=self.listener is not None)
+
+  def _assign_request_id(self):
+    g.request_id = new_request_id(request.headers.get('X-Request-ID', ''))
+
+  def _echo_request_id(self, response):
+    if 'request_id' in g:
+      response.headers['X-Request-ID'] = g.request_id
+    return response
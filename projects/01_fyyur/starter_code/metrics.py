@@ -0,0 +1,257 @@
+#----------------------------------------------------------------------------#
+# Request metrics, SQL instrumentation and slow request profiling.
+#----------------------------------------------------------------------------#
+
+# Opt-in (METRICS_ENABLED). For every request it records the wall time, the
+# number and total time of the SQL statements run (engine events) and the
+# time spent rendering templates, per endpoint, and serves them at
+# /_debug/metrics in the Prometheus text format. Each response also carries
+# a Server-Timing header with the same figures for the browser's dev tools.
+#
+# A statement run METRICS_N_PLUS_ONE times or more within one request is
+# logged as a likely N+1 query and counted.
+#
+# With PROFILE_THRESHOLD_MS set, requests run under cProfile and those
+# slower than the threshold are dumped to PROFILE_DIR (read them with
+# python -m pstats or snakeviz).
+#
+# Figures are per process; for a streamed response, the time to its first
+# byte. The ASGI read routes (asgi.py) are measured too, with their record
+# in a context variable rather than g, but not profiled.
+
+import cProfile
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+import jinja2
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _labels(names, values):
+  return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                  for name, value in zip(names, values))
+
+
+class CounterMetric(object):
+
+  def __init__(self, name, help, labels):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.values = Counter()
+
+  def inc(self, labels, amount=1):
+    self.values[labels] += amount
+
+  def render(self):
+    lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+    for labels, value in sorted(self.values.items()):
+      lines.append('%s{%s} %s' % (self.name, _labels(self.labels, labels), value))
+    return lines
+
+
+class HistogramMetric(object):
+
+  def __init__(self, name, help, labels, buckets):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.buckets = buckets
+    # labels -> ([count per bucket], sum, count)
+    self.values = {}
+
+  def observe(self, labels, value):
+    counts, total, n = self.values.get(labels) or ([0] * len(self.buckets), 0, 0)
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        counts[i] += 1
+    self.values[labels] = (counts, total + value, n + 1)
+
+  def render(self):
+    lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+    for labels, (counts, total, n) in sorted(self.values.items()):
+      names = self.labels + ('le',)
+      for bound, count in zip(self.buckets, counts):
+        lines.append('%s_bucket{%s} %d' % (self.name, _labels(names, labels + (bound,)), count))
+      lines.append('%s_bucket{%s} %d' % (self.name, _labels(names, labels + ('+Inf',)), n))
+      lines.append('%s_sum{%s} %s' % (self.name, _labels(self.labels, labels), total))
+      lines.append('%s_count{%s} %d' % (self.name, _labels(self.labels, labels), n))
+    return lines
+
+
+class RequestRecord(object):
+  # What one request has done so far
+
+  __slots__ = ('started', 'statements', 'sql_time', 'render_time', 'profiler')
+
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.statements = Counter()
+    self.sql_time = 0.0
+    self.render_time = 0.0
+    self.profiler = None
+
+
+# The record of the ASGI request being served, for its task and the worker
+# threads it runs queries on
+current_record = ContextVar('fyyur_metrics_record', default=None)
+
+
+def _record():
+  # The current request's record, if it is being measured
+  if has_request_context():
+    record = g.get('metrics')
+    if record is not None:
+      return record
+  return current_record.get()
+
+
+class TimedTemplate(jinja2.Template):
+  # Adds its top-level render time to the request's record ({% extends %}
+  # and includes render within it)
+
+  def render(self, *args, **kwargs):
+    record = _record()
+    if record is None:
+      return super(TimedTemplate, self).render(*args, **kwargs)
+
+    started = time.perf_counter()
+    try:
+      return super(TimedTemplate, self).render(*args, **kwargs)
+    finally:
+      record.render_time += time.perf_counter() - started
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  if _record() is not None:
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  record = _record()
+  started = conn.info.get('metrics_started')
+  if record is not None and started:
+    record.sql_time += time.perf_counter() - started.pop()
+    record.statements[statement] += 1
+
+
+class Metrics(object):
+
+  def __init__(self, app=None):
+    self.app = None
+    self.lock = threading.Lock()
+
+    labels = ('endpoint',)
+    self.requests = CounterMetric(
+      'fyyur_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+    self.duration = HistogramMetric(
+      'fyyur_request_duration_seconds', 'Request wall time.', labels, DURATION_BUCKETS)
+    self.statements = HistogramMetric(
+      'fyyur_request_sql_statements', 'SQL statements run per request.', labels, STATEMENT_BUCKETS)
+    self.sql_time = CounterMetric(
+      'fyyur_sql_duration_seconds_total', 'Time spent running SQL statements.', labels)
+    self.render_time = CounterMetric(
+      'fyyur_template_render_seconds_total', 'Time spent rendering templates.', labels)
+    self.n_plus_one = CounterMetric(
+      'fyyur_n_plus_one_total', 'Requests that repeated a statement METRICS_N_PLUS_ONE times or more.', labels)
+    self.profiled = CounterMetric(
+      'fyyur_profiles_dumped_total', 'Slow requests whose profile was dumped.', labels)
+
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('METRICS_ENABLED', False)
+    app.config.setdefault('METRICS_N_PLUS_ONE', 10)
+    app.config.setdefault('PROFILE_THRESHOLD_MS', None)
+    app.config.setdefault('PROFILE_DIR', 'profiles')
+    self.app = app
+
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(self._start)
+    app.after_request(self._finish)
+
+  @property
+  def enabled(self):
+    return self.app.config['METRICS_ENABLED']
+
+  def _start(self):
+    if not self.enabled:
+      return
+
+    record = g.metrics = RequestRecord()
+    if self.app.config['PROFILE_THRESHOLD_MS'] is not None:
+      profiler = cProfile.Profile()
+      try:
+        profiler.enable()
+      except ValueError:
+        # Another request's profiler is active (Python 3.12+ allows one)
+        return
+      record.profiler = profiler
+
+  def begin(self):
+    # A record for a request served outside Flask, or None when disabled
+    return RequestRecord() if self.enabled else None
+
+  def _finish(self, response):
+    record = g.pop('metrics', None)
+    if record is None:
+      return response
+    return self.finish(record, request.endpoint or 'none', request.method, response)
+
+  def finish(self, record, endpoint, method, response):
+    # Account for a finished request and add its Server-Timing header
+    elapsed = time.perf_counter() - record.started
+    if record.profiler is not None:
+      record.profiler.disable()
+
+    endpoint = (endpoint,)
+    statements = sum(record.statements.values())
+    repeated = [(statement, n) for statement, n in record.statements.items()
+                if n >= self.app.config['METRICS_N_PLUS_ONE']]
+
+    with self.lock:
+      self.requests.inc(endpoint + (method, response.status_code))
+      self.duration.observe(endpoint, elapsed)
+      self.statements.observe(endpoint, statements)
+      self.sql_time.inc(endpoint, record.sql_time)
+      self.render_time.inc(endpoint, record.render_time)
+      if repeated:
+        self.n_plus_one.inc(endpoint)
+
+    for statement, n in repeated:
+      self.app.logger.warning('Likely N+1 query in %s: run %d times: %s', endpoint[0], n, ' '.join(statement.split())[:200])
+
+    threshold = self.app.config['PROFILE_THRESHOLD_MS']
+    if record.profiler is not None and elapsed * 1000 >= threshold:
+      self._dump(record.profiler, endpoint[0], elapsed)
+
+    response.headers['Server-Timing'] = 'sql;dur=%.1f;desc="%d statements", tpl;dur=%.1f, total;dur=%.1f' % (
+      record.sql_time * 1000, statements, record.render_time * 1000, elapsed * 1000)
+    return response
+
+  def _dump(self, profiler, endpoint, elapsed):
+    directory = self.app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '%s-%s-%dms.prof' % (time.strftime('%Y%m%d-%H%M%S'), endpoint, elapsed * 1000))
+    profiler.dump_stats(path)
+    with self.lock:
+      self.profiled.inc((endpoint,))
+
+  def render(self):
+    # Everything in the Prometheus text format
+    with self.lock:
+      metrics = (self.requests, self.duration, self.statements, self.sql_time,
+                 self.render_time, self.n_plus_one, self.profiled)
+      return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
@@ -0,0 +1,24 @@
+"""Add shows start_time index
+
+Revision ID: 4f1c2a9d7e3b
+Revises: b71f002d6064
+Create Date: 2026-10-18 10:12:44.180231
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2a9d7e3b'
+down_revision = 'b71f002d6064'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Shows_start_time_id', 'Shows', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Shows_start_time_id', table_name='Shows')
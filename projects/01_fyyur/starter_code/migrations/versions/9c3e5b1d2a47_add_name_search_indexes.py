@@ -0,0 +1,42 @@
+"""Add name search indexes
+
+Revision ID: 9c3e5b1d2a47
+Revises: 4f1c2a9d7e3b
+Create Date: 2026-10-18 11:03:27.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e5b1d2a47'
+down_revision = '4f1c2a9d7e3b'
+branch_labels = None
+depends_on = None
+
+# Trigram GIN indexes let Postgres answer ILIKE '%term%' and similarity()
+# without a sequential scan. Other backends search through the in-process
+# index in search.py instead, so there is nothing to create for them.
+INDEXES = [
+    ('ix_Venue_name_trgm', 'Venue', 'name'),
+    ('ix_Artist_name_trgm', 'Artist', 'name'),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in INDEXES:
+        op.create_index(name, table, [sa.text('"%s" gin_trgm_ops' % column)],
+                        postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for name, table, column in INDEXES:
+        op.drop_index(name, table_name=table)
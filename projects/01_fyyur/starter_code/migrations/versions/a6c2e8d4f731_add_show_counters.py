@@ -0,0 +1,52 @@
+"""Add upcoming/past show counters to venues and artists
+
+Revision ID: a6c2e8d4f731
+Revises: e3f7a2c9b104
+Create Date: 2026-10-18 15:22:09.614380
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c2e8d4f731'
+down_revision = 'e3f7a2c9b104'
+branch_labels = None
+depends_on = None
+
+# (counted table, its Shows foreign key)
+SIDES = [('Venue', 'venue_id'), ('Artist', 'artist_id')]
+
+
+def upgrade():
+    for table, _ in SIDES:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), nullable=False, server_default='0'))
+
+    counter = op.create_table('show_counter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('reconciled_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Count the existing shows as of now
+    now = datetime.now()
+    for table, show_fk in SIDES:
+        op.get_bind().execute(sa.text(
+            'UPDATE "{table}" SET '
+            'upcoming_shows_count = (SELECT count(*) FROM "Shows" WHERE "Shows".{fk} = "{table}".id AND start_time > :now), '
+            'past_shows_count = (SELECT count(*) FROM "Shows" WHERE "Shows".{fk} = "{table}".id AND start_time <= :now)'
+            .format(table=table, fk=show_fk)
+        ), now=now)
+    op.bulk_insert(counter, [{'id': 1, 'reconciled_at': now}])
+
+
+def downgrade():
+    op.drop_table('show_counter')
+    for table, _ in SIDES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
@@ -0,0 +1,32 @@
+"""Add venue coordinates and a geohash index
+
+Revision ID: b83e5d2f9a16
+Revises: c4e8a1f6b392
+Create Date: 2026-10-18 19:02:14.337518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83e5d2f9a16'
+down_revision = 'c4e8a1f6b392'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in by flask fyyur geocode
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
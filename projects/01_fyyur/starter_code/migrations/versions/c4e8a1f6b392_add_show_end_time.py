@@ -0,0 +1,51 @@
+"""Add Shows.end_time and keep venues and artists from double-booking
+
+Revision ID: c4e8a1f6b392
+Revises: f1d9b3a7c582
+Create Date: 2026-10-18 18:11:37.480926
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f6b392'
+down_revision = 'f1d9b3a7c582'
+branch_labels = None
+depends_on = None
+
+# Existing shows get the default length (config.SHOW_LENGTH_MINUTES)
+SHOW_LENGTH_MINUTES = 180
+
+# (constraint name, Shows foreign key)
+SIDES = [('ex_Shows_venue_id_overlap', 'venue_id'), ('ex_Shows_artist_id_overlap', 'artist_id')]
+
+
+def upgrade():
+    op.add_column('Shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        bind.execute(
+            "UPDATE \"Shows\" SET end_time = start_time + interval '%d minutes'" % SHOW_LENGTH_MINUTES)
+
+        # Fails if existing shows already overlap at a venue or for an artist;
+        # move or shorten them first. Needs btree_gist for the = on ids.
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for name, column in SIDES:
+            op.execute(
+                'ALTER TABLE "Shows" ADD CONSTRAINT "{name}" '
+                'EXCLUDE USING gist ({column} WITH =, tsrange(start_time, end_time) WITH &&)'
+                .format(name=name, column=column))
+    else:
+        bind.execute(
+            "UPDATE \"Shows\" SET end_time = datetime(start_time, '+%d minutes')" % SHOW_LENGTH_MINUTES)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, _ in SIDES:
+            op.drop_constraint(name, 'Shows')
+    with op.batch_alter_table('Shows') as batch_op:
+        batch_op.drop_column('end_time')
@@ -0,0 +1,95 @@
+"""Normalize genres
+
+Revision ID: d8a4f0c6b215
+Revises: 9c3e5b1d2a47
+Create Date: 2026-10-18 11:48:09.334187
+
+"""
+import csv
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a4f0c6b215'
+down_revision = '9c3e5b1d2a47'
+branch_labels = None
+depends_on = None
+
+# (entity table, association table, association entity column)
+ENTITIES = [
+    ('Venue', 'venue_genres', 'venue_id'),
+    ('Artist', 'artist_genres', 'artist_id'),
+]
+
+
+def parse_genres(value):
+    # '{Jazz,"Rock n Roll"}' (a Postgres array literal) -> ['Jazz', 'Rock n Roll']
+    value = (value or '').strip().lstrip('{').rstrip('}')
+    if not value:
+        return []
+    return [genre.strip() for genre in next(csv.reader([value])) if genre.strip()]
+
+
+def format_genres(names):
+    return '{%s}' % ','.join('"%s"' % name if (',' in name or ' ' in name) else name for name in names)
+
+
+def upgrade():
+    genre = op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    for table, association, column in ENTITIES:
+        op.create_table(association,
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.Column(column, sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+        sa.ForeignKeyConstraint([column], [table + '.id'], ),
+        sa.PrimaryKeyConstraint('genre_id', column)
+        )
+        op.create_index(op.f('ix_%s_%s' % (association, column)), association, [column], unique=False)
+
+    # Back-fill from the old array-literal strings
+    bind = op.get_bind()
+    genre_ids = {}
+    for table, association, column in ENTITIES:
+        rows = bind.execute(sa.text('SELECT id, genres FROM "%s"' % table)).fetchall()
+        links = []
+        for entity_id, genres in rows:
+            for name in parse_genres(genres):
+                if name not in genre_ids:
+                    bind.execute(genre.insert().values(name=name))
+                    genre_ids[name] = bind.execute(
+                        sa.select([genre.c.id]).where(genre.c.name == name)).scalar()
+                links.append({'genre_id': genre_ids[name], column: entity_id})
+        if links:
+            links_table = sa.table(association, sa.column('genre_id'), sa.column(column))
+            op.bulk_insert(links_table, list({(l['genre_id'], l[column]): l for l in links}.values()))
+
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('genres')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table, association, column in ENTITIES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('genres', sa.String(length=120), nullable=True))
+
+        rows = bind.execute(sa.text(
+            'SELECT a."%s", g.name FROM "%s" a JOIN "Genre" g ON g.id = a.genre_id ORDER BY a."%s", g.name'
+            % (column, association, column))).fetchall()
+        names = {}
+        for entity_id, name in rows:
+            names.setdefault(entity_id, []).append(name)
+        for entity_id, genres in names.items():
+            bind.execute(sa.text('UPDATE "%s" SET genres = :genres WHERE id = :id' % table),
+                         genres=format_genres(genres), id=entity_id)
+
+        op.drop_index(op.f('ix_%s_%s' % (association, column)), table_name=association)
+        op.drop_table(association)
+    op.drop_table('Genre')
@@ -0,0 +1,52 @@
+"""Index shows by venue/artist and start time, venues by area; cascade deletes
+
+Revision ID: e3f7a2c9b104
+Revises: d8a4f0c6b215
+Create Date: 2026-10-18 14:05:31.402816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f7a2c9b104'
+down_revision = 'd8a4f0c6b215'
+branch_labels = None
+depends_on = None
+
+# (column, referred table) of each Shows foreign key
+FOREIGN_KEYS = [('artist_id', 'Artist'), ('venue_id', 'Venue')]
+
+# Names batch mode gives the (unnamed) SQLite foreign keys it reflects
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def set_ondelete(ondelete):
+    if op.get_bind().dialect.name == 'sqlite':
+        # SQLite can't alter constraints, so the table is rebuilt with them
+        with op.batch_alter_table('Shows', recreate='always', naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referred in FOREIGN_KEYS:
+                name = 'fk_Shows_%s_%s' % (column, referred)
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+    else:
+        # Postgres' default names, as created by 2ba275d60148
+        for column, referred in FOREIGN_KEYS:
+            name = 'Shows_%s_fkey' % column
+            op.drop_constraint(name, 'Shows', type_='foreignkey')
+            op.create_foreign_key(name, 'Shows', referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    op.create_index('ix_Shows_venue_id_start_time', 'Shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Shows_artist_id_start_time', 'Shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_Venue_city_state', 'Venue', ['city', 'state'], unique=False)
+    set_ondelete('CASCADE')
+
+
+def downgrade():
+    set_ondelete(None)
+    op.drop_index('ix_Venue_city_state', table_name='Venue')
+    op.drop_index('ix_Shows_artist_id_start_time', table_name='Shows')
+    op.drop_index('ix_Shows_venue_id_start_time', table_name='Shows')
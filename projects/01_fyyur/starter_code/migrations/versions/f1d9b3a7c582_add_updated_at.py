@@ -0,0 +1,46 @@
+"""Add updated_at to venues and artists
+
+Revision ID: f1d9b3a7c582
+Revises: a6c2e8d4f731
+Create Date: 2026-10-18 17:04:51.208733
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1d9b3a7c582'
+down_revision = 'a6c2e8d4f731'
+branch_labels = None
+depends_on = None
+
+TABLES = ['Venue', 'Artist']
+
+
+def upgrade():
+    now = datetime.utcnow()
+    # The time in UTC, as the ORM writes it; now() is in the session's time
+    # zone on Postgres, while SQLite's CURRENT_TIMESTAMP is already UTC
+    if op.get_bind().dialect.name == 'postgresql':
+        default = sa.text("timezone('utc', now())")
+    else:
+        default = sa.func.now()
+
+    for table in TABLES:
+        # Existing rows count as last edited now, in UTC like new edits
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.get_bind().execute(sa.text('UPDATE "{table}" SET updated_at = :now'.format(table=table)), now=now)
+
+        # SQLite can't add a column with a non-constant default, so it is
+        # set afterwards (batch mode rebuilds the table there)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False, server_default=default)
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
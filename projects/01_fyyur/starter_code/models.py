@@ -1,7 +1,15 @@
+from datetime import datetime, timedelta
+
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from flask_migrate import Migrate
 from flask_moment import Moment
+from cache import Cache
+from metrics import Metrics
+from logs import Logs
+from engine import Database
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -10,16 +18,80 @@ from flask_moment import Moment
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = Database(app)
 migrate = Migrate(app, db)
+cache = Cache(app)
+metrics = Metrics(app)
+logs = Logs(app)
 
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+# Genre <-> entity association tables. The (genre_id, entity_id) primary key
+# doubles as the genre -> entities index used by the ?genre= filters.
+venue_genres = db.Table('venue_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True, index=True)
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True, index=True)
+)
+
+class utcnow(FunctionElement):
+    # The current time in UTC, as datetime.utcnow() gives it: now() is in
+    # the session's time zone on Postgres, CURRENT_TIMESTAMP is UTC on SQLite
+    type = db.DateTime()
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+def genres_named(names):
+    # Genre rows for the given names, creating any that don't exist yet.
+    # Missing ones are inserted straight away, skipping names another
+    # transaction has just added, so two submissions bringing the same new
+    # genre don't trip over its unique name.
+    names = list(dict.fromkeys(names or []))
+    if not names:
+        return []
+
+    genres = Genre.query.filter(Genre.name.in_(names)).all()
+    missing = set(names) - set(genre.name for genre in genres)
+    if missing:
+        db.session.execute(_insert_new(Genre.__table__), [{'name': name} for name in missing])
+        genres = Genre.query.filter(Genre.name.in_(names)).all()
+
+    by_name = dict((genre.name, genre) for genre in genres)
+    return [by_name[name] for name in names]
+
+def _insert_new(table):
+    # INSERT that skips rows clashing with a unique key (Postgres or SQLite)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('OR IGNORE')
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        # /venues groups venues by area
+        db.Index('ix_Venue_city_state', 'city', 'state'),
+        # /venues/nearby scans geohash prefixes
+        db.Index('ix_Venue_geohash', 'geohash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -31,13 +103,26 @@ class Venue(db.Model):
     facebook_link = db.Column(db.String(120))
 
     # New fields
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=venue_genres, lazy=True, order_by=Genre.name)
     website_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.Text)
 
-    # Connect to shows
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    # Connect to shows; the database deletes them along with the venue
+    shows = db.relationship('Show', backref='venue', lazy=True, passive_deletes='all')
+
+    # Shows starting after / up to ShowCounter.reconciled_at (see counters.py)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Last edit, in UTC; part of the page's version (see http_cache.py)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=utcnow())
+
+    # Set by flask fyyur geocode; geohash follows them (see geo.py)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+
     # This is past shows, upcoming shows, past shows count, upcoming shows count
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
@@ -50,7 +135,7 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres, lazy=True, order_by=Genre.name)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
 
@@ -59,15 +144,48 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.Text)
     
-    # Connect to shows
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    # Connect to shows; the database deletes them along with the artist
+    shows = db.relationship('Show', backref='artist', lazy=True, passive_deletes='all')
+
+    # Shows starting after / up to ShowCounter.reconciled_at (see counters.py)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Last edit, in UTC; part of the page's version (see http_cache.py)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=utcnow())
 
     # This is past shows, upcoming shows, past shows count, upcoming shows count
 
+def _default_end(context):
+  # SHOW_LENGTH_MINUTES after the start
+  start_time = context.get_current_parameters().get('start_time')
+  if start_time is None:
+    return None
+  return start_time + timedelta(minutes=app.config['SHOW_LENGTH_MINUTES'])
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
   __tablename__ = 'Shows'
+  __table_args__ = (
+    # Serves /shows ordering, its keyset cursor and the upcoming-only filter
+    db.Index('ix_Shows_start_time_id', 'start_time', 'id'),
+    # Serve the venue and artist pages' upcoming/past shows, already sorted
+    db.Index('ix_Shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Shows_artist_id_start_time', 'artist_id', 'start_time'),
+  )
+
   id = db.Column(db.Integer, primary_key=True)
   start_time = db.Column(db.DateTime)
-  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
\ No newline at end of file
+  # The venue and artist are booked until then; on Postgres exclusion
+  # constraints keep their shows from overlapping (see scheduling.py)
+  end_time = db.Column(db.DateTime, default=_default_end)
+  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+
+class ShowCounter(db.Model):
+  # Single row: the time up to which the Venue/Artist show counters have
+  # moved shows from upcoming to past (see counters.py)
+  __tablename__ = 'show_counter'
+
+  id = db.Column(db.Integer, primary_key=True)
+  reconciled_at = db.Column(db.DateTime, nullable=False)
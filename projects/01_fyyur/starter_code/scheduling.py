@@ -0,0 +1,144 @@
+#----------------------------------------------------------------------------#
+# Show scheduling: double-booking checks and venue availability.
+#----------------------------------------------------------------------------#
+
+# A show occupies its venue and its artist from start_time to end_time
+# (SHOW_LENGTH_MINUTES after the start unless given), and no two shows may
+# overlap at the same venue or for the same artist.
+#
+# The (venue_id, start_time) and (artist_id, start_time) indexes double as
+# the interval index: as no show is longer than MAX_SHOW_LENGTH, the only
+# shows that can overlap [start, end) are those starting in
+# (start - MAX_SHOW_LENGTH, end), a single index range per side. On
+# Postgres, exclusion constraints (migration c4e8a1f6b392) enforce the same
+# rule, so two concurrent bookings can't both get in; book() checks first
+# to name the conflicting shows.
+
+from bisect import bisect_left
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Venue, Artist, Show
+
+MAX_SHOW_LENGTH = timedelta(hours=24)
+MAX_AVAILABILITY_RANGE = timedelta(days=92)
+MAX_REPEAT = 52
+
+# side -> (model, Shows foreign key)
+SIDES = {
+  'venue': (Venue, Show.venue_id),
+  'artist': (Artist, Show.artist_id)
+}
+
+
+class SchedulingError(ValueError):
+  pass
+
+
+class BookingConflict(SchedulingError):
+  # conflicts: (side, show) pairs, show being an (id, start_time, end_time) row
+
+  def __init__(self, conflicts):
+    self.conflicts = conflicts
+    super(BookingConflict, self).__init__('; '.join(
+      'the %s is already booked from %s to %s (show %d)' % (
+        side, show.start_time.strftime('%Y-%m-%d %H:%M'), show.end_time.strftime('%Y-%m-%d %H:%M'), show.id)
+      for side, show in conflicts
+    ) or 'the venue or artist is already booked at that time')
+
+
+def show_length():
+  return timedelta(minutes=current_app.config['SHOW_LENGTH_MINUTES'])
+
+
+def bookings(side, id, start, end):
+  # The shows of one venue/artist overlapping [start, end), by start time
+  column = SIDES[side][1]
+  return db.session.query(Show.id, Show.start_time, Show.end_time) \
+    .filter(
+      column == id,
+      Show.start_time > start - MAX_SHOW_LENGTH,
+      Show.start_time < end,
+      Show.end_time > start
+    ) \
+    .order_by(Show.start_time) \
+    .all()
+
+
+def conflicts(venue_id, artist_id, slots):
+  # The booked shows overlapping any of slots, (start, end) pairs sorted
+  # and disjoint, as (side, show) pairs: one range scan per side over the
+  # span of the run, then a binary search per booked show
+  starts = [start for start, _ in slots]
+  found = []
+
+  for side, id in (('venue', venue_id), ('artist', artist_id)):
+    for show in bookings(side, id, slots[0][0], slots[-1][1]):
+      # The last slot starting before the show ends is the only one that
+      # can overlap it without an earlier slot overlapping it too
+      i = bisect_left(starts, show.end_time)
+      if i and slots[i - 1][1] > show.start_time:
+        found.append((side, show))
+
+  return found
+
+
+def run_slots(start, end=None, repeat=1, every=timedelta(weeks=1)):
+  # The (start, end) slots of a run of repeat shows, every apart
+  end = end or start + show_length()
+  if end <= start:
+    raise SchedulingError('a show must end after it starts')
+  if end - start > MAX_SHOW_LENGTH:
+    raise SchedulingError('a show can last at most %d hours' % (MAX_SHOW_LENGTH.total_seconds() // 3600))
+  if not 1 <= repeat <= MAX_REPEAT:
+    raise SchedulingError('a run has between 1 and %d shows' % MAX_REPEAT)
+  if repeat > 1 and every < end - start:
+    raise SchedulingError('the shows of a run would overlap each other')
+
+  return [(start + i * every, end + i * every) for i in range(repeat)]
+
+
+def book(venue_id, artist_id, start, end=None, repeat=1, every=timedelta(weeks=1)):
+  # Add a show, or a run of repeat shows every apart, in one transaction.
+  # Raises SchedulingError (BookingConflict for double bookings) and adds
+  # nothing if any of them can't be booked.
+  slots = run_slots(start, end, repeat, every)
+
+  for side, id in (('venue', venue_id), ('artist', artist_id)):
+    model = SIDES[side][0]
+    if not db.session.query(db.session.query(model).filter(model.id == id).exists()).scalar():
+      raise SchedulingError('%s %s does not exist' % (side, id))
+
+  found = conflicts(venue_id, artist_id, slots)
+  if found:
+    raise BookingConflict(found)
+
+  shows = [Show(venue_id=venue_id, artist_id=artist_id, start_time=start, end_time=end) for start, end in slots]
+  db.session.add_all(shows)
+  try:
+    db.session.commit()
+  except IntegrityError:
+    # Lost a race with a concurrent booking (Postgres exclusion constraint)
+    db.session.rollback()
+    raise BookingConflict([])
+  return shows
+
+
+def availability(venue_id, start, end):
+  # The free (start, end) slots of a venue between start and end
+  if end <= start:
+    raise SchedulingError('to must be after from')
+  if end - start > MAX_AVAILABILITY_RANGE:
+    raise SchedulingError('at most %d days at a time' % MAX_AVAILABILITY_RANGE.days)
+
+  free = []
+  cursor = start
+  for show in bookings('venue', venue_id, start, end):
+    if show.start_time > cursor:
+      free.append((cursor, show.start_time))
+    cursor = max(cursor, show.end_time)
+  if cursor < end:
+    free.append((cursor, end))
+  return free
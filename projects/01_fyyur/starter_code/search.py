@@ -0,0 +1,284 @@
+#----------------------------------------------------------------------------#
+# Venue and artist name search.
+#----------------------------------------------------------------------------#
+
+# On Postgres, searches run as ILIKE filters served by the pg_trgm GIN
+# indexes on "name" (see the add_name_search_indexes migration) and are
+# ranked by trigram similarity. SQLite has no trigram indexes, so there the
+# names are held in an in-process trigram inverted index instead and only
+# the best matching rows are read back from the database.
+#
+# The index is shared by the server's threads, so every read and change
+# holds its lock. ORM writes reach it when their transaction commits (a
+# rolled back delete leaves the name in place). Rows added outside the ORM
+# are caught up by id on the next search, and since ids can commit out of
+# order across processes the whole index is rebuilt every INDEX_TTL
+# seconds. Both read committed rows only, on a connection of their own.
+
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from models import db, Venue, Artist
+
+# Most rows a single search returns; "count" still reports every match
+SEARCH_LIMIT = 100
+
+# Seconds before an index is rebuilt from the database
+INDEX_TTL = 300
+
+# Rows added to an index per hold of its lock while loading
+LOAD_BATCH = 1000
+
+
+def _trigrams(text):
+  # Every trigram of text; each one occurs in any string containing text
+  return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TrigramIndex(object):
+  # In-memory inverted index from name trigram to the ids containing it
+
+  def __init__(self):
+    self.names = {}
+    self.postings = defaultdict(set)
+    self.max_id = 0
+    self.built_at = time.time()
+    self.ready = threading.Event()
+    self.lock = threading.Lock()
+    # Ids changed by commits while load() runs, and how many loads run
+    self.changed = set()
+    self.loading = 0
+
+  def add(self, id, name):
+    with self.lock:
+      self._changed(id)
+      self._add(id, name)
+
+  def remove(self, id):
+    with self.lock:
+      self._changed(id)
+      self._remove(id)
+
+  def load(self, rows):
+    # Add (id, name) rows read from the database, skipping ids a commit has
+    # changed since (the commit's name is the newer one)
+    with self.lock:
+      self.loading += 1
+    try:
+      for batch in iter(lambda: rows.fetchmany(LOAD_BATCH), []):
+        with self.lock:
+          for id, name in batch:
+            if id not in self.changed:
+              self._add(id, name)
+    finally:
+      with self.lock:
+        self.loading -= 1
+        if not self.loading:
+          self.changed.clear()
+
+  def _changed(self, id):
+    if self.loading:
+      self.changed.add(id)
+
+  def _add(self, id, name):
+    self._remove(id)
+    name = (name or '').lower()
+    self.names[id] = name
+    for gram in _trigrams(name):
+      self.postings[gram].add(id)
+    self.max_id = max(self.max_id, id)
+
+  def _remove(self, id):
+    name = self.names.pop(id, None)
+    if name is None:
+      return
+    for gram in _trigrams(name):
+      posting = self.postings.get(gram)
+      if posting is not None:
+        posting.discard(id)
+        if not posting:
+          del self.postings[gram]
+
+  def search(self, term):
+    # (id, lowercased name) of the names containing term
+    # (case-insensitive), unordered
+    term = term.lower()
+    grams = _trigrams(term)
+
+    with self.lock:
+      if not grams:
+        # Too short for a trigram lookup; the names are already in memory
+        return [(id, name) for id, name in self.names.items() if term in name]
+
+      postings = [self.postings.get(gram) for gram in grams]
+      if not all(postings):
+        return []
+
+      postings.sort(key=len)
+      candidates = set(postings[0])
+      for posting in postings[1:]:
+        candidates &= posting
+        if not candidates:
+          return []
+
+      return [(id, self.names[id]) for id in candidates if term in self.names[id]]
+
+
+# One index per (engine, model), built on first use and rebuilt when stale;
+# a rebuild fills a new index while the old one keeps serving
+_indexes = {}
+_building = {}
+_indexes_lock = threading.Lock()
+
+
+def _load(index, model, after=0):
+  # Add model's committed rows with id > after; a connection of its own
+  # keeps the session's flushed but uncommitted rows out
+  with db.engine.connect() as connection:
+    index.load(connection.execution_options(stream_results=True).execute(
+      select([model.id, model.name]).where(model.id > after)))
+
+
+def _index_for(model):
+  key = (db.engine, model)
+  with _indexes_lock:
+    index = _indexes.get(key)
+    fresh = _building.get(key)
+    build = fresh is None and (index is None or time.time() - index.built_at >= INDEX_TTL)
+    if build:
+      fresh = _building[key] = TrigramIndex()
+
+  if build:
+    try:
+      _load(fresh, model)
+      with _indexes_lock:
+        _indexes[key] = fresh
+    finally:
+      with _indexes_lock:
+        del _building[key]
+      fresh.ready.set()
+    return fresh
+
+  if index is None:
+    # Another thread is building the first one
+    fresh.ready.wait()
+    return _index_for(model)
+
+  # Pick up rows appended outside the ORM (bulk inserts, other processes)
+  _load(index, model, index.max_id)
+  return index
+
+
+#  Keeping built indexes current with ORM writes
+#  ----------------------------------------------------------------
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+  # Note what this flush changed, applied once the transaction commits
+  changes = session.info.setdefault('search_changes', [])
+  engine = session.get_bind()
+  for entity in list(session.new) + list(session.dirty):
+    if isinstance(entity, (Venue, Artist)):
+      changes.append((engine, type(entity), entity.id, entity.name))
+  for entity in session.deleted:
+    if isinstance(entity, (Venue, Artist)):
+      changes.append((engine, type(entity), entity.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply(session):
+  for engine, model, id, name in session.info.pop('search_changes', None) or ():
+    # The serving index, and the one replacing it if a rebuild is running
+    for index in (_indexes.get((engine, model)), _building.get((engine, model))):
+      if index is None:
+        continue
+      if name is None:
+        index.remove(id)
+      else:
+        index.add(id, name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+  session.info.pop('search_changes', None)
+
+
+def _rows(model):
+  # id, name and number of upcoming shows (from the counters), per entity
+  return db.session.query(model.id, model.name, model.upcoming_shows_count.label('num_upcoming_shows'))
+
+
+def _escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_queries(model, term, limit=SEARCH_LIMIT):
+  # (count, rows) queries of a SQL-side search, for Postgres
+  name_filter = model.name.ilike('%' + _escape_like(term) + '%', escape='\\')
+
+  count = db.session.query(func.count(model.id)).filter(name_filter)
+
+  query = _rows(model).filter(name_filter)
+  if db.engine.dialect.name == 'postgresql':
+    query = query.order_by(func.similarity(model.name, term).desc(), model.name, model.id)
+  else:
+    query = query.order_by(model.name, model.id)
+
+  return count, query.limit(limit)
+
+
+def _search_sql(model, term, limit):
+  count, query = search_queries(model, term, limit)
+  return count.scalar(), query.all()
+
+
+def _search_index(model, term, limit):
+  matches = _index_for(model).search(term)
+
+  # Every candidate contains the whole term, so its trigram similarity
+  # falls as the name grows; rank names starting with the term first, then
+  # by length, which orders like similarity() without building gram sets
+  term = term.lower()
+  top = [id for id, _ in heapq.nsmallest(
+    limit,
+    matches,
+    key=lambda match: (not match[1].startswith(term), len(match[1]), match[1], match[0])
+  )]
+  if not top:
+    return len(matches), []
+
+  # The index only proposes ids; the database decides what still matches
+  rows = _rows(model).filter(model.id.in_(top)).all()
+  found = dict((row.id, row) for row in rows if term in (row.name or '').lower())
+
+  return len(matches) - (len(top) - len(found)), [found[id] for id in top if id in found]
+
+
+def _search(model, term, limit):
+  term = (term or '').strip()
+
+  if db.engine.dialect.name == 'sqlite':
+    count, data = _search_index(model, term, limit)
+  else:
+    count, data = _search_sql(model, term, limit)
+
+  return {
+    'count': count,
+    'data': data
+  }
+
+
+def search_venues(term, limit=SEARCH_LIMIT):
+  # Ranked, de-duplicated venues whose name contains term, each with its
+  # num_upcoming_shows, as {'count': ..., 'data': [...]}
+  return _search(Venue, term, limit)
+
+
+def search_artists(term, limit=SEARCH_LIMIT):
+  # Same as search_venues() for artists
+  return _search(Artist, term, limit)
@@ -0,0 +1,653 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+
+from app import app
+from models import db, cache, metrics, Venue, Artist, Show, genres_named
+from details import load_venue, load_artist
+from listings import venue_areas, artist_rows, show_page, decode_show_cursor
+import search
+import counters
+import geo
+import facets
+import asgi
+from importer import fyyur_cli
+from logs import BoundedQueueHandler, JsonFormatter
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the Fyyur test case"""
+
+    def setUp(self):
+        """Point the app at an in-memory database and create the tables."""
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['TESTING'] = True
+        self.client = app.test_client
+
+        db.create_all()
+        cache.clear()
+        facets.invalidate()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+
+    def add_shows(self, count):
+        """Add a venue and an artist with `count` shows, half of them upcoming."""
+        venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', genres=genres_named(['Jazz', 'Folk']))
+        artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', genres=genres_named(['Rock n Roll']))
+        db.session.add_all([venue, artist])
+        db.session.flush()
+
+        now = datetime.now()
+        for i in range(count):
+            offset = timedelta(days=i + 1)
+            db.session.add(Show(
+                venue_id=venue.id,
+                artist_id=artist.id,
+                start_time=now + offset if i % 2 else now - offset
+            ))
+        db.session.commit()
+
+        return venue.id, artist.id
+
+    def count_queries(self, fn, *args):
+        """Call fn(*args) and return (result, number of SQL statements run)."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = fn(*args)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        return result, len(statements)
+
+    def query_plans(self, path):
+        """GET path and return the EXPLAIN QUERY PLAN details of every SELECT it ran."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(path)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(res.status_code, 200)
+
+        connection = db.engine.raw_connection()
+        try:
+            return [
+                detail
+                for statement, parameters in statements
+                for (_, _, _, detail) in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            ]
+        finally:
+            connection.close()
+
+    def assertUsesIndex(self, path, index):
+        plans = self.query_plans(path)
+        self.assertTrue(any(re.search(r'INDEX %s\b' % index, detail) for detail in plans), plans)
+        self.assertFalse(any(detail.startswith('SCAN Shows') for detail in plans), plans)
+
+    # Test that loading a venue page doesn't cost more queries with more shows
+    def test_load_venue_query_count(self):
+        venue_id, _ = self.add_shows(2)
+        db.session.expunge_all()
+        data, few = self.count_queries(load_venue, venue_id)
+        self.assertEqual(data['upcoming_shows_count'], 1)
+
+        venue_id, _ = self.add_shows(100)
+        db.session.expunge_all()
+        data, many = self.count_queries(load_venue, venue_id)
+
+        self.assertEqual(data['upcoming_shows_count'], 50)
+        self.assertEqual(data['past_shows_count'], 50)
+        self.assertEqual(data['upcoming_shows'][0]['artist_name'], 'Guns N Petals')
+        self.assertEqual(data['genres'], ['Folk', 'Jazz'])
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 3)
+
+    # Test that loading an artist page doesn't cost more queries with more shows
+    def test_load_artist_query_count(self):
+        _, artist_id = self.add_shows(2)
+        db.session.expunge_all()
+        data, few = self.count_queries(load_artist, artist_id)
+        self.assertEqual(data['past_shows_count'], 1)
+
+        _, artist_id = self.add_shows(100)
+        db.session.expunge_all()
+        data, many = self.count_queries(load_artist, artist_id)
+
+        self.assertEqual(data['upcoming_shows_count'], 50)
+        self.assertEqual(data['past_shows'][0]['venue_name'], 'The Musical Hop')
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 3)
+
+    # Test that keyset pages of /shows cover every show exactly once
+    def test_show_page_keyset(self):
+        self.add_shows(25)
+
+        seen = []
+        shows, cursor = show_page(limit=10)
+        seen.extend(show.id for show in shows)
+        while cursor:
+            shows, cursor = show_page(after=decode_show_cursor(cursor), limit=10)
+            seen.extend(show.id for show in shows)
+
+        upcoming, _ = show_page(upcoming=True, limit=100)
+
+        self.assertEqual(sorted(seen), list(range(1, 26)))
+        self.assertEqual(len(upcoming), 12)
+
+    # Test that artist search returns each artist once with its show count
+    def test_search_artists_distinct(self):
+        self.add_shows(10)
+        db.session.add(Artist(name='The Wild Sax Band'))
+        db.session.commit()
+
+        results = search.search_artists('petals')
+        everyone = search.search_artists('')
+
+        self.assertEqual(results['count'], 1)
+        self.assertEqual(results['data'][0].name, 'Guns N Petals')
+        self.assertEqual(results['data'][0].num_upcoming_shows, 5)
+        self.assertEqual(everyone['count'], 2)
+
+        # The index follows committed writes only
+        db.session.delete(Artist.query.filter_by(name='The Wild Sax Band').one())
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(search.search_artists('sax')['count'], 1)
+        Artist.query.filter_by(name='The Wild Sax Band').one().name = 'The Wild Horn Band'
+        db.session.commit()
+        self.assertEqual((search.search_artists('sax')['count'], search.search_artists('horn')['count']), (0, 1))
+
+        # A row committed behind the id watermark turns up once the index is rebuilt
+        db.session.execute(Artist.__table__.insert().values(id=10, name='Early Commit'))
+        db.session.commit()
+        self.assertEqual(search.search_artists('early')['count'], 1)
+        db.session.execute(Artist.__table__.insert().values(id=5, name='Late Commit'))
+        db.session.commit()
+        self.assertEqual(search.search_artists('late')['count'], 0)
+        search.INDEX_TTL, ttl = 0, search.INDEX_TTL
+        self.addCleanup(setattr, search, 'INDEX_TTL', ttl)
+        self.assertEqual(search.search_artists('late')['count'], 1)
+
+    # Test the ?genre= filters on the venue and artist listings
+    def test_genre_filter(self):
+        self.add_shows(0)
+        db.session.add(Venue(name='Dueling Pianos', city='New York', state='NY', genres=genres_named(['Classical'])))
+        db.session.commit()
+
+        jazz = list(venue_areas(genre='Jazz'))
+        classical = list(venue_areas(genre='Classical'))
+
+        self.assertEqual([area['city'] for area in jazz], ['San Francisco'])
+        self.assertEqual(classical[0]['venues'][0]['name'], 'Dueling Pianos')
+        self.assertEqual([a.name for a in artist_rows(genre='Rock n Roll')], ['Guns N Petals'])
+        self.assertEqual(list(artist_rows(genre='Jazz')), [])
+
+        # A genre another submission commits between the lookup and the insert
+        raced = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if re.match(r'INSERT .*INTO "Genre"', statement) and not raced:
+                raced.append(statement)
+                cursor.execute('INSERT INTO "Genre" (name) VALUES (?)', ('Blues',))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            blues = genres_named(['Blues', 'Jazz'])
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual([genre.name for genre in blues], ['Blues', 'Jazz'])
+        self.assertEqual(len(genres_named(['Blues'])), 1)
+
+    # Test that pages with show times render through the datetime filter
+    def test_shows_page(self):
+        venue_id, _ = self.add_shows(4)
+        res = self.client().get('/shows')
+        venue = self.client().get('/venues/%d' % venue_id)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Guns N Petals', res.data)
+        self.assertEqual(venue.status_code, 200)
+        self.assertIn(b'2 Upcoming Shows', venue.data)
+
+    # Test that cached pages are dropped by the writes that affect them
+    def test_page_cache_invalidation(self):
+        venue_id, artist_id = self.add_shows(2)
+
+        self.assertIn(b'The Musical Hop', self.client().get('/artists/%d' % artist_id).data)
+        self.assertIn(b'The Musical Hop', self.client().get('/venues').data)
+
+        # Changed behind the cache's back: still served from the cache
+        Venue.query.get(venue_id).name = 'The Musical Skip'
+        db.session.commit()
+        self.assertIn(b'The Musical Hop', self.client().get('/venues').data)
+
+        res = self.client().post('/venues/%d/edit' % venue_id, data={'name': 'The Musical Jump'})
+        self.assertEqual(res.status_code, 302)
+
+        self.assertIn(b'The Musical Jump', self.client().get('/artists/%d' % artist_id).data)
+        self.assertIn(b'The Musical Jump', self.client().get('/venues').data)
+
+    # Test detail pages for missing records
+    def test_show_venue_404(self):
+        res = self.client().get('/venues/1000')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_import(self):
+        files = {
+            'venues.jsonl': '{"id": "v1", "name": "The Musical Hop", "genres": ["Jazz"], "address": "1015 Folsom Street", '
+                            '"city": "San Francisco", "state": "CA", "website_link": "https://hop.example", '
+                            '"facebook_link": "https://facebook.com/hop", "seeking_talent": true}\n'
+                            '{"id": "v2", "name": "No Links", "genres": ["Jazz"], "address": "1 Main St", '
+                            '"city": "San Francisco", "state": "CA"}\n',
+            'artists.csv': 'id,name,genres,city,state,website_link,facebook_link,seeking_venue\n'
+                           'a1,Guns N Petals,Rock n Roll;Folk,San Francisco,CA,https://gnp.example,https://facebook.com/gnp,true\n',
+            'shows.csv': 'venue_id,artist_id,start_time\n'
+                         'v1,a1,2035-04-01T20:00:00.000Z\n'
+                         'v1,a1,2035-04-08 20:00:00\n'
+                         'v2,a1,2035-04-15 20:00:00\n'
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            args = ['import', '--chunk-size', '1']
+            for name, content in files.items():
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write(content)
+                args += ['--' + name.split('.')[0], os.path.join(directory, name)]
+
+            result = app.test_cli_runner().invoke(fyyur_cli, args)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('venues: 1 loaded, 1 rejected', result.output)
+        self.assertIn('shows: 2 loaded, 1 rejected', result.output)
+
+        venue = Venue.query.one()
+        artist = Artist.query.one()
+        self.assertTrue(venue.seeking_talent)
+        self.assertEqual([genre.name for genre in artist.genres], ['Folk', 'Rock n Roll'])
+        self.assertEqual(
+            [(show.venue_id, show.artist_id, show.start_time) for show in Show.query.order_by(Show.start_time)],
+            [(venue.id, artist.id, datetime(2035, 4, 1, 20)), (venue.id, artist.id, datetime(2035, 4, 8, 20))])
+
+    def test_export(self):
+        venue_id, artist_id = self.add_shows(4)
+
+        res = self.client().get('/export/venues.csv')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        header, row = res.get_data(as_text=True).splitlines()
+        self.assertTrue(header.startswith('id,name,'))
+        self.assertTrue(row.endswith(',Folk;Jazz'))
+
+        res = self.client().get('/export/shows.ndjson?after=2')
+        records = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+        self.assertEqual([record['id'] for record in records], [3, 4])
+        self.assertEqual(records[0]['venue_id'], venue_id)
+
+        self.assertEqual(self.client().get('/export/shows.ndjson?after=x').status_code, 400)
+        self.assertEqual(self.client().get('/export/genres.csv').status_code, 404)
+
+    # Test that each route's queries are served by the intended index
+    def test_query_plans(self):
+        venue_id, artist_id = self.add_shows(4)
+
+        self.assertUsesIndex('/venues', 'ix_Venue_city_state')
+        self.assertUsesIndex('/venues/%d' % venue_id, 'ix_Shows_venue_id_start_time')
+        self.assertUsesIndex('/artists/%d' % artist_id, 'ix_Shows_artist_id_start_time')
+        self.assertUsesIndex('/shows', 'ix_Shows_start_time_id')
+        self.assertUsesIndex('/shows?upcoming=1', 'ix_Shows_start_time_id')
+
+    def test_delete_venue_cascades(self):
+        venue_id, artist_id = self.add_shows(4)
+        self.client().get('/artists/%d' % artist_id)
+
+        res = self.client().post('/venues/%d' % venue_id)
+
+        self.assertEqual(res.status_code, 302)
+        self.assertIsNone(Venue.query.get(venue_id))
+        self.assertEqual(Show.query.count(), 0)
+        self.assertNotIn(b'The Musical Hop', self.client().get('/artists/%d' % artist_id).data)
+
+    # Test that the show counters follow ORM writes, deletes and the clock
+    def test_show_counters(self):
+        venue_id, artist_id = self.add_shows(4)
+        venue = Venue.query.get(venue_id)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (2, 2))
+
+        show = Show.query.filter(Show.start_time > datetime.now()).first()
+        show.start_time = datetime.now() - timedelta(days=30)
+        db.session.delete(Show.query.filter(Show.start_time > datetime.now()).first())
+        db.session.commit()
+        db.session.refresh(venue)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (0, 3))
+
+        db.session.add(Show(venue_id=venue_id, artist_id=artist_id, start_time=datetime.now() + timedelta(hours=1)))
+        db.session.commit()
+        self.assertEqual(counters.reconcile(datetime.now() + timedelta(hours=2)), 1)
+        db.session.refresh(venue)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (0, 4))
+
+        # Deleting the venue cascades its shows away from the artist's counts
+        artist = Artist.query.get(artist_id)
+        db.session.delete(venue)
+        db.session.commit()
+        db.session.refresh(artist)
+        self.assertEqual((artist.upcoming_shows_count, artist.past_shows_count), (0, 0))
+        self.assertEqual(Show.query.count(), 0)
+
+    def test_recount(self):
+        venue_id, artist_id = self.add_shows(6)
+        Venue.query.update({'upcoming_shows_count': 100, 'past_shows_count': 100})
+        db.session.commit()
+
+        counters.recount()
+        venue = Venue.query.get(venue_id)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (3, 3))
+        self.assertEqual(search.search_venues('hop')['data'][0].num_upcoming_shows, 3)
+
+    def asgi_request(self, method, path, query_string=b'', body=b'', headers=()):
+        """Call the ASGI app once and return (status, body); the response
+        headers are left in self.asgi_headers."""
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+                 'headers': list(headers), 'http_version': '1.1'}
+        asyncio.run(asgi.application(scope, receive, send))
+        self.asgi_headers = dict((name.decode('latin-1').lower(), value.decode('latin-1'))
+                                 for name, value in sent[0]['headers'])
+        return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+    # Test that ASGI mode renders the same pages and hands the rest to Flask
+    def test_asgi(self):
+        venue_id, artist_id = self.add_shows(4)
+
+        for path in ['/', '/venues', '/artists', '/shows', '/venues/%d' % venue_id,
+                     '/artists/%d' % artist_id, '/venues/1000', '/venues/create']:
+            cache.clear()
+            res = self.client().get(path)
+            # Empty again, so the async handlers render rather than replay Flask's page
+            cache.clear()
+            self.assertEqual(self.asgi_request('GET', path), (res.status_code, res.data), path)
+
+        status, body = self.asgi_request('POST', '/artists/search', body=b'search_term=petals',
+                                         headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+        self.assertEqual(status, 200)
+        self.assertIn(b'Number of search results for "petals": 1', body)
+        self.assertEqual(self.asgi_request('GET', '/shows', b'after=x')[0], 400)
+
+    def test_api(self):
+        venue_id, artist_id = self.add_shows(5)
+
+        res = self.client().get('/api/v1/venues/%d?fields=name,genres,upcoming_shows_count' % venue_id)
+        self.assertEqual(res.get_json(), {'name': 'The Musical Hop', 'genres': ['Folk', 'Jazz'], 'upcoming_shows_count': 2})
+
+        # Cursor pagination walks every show once, in start time order
+        seen, after = [], ''
+        while after is not None:
+            page = self.client().get('/api/v1/shows?limit=2&fields=id,start_time&after=' + after).get_json()
+            seen += page['data']
+            after = page['next']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen, key=lambda show: show['start_time']))
+
+        res = self.client().get('/api/v1/artists')
+        again = self.client().get('/api/v1/artists', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+        # Booking a show updates the counts in the cached lists
+        counts = lambda resource: self.client().get('/api/v1/%s?fields=upcoming_shows_count' % resource).get_json()['data']
+        self.assertEqual((counts('venues'), counts('artists')), ([{'upcoming_shows_count': 2}], [{'upcoming_shows_count': 2}]))
+        start = datetime.now() + timedelta(days=30)
+        self.client().post('/shows/create', data=dict(venue_id=venue_id, artist_id=artist_id, start_time=start.strftime('%Y-%m-%d %H:%M:%S')))
+        self.assertEqual((counts('venues'), counts('artists')), ([{'upcoming_shows_count': 3}], [{'upcoming_shows_count': 3}]))
+
+        self.assertEqual(self.client().get('/api/v1/venues?fields=nope').status_code, 400)
+        self.assertEqual(self.client().get('/api/v1/shows?after=nope').status_code, 400)
+        self.assertEqual(self.client().get('/api/v1/artists/1000').status_code, 404)
+
+    # Test the caching headers and that a current ETag gets a 304
+    def test_conditional_get(self):
+        venue_id, artist_id = self.add_shows(2)
+        path = '/venues/%d' % venue_id
+
+        res = self.client().get(path)
+        etag = res.headers['ETag']
+        self.assertIn('no-cache', res.headers['Cache-Control'])
+        self.assertIn('Last-Modified', res.headers)
+        self.assertIn('max-age=60', self.client().get('/venues').headers['Cache-Control'])
+
+        res = self.client().get(path, headers={'If-None-Match': etag})
+        self.assertEqual((res.status_code, res.data), (304, b''))
+        self.assertEqual(self.asgi_request('GET', path, headers=[(b'if-none-match', etag.encode())]), (304, b''))
+
+        # Editing the artist renames it on the venue page; a new show changes its counts
+        self.client().post('/artists/%d/edit' % artist_id, data={'name': 'Guns N Roses'})
+        res = self.client().get(path, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Guns N Roses', res.data)
+
+        etag = res.headers['ETag']
+        db.session.add(Show(venue_id=venue_id, artist_id=artist_id, start_time=datetime.now() + timedelta(days=9)))
+        db.session.commit()
+        self.assertEqual(self.client().get(path, headers={'If-None-Match': etag}).status_code, 200)
+
+        # Shows starting change the version without touching the page cache;
+        # the cached body must not be served under the new ETag
+        self.assertIn(b'2 Upcoming Shows', self.client().get(path).data)
+        self.assertIn(b'2 Upcoming Shows', self.asgi_request('GET', path)[1])
+        db.session.execute(Show.__table__.update().values(start_time=datetime.now() - timedelta(hours=1)))
+        db.session.commit()
+
+        res = self.client().get(path)
+        self.assertIn(b'0 Upcoming Shows', res.data)
+        self.assertIn(b'0 Upcoming Shows', self.asgi_request('GET', path)[1])
+        res = self.client().get(path, headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    # Test that shows can't double-book and that runs are all or nothing
+    def test_scheduling(self):
+        venue_id, artist_id = self.add_shows(2)
+        booked = Show.query.filter(Show.start_time > datetime.now()).one()
+        start = booked.start_time
+
+        def create(start_time, **fields):
+            data = dict(venue_id=venue_id, artist_id=artist_id, start_time=start_time.strftime('%Y-%m-%d %H:%M:%S'))
+            data.update(fields)
+            res = self.client().post('/shows/create', data=data)
+            self.assertEqual(res.status_code, 200)
+            return Show.query.count()
+
+        self.assertEqual(create(start + timedelta(hours=1)), 2)
+        self.assertEqual(create(start - timedelta(hours=3)), 3)
+        # The second week of this run clashes, so none of it is listed
+        self.assertEqual(create(start - timedelta(days=7, hours=1), repeat=3), 3)
+        self.assertEqual(create(start + timedelta(days=1), repeat=3), 6)
+        self.assertEqual(create(start + timedelta(days=30), venue_id=1000), 6)
+
+        res = self.client().get('/venues/%d/availability?from=%s&to=%s' % (
+            venue_id, start.isoformat(), (start + timedelta(days=1)).isoformat()))
+        self.assertEqual(res.get_json()['free'], [{
+            'start': (start + timedelta(hours=3)).isoformat(),
+            'end': (start + timedelta(days=1)).replace(microsecond=0).isoformat()
+        }])
+        self.assertEqual(self.client().get('/venues/%d/availability?from=nope' % venue_id).status_code, 400)
+        self.assertEqual(self.client().get('/venues/1000/availability').status_code, 404)
+        self.assertUsesIndex('/venues/%d/availability' % venue_id, 'ix_Shows_venue_id_start_time')
+
+    # Test the request metrics, N+1 detection and slow request profiles
+    def test_metrics(self):
+        venue_id, artist_id = self.add_shows(2)
+        profiles = tempfile.mkdtemp()
+        app.config.update(METRICS_ENABLED=True, METRICS_N_PLUS_ONE=3, PROFILE_THRESHOLD_MS=0, PROFILE_DIR=profiles)
+        self.addCleanup(app.config.update, METRICS_ENABLED=False, METRICS_N_PLUS_ONE=10, PROFILE_THRESHOLD_MS=None)
+
+        res = self.client().get('/venues/%d' % venue_id)
+        self.assertRegex(res.headers['Server-Timing'], r'sql;dur=[\d.]+;desc="\d+ statements", tpl;dur=[\d.]+')
+
+        # Booking a run adds its shows one by one
+        self.client().post('/shows/create', data={'venue_id': venue_id, 'artist_id': artist_id, 'repeat': 3,
+                                                  'start_time': '2030-01-01 20:00:00'})
+
+        text = self.client().get('/_debug/metrics').data.decode()
+        self.assertIn('fyyur_requests_total{endpoint="show_venue",method="GET",status="200"} 1', text)
+        self.assertIn('fyyur_request_sql_statements_bucket{endpoint="show_venue",le="+Inf"} 1', text)
+        self.assertIn('fyyur_n_plus_one_total{endpoint="create_show_submission"} 1', text)
+        self.assertNotIn('fyyur_n_plus_one_total{endpoint="show_venue"}', text)
+        self.assertTrue(any('-show_venue-' in name for name in os.listdir(profiles)))
+
+        # The ASGI read routes skip Flask's hooks but are counted all the same
+        self.assertEqual(self.asgi_request('GET', '/venues')[0], 200)
+        self.assertRegex(self.asgi_headers['server-timing'], r'sql;dur=[\d.]+;desc="\d+ statements"')
+        text = self.client().get('/_debug/metrics').data.decode()
+        self.assertIn('fyyur_requests_total{endpoint="venues",method="GET",status="200"} 1', text)
+
+        app.config['METRICS_ENABLED'] = False
+        self.assertEqual(self.client().get('/_debug/metrics').status_code, 404)
+
+    # Test that log records carry the request ID and overflow is dropped
+    def test_logging(self):
+        handler = BoundedQueueHandler(2)
+        logger = logging.getLogger('fyyur.test')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        with app.test_request_context('/venues'):
+            app.preprocess_request()
+            for i in range(5):
+                logger.warning('record %d', i)
+        self.assertEqual(handler.stats(), {'queued': 2, 'capacity': 2, 'dropped': 3})
+
+        entry = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+        self.assertEqual((entry['message'], entry['path']), ('record 0', '/venues'))
+        self.assertRegex(entry['request_id'], r'^[0-9a-f]{32}$')
+
+        res = self.client().get('/venues', headers={'X-Request-ID': 'abc-123'})
+        self.assertEqual(res.headers['X-Request-ID'], 'abc-123')
+        self.asgi_request('GET', '/venues', headers=[(b'x-request-id', b'abc-123')])
+        self.assertEqual(self.asgi_headers['x-request-id'], 'abc-123')
+        self.asgi_request('GET', '/venues')
+        self.assertRegex(self.asgi_headers['x-request-id'], r'^[0-9a-f]{32}$')
+
+    # Test geocoding from a gazetteer and that nearby search matches a full scan
+    def test_nearby(self):
+        db.session.add_all([
+            Venue(name='The Musical Hop', city='San Francisco', state='CA'),
+            Venue(name='Park Square Live Music & Coffee', city='san francisco ', state='CA'),
+            Venue(name='The Dueling Pianos Bar', city='New York', state='NY'),
+            Venue(name='Nowhere', city='Atlantis', state='AL'),
+        ])
+        db.session.commit()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cities.csv')
+            with open(path, 'w') as f:
+                f.write('city,state,latitude,longitude\nSan Francisco,CA,37.7749,-122.4194\nNew York,NY,40.7128,-74.0060\n')
+            result = app.test_cli_runner().invoke(fyyur_cli, ['geocode', path])
+        self.assertIn('3 venues geocoded', result.output)
+        self.assertIn('Not in the gazetteer: Atlantis, AL', result.output)
+
+        res = self.client().get('/venues/nearby?lat=37.80&lon=-122.27&radius=20')
+        self.assertEqual([venue['name'] for venue in res.get_json()['venues']],
+                         ['The Musical Hop', 'Park Square Live Music & Coffee'])
+        self.assertEqual(self.client().get('/venues/nearby?lat=37.8').status_code, 400)
+        self.assertEqual(self.client().get('/venues/nearby?lat=37.8&lon=0&radius=9000').status_code, 400)
+
+        # Moving a venue drops its coordinates until it is geocoded again
+        venue = Venue.query.filter_by(city='New York').one()
+        venue.city = 'Brooklyn'
+        db.session.commit()
+        self.assertEqual((venue.latitude, venue.geohash), (None, None))
+
+        rng = random.Random(19)
+        db.session.add_all([
+            Venue(name='Venue %d' % i, latitude=rng.uniform(30, 50), longitude=rng.uniform(-125, -70))
+            for i in range(300)
+        ])
+        db.session.commit()
+
+        everything = [(venue.id, venue.latitude, venue.longitude) for venue in Venue.query.filter(Venue.latitude.isnot(None))]
+        for _ in range(10):
+            lat, lon = rng.uniform(30, 50), rng.uniform(-125, -70)
+            by_distance = sorted((geo.distance_km(lat, lon, vlat, vlon), id) for id, vlat, vlon in everything)
+
+            found = geo.nearby(lat, lon, radius_km=300, limit=100)
+            self.assertEqual([row.id for _, row in found], [id for distance, id in by_distance if distance <= 300][:100])
+            found = geo.nearby(lat, lon, limit=5)
+            self.assertEqual([row.id for _, row in found], [id for _, id in by_distance[:5]])
+
+        self.assertUsesIndex('/venues/nearby?lat=40&lon=-100&radius=50', 'ix_Venue_geohash')
+
+
+    def test_facets(self):
+        self.add_shows(0)
+        db.session.add_all([
+            Venue(name='Dueling Pianos', city='New York', state='NY', seeking_talent=True, genres=genres_named(['Classical', 'Jazz'])),
+            Venue(name='Park Square', city='San Francisco', state='CA', seeking_talent=True, genres=genres_named(['Rock n Roll'])),
+        ])
+        db.session.commit()
+
+        def counts(filters):
+            with app.app_context():
+                result = facets.browse('venues', filters)
+            return result['total'], dict(
+                (facet['name'], dict((option['value'], option['count']) for option in facet['options']))
+                for facet in result['facets'])
+
+        # Each facet's counts apply the other facets' selections
+        filters = facets.parse(MultiDict([('state', 'CA'), ('genre', 'Jazz'), ('genre', 'Rock n Roll'), ('seeking', '1')]))
+        total, by_facet = counts(filters)
+        self.assertEqual(total, 1)
+        self.assertEqual(by_facet['state'], {'CA': 1, 'NY': 1})
+        self.assertEqual(by_facet['genre'], {'Jazz': 0, 'Rock n Roll': 1})
+        self.assertEqual(by_facet['seeking'], {True: 1, False: 1})
+        self.assertEqual([venue['name'] for area in venue_areas(filters=filters) for venue in area['venues']], ['Park Square'])
+
+        # Committed ORM writes update the index in place
+        venue = Venue.query.filter_by(name='The Musical Hop').one()
+        venue.seeking_talent = True
+        db.session.add(Artist(name='The Wild Sax Band', state='NY', seeking_venue=True, genres=genres_named(['Jazz'])))
+        db.session.commit()
+        self.assertEqual(counts(filters)[0], 2)
+        with app.app_context():
+            self.assertEqual(facets.browse('artists', {'state': ['NY']})['total'], 1)
+
+        res = self.client().get('/venues?state=CA&genre=Jazz&seeking=1')
+        self.assertIn(b'1 match', res.data)
+        self.assertIn(b'The Musical Hop', res.data)
+        self.assertNotIn(b'Park Square', res.data)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# Benchmark GET /questions as the question bank grows.
+#
+#   python benchmarks/bench_questions.py [--sizes 1000,10000,100000,500000] [--database-url URL]
+#
+# The bank is grown to each size in turn (SQLite file by default, or any
+# SQLAlchemy URL, e.g. a scratch Postgres database) and the route is timed
+# on page 1, on a page halfway through with ?page= (OFFSET) and with ?after=
+# (keyset), next to "legacy": Question.query.all() sliced in Python, the
+# previous implementation. Page 1 and keyset pages should stay flat.
+#
+# "search" times POST /questions/search for a word in a few questions and
+# "search (ilike)" the previous substring scan. The first search after each
+# growth rebuilds SQLite's in-process index and is left out.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr import create_app, QUESTIONS_PER_PAGE
+from flaskr.search import inverted_index
+from models import db, Question
+
+CHUNK = 10000
+
+
+def grow(size):
+  have = db.session.query(Question).count()
+  for start in range(have, size, CHUNK):
+    db.session.execute(Question.__table__.insert(), [
+      {'question': 'Question %d about %s?' % (i, 'zeppelins' if i % 10000 == 0 else 'trivia'),
+       'answer': 'Answer %d' % i, 'category': str(i % 6 + 1), 'difficulty': i % 5 + 1}
+      for i in range(start, min(start + CHUNK, size))
+    ])
+    db.session.commit()
+
+
+def per_call_ms(fn, repeat):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    fn()
+  return (time.perf_counter() - start) / repeat * 1000
+
+
+def legacy(page):
+  questions = [question.format() for question in Question.query.all()]
+  return questions[(page - 1) * QUESTIONS_PER_PAGE:page * QUESTIONS_PER_PAGE], len(questions)
+
+
+def ilike(term):
+  return [question.format() for question in Question.query.filter(Question.question.ilike('%{}%'.format(term))).all()]
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark GET /questions')
+  parser.add_argument('--sizes', default='1000,10000,100000,500000')
+  parser.add_argument('--database-url')
+  parser.add_argument('--repeat', type=int, default=20)
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp()
+  url = args.database_url or 'sqlite:///' + os.path.join(directory, 'bench.db')
+  app = create_app({'SQLALCHEMY_DATABASE_URI': url})
+  client = app.test_client()
+
+  print('%10s %12s %12s %12s %12s %12s %15s' % (
+    'questions', 'page 1', 'middle page', 'keyset', 'legacy', 'search', 'search (ilike)'))
+  with app.app_context():
+    for size in [int(size) for size in args.sizes.split(',')]:
+      grow(size)
+      # Rows added behind the app's back
+      inverted_index.invalidate()
+      middle = size // QUESTIONS_PER_PAGE // 2 + 1
+      after = (middle - 1) * QUESTIONS_PER_PAGE
+
+      timings = [
+        per_call_ms(lambda: client.get('/questions?page=1'), args.repeat),
+        per_call_ms(lambda: client.get('/questions?page=%d' % middle), args.repeat),
+        per_call_ms(lambda: client.get('/questions?after=%d' % after), args.repeat),
+        per_call_ms(lambda: legacy(middle), max(1, args.repeat // 10)),
+      ]
+      matches = client.post('/questions/search', json={'searchTerm': 'zeppelins'}).get_json()['totalQuestions']
+      assert matches == (size - 1) // 10000 + 1, matches
+      timings += [
+        per_call_ms(lambda: client.post('/questions/search', json={'searchTerm': 'zeppelins'}), args.repeat),
+        per_call_ms(lambda: ilike('zeppelins'), max(1, args.repeat // 10)),
+      ]
+      print('%10d %10.2fms %10.2fms %10.2fms %10.2fms %10.2fms %13.2fms' % ((size,) + tuple(timings)))
+
+
+if __name__ == '__main__':
+  main()
@@ -2,16 +2,32 @@ import os
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
 from models import setup_db, Question, Category, db
-
-QUESTIONS_PER_PAGE = 10
+from .pagination import QUESTIONS_PER_PAGE, paginate, page_after, total_questions
+from .categories import categories
+from .quiz import quiz_pool
+from .sessions import QUIZ_LENGTH, MAX_QUIZ_LENGTH, draw, session_store
+from .search import ensure_index, inverted_index, search_questions as find_questions
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  if test_config and 'SQLALCHEMY_DATABASE_URI' in test_config:
+    setup_db(app, test_config['SQLALCHEMY_DATABASE_URI'])
+  else:
+    setup_db(app)
+  total_questions.invalidate()
+  quiz_pool.invalidate()
+  inverted_index.invalidate()
+
+  # Categories are read once here and then served from memory
+  with app.app_context():
+    categories.load()
+    ensure_index()
+
+  # Where quiz sessions are kept (memory, or Redis for several processes)
+  store = session_store(test_config)
 
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -35,19 +51,11 @@ def create_app(test_config=None):
   '''
   @app.route("/categories")
   def get_categories():
-      
-    # Query all categories
-    categories = Category.query.all()
-
-    # Reformat categories into a dictionary
-    # of id: type
-    categories_ids = {
-        category.id: category.type for category in categories
-    }
 
+    # Dictionary of id: type, from the category registry
     result = jsonify({
         'success': True,
-        'categories': categories_ids
+        'categories': categories.all()
     })
 
     return result
@@ -65,43 +73,30 @@ def create_app(test_config=None):
   Clicking on the page numbers should update the questions. 
   '''
 
-  # Create pagination function called in get_questions
-  def paginate(questions, max_per_page, page):
-      start = (page - 1) * max_per_page
-      end = page * max_per_page 
-
-      questions = questions[start:end]
-
-      return questions
-
   @app.route("/questions")
   def get_questions():
 
-      # Get page number from request
-      page = request.args.get('page', default=1)
-      page = int(page)
-      
-      # Query all questions from database and format
-      questions = Question.query.all()
+      # ?page= is served with LIMIT/OFFSET in SQL. ?after=<id> (the
+      # next_cursor of the previous page) continues from the primary key
+      # instead, costing the same however deep into the bank it is.
+      page = request.args.get('page', default=1, type=int)
+      after = request.args.get('after', type=int)
+      if page < 1 or (after is not None and after < 0):
+          abort(400)
+
+      if after is None:
+          questions = paginate(Question.query.order_by(Question.id), page)
+          next_cursor = questions[-1].id if len(questions) == QUESTIONS_PER_PAGE else None
+      else:
+          questions, next_cursor = page_after(Question.query, after)
       questions = [question.format() for question in questions]
 
-      # Calculate total length of request to support pagination
-      max_questions = len(questions)
-
-      # Run paginate custom function
-      questions = paginate(questions, QUESTIONS_PER_PAGE, page)
-
-      # Get all categories
-      categories = Category.query.all()
-      categories_ids = {
-          category.id: category.type for category in categories
-      }
-
       result = {
           'success': True,
           'questions': questions,
-          'total_questions': max_questions,
-          'categories': categories_ids,
+          'total_questions': total_questions.get(),
+          'next_cursor': next_cursor,
+          'categories': categories.all(),
           'currentCategory': None
       }
 
@@ -126,6 +121,9 @@ def create_app(test_config=None):
         question.delete()
     except Exception as e:
         abort(500)
+    total_questions.adjust(-1)
+    quiz_pool.remove(id)
+    inverted_index.remove(id)
 
     result = jsonify({
         'success': True
@@ -156,6 +154,9 @@ def create_app(test_config=None):
         q = Question(question=body['question'], answer=body['answer'], 
             difficulty=body['difficulty'], category=body['category'])
         q.insert()
+        total_questions.adjust(1)
+        quiz_pool.add(q)
+        inverted_index.add(q)
     except Exception as e:
         db.session.rollback()
         print(e)
@@ -178,17 +179,33 @@ def create_app(test_config=None):
   @app.route("/questions/search", methods=['POST'])
   def search_questions():
     #Get search term
-    body = request.get_json()
-    search_term = body['searchTerm']
-    
-    # Find and format questions with the search team, case insensitive
-    questions = Question.query.filter(Question.question.ilike('%{}%'.format(search_term))).all()
+    body = request.get_json() or {}
+    search_term = body.get('searchTerm') or ''
+
+    # Optional filters and page, checked before searching
+    category = body.get('category')
+    difficulty = body.get('difficulty')
+    page = body.get('page', 1)
+    try:
+        category = int(category) if category is not None else None
+        difficulty = int(difficulty) if difficulty is not None else None
+        page = int(page)
+    except (TypeError, ValueError):
+        abort(422)
+    if category is not None and category not in categories:
+        abort(422)
+    if page < 1:
+        abort(400)
+
+    # Questions and answers with every word of the search term, best match
+    # first, a page at a time
+    questions, total = find_questions(search_term, category, difficulty, page)
     questions = [question.format() for question in questions]
 
     result = {
         'success': True,
         'questions': questions,
-        'totalQuestions': len(questions),
+        'totalQuestions': total,
         'currentCategory': None
     }
 
@@ -203,11 +220,12 @@ def create_app(test_config=None):
   categories in the left column will cause only questions of that 
   category to be shown. 
   '''
-  @app.route('/categories/<id>/questions')
+  @app.route('/categories/<int:id>/questions')
   def question_category(id):
-    category_id = id
+    if id not in categories:
+        abort(404)
 
-    questions = Question.query.filter(Question.category==category_id).all()
+    questions = Question.query.filter(Question.category==str(id)).all()
     questions = [question.format() for question in questions]
 
     result = {
@@ -231,6 +249,17 @@ def create_app(test_config=None):
   one question at a time is displayed, the user is allowed to answer
   and shown whether they were correct or not. 
   '''
+  # Category id of a quiz_category object. The frontend sends ids as
+  # strings; 0 is "All", anything else must be a known category.
+  def quiz_category_id(category):
+    try:
+        category_id = int(category['id'])
+    except (KeyError, TypeError, ValueError):
+        abort(422)
+    if category_id != 0 and category_id not in categories:
+        abort(422)
+    return category_id
+
   @app.route('/quizzes', methods=['POST'])
   def play_quiz():
       
@@ -240,29 +269,12 @@ def create_app(test_config=None):
     category = body['quiz_category']
     previous_questions = body['previous_questions']
 
-    #Get all questions in category
-    questions = Question.query.filter(Question.category==category['id'])
-    
-    # Get full list of question ids in the category
-    question_ids = []
-    for q in questions:
-        question_ids.append(q.id)
-
-    # Remove question ids if in previous questions list
-    # Informed by list comprehension in following Stack Overflow answer:
-    # https://stackoverflow.com/questions/4211209/remove-all-the-elements-that-occur-in-one-list-from-another/4211228
-    
-    potential_question_ids = [id for id in question_ids if id not in previous_questions]
-    
-    # Get random question from potential question ids
-    if len(potential_question_ids) > 0:
-        random_question_id = random.choice(potential_question_ids)
+    category_id = quiz_category_id(category)
 
-        for q in questions:
-            if q.id == random_question_id:
-                random_question = q.format()
-    else:
-        random_question = None
+    # A random unseen question, drawn from the in-memory id arrays and
+    # then fetched by primary key. Category 0 draws from all of them.
+    question = quiz_pool.sample(category_id, set(previous_questions))
+    random_question = question.format() if question is not None else None
 
     result = {
         'success': True, 
@@ -271,6 +283,58 @@ def create_app(test_config=None):
 
     return jsonify(result)
 
+  '''
+  Quiz sessions: the server draws the quiz's questions when it starts and
+  hands them out one at a time, so clients don't resend previous_questions.
+  '''
+  @app.route('/quizzes/sessions', methods=['POST'])
+  def create_quiz_session():
+
+    body = request.get_json() or {}
+
+    # quiz_category as for /quizzes (All when omitted), and how many
+    # questions to ask
+    category_id = quiz_category_id(body.get('quiz_category') or {'id': 0})
+    length = body.get('questions', QUIZ_LENGTH)
+    if isinstance(length, bool) or not isinstance(length, int) or not 1 <= length <= MAX_QUIZ_LENGTH:
+        abort(422)
+
+    order = draw(category_id, length)
+    session_id = store.create(order)
+
+    result = {
+        'success': True,
+        'session_id': session_id,
+        'total_questions': len(order)
+    }
+
+    return jsonify(result), 201
+
+  @app.route('/quizzes/sessions/<session_id>/next')
+  def next_quiz_question(session_id):
+
+    # The session's next question, skipping any deleted since it started;
+    # None once the quiz is over
+    question = None
+    while True:
+        try:
+            question_id = store.next(session_id)
+        except KeyError:
+            abort(404)
+        if question_id is None:
+            break
+        question = Question.query.get(question_id)
+        if question is not None:
+            break
+
+    result = {
+        'success': True,
+        'question': question.format() if question is not None else None,
+        'remaining': store.remaining(session_id)
+    }
+
+    return jsonify(result)
+
   '''
   @TODO: 
   Create error handlers for all expected errors 
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from models import db, Category
+
+# Seconds the categories are served from memory before they are read again.
+# There is no endpoint that changes them, so this only bounds how long a
+# category added in the database takes to show up.
+CATEGORY_TTL = 300
+
+'''
+CategoryRegistry
+    the {id: type} map of every category, loaded once and served from memory
+    to all requests of the process, read again when older than ttl seconds
+'''
+class CategoryRegistry(object):
+
+  def __init__(self, ttl=CATEGORY_TTL):
+    self.ttl = ttl
+    self.types = None
+    self.loaded_at = 0
+    self.lock = threading.Lock()
+
+  def load(self):
+    types = dict(db.session.query(Category.id, Category.type).order_by(Category.id).all())
+    with self.lock:
+      self.types, self.loaded_at = types, time.time()
+    return types
+
+  def all(self):
+    # {id: type}; callers must not modify it
+    types = self.types
+    if types is None or time.time() - self.loaded_at >= self.ttl:
+      types = self.load()
+    return types
+
+  def __contains__(self, id):
+    return id in self.all()
+
+  def get(self, id):
+    return self.all().get(id)
+
+  def invalidate(self):
+    with self.lock:
+      self.types = None
+
+
+categories = CategoryRegistry()
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from sqlalchemy import func, text
+
+from models import db, Question
+
+QUESTIONS_PER_PAGE = 10
+
+# Seconds a question count is served from memory before it is taken again
+COUNT_TTL = 60
+
+# Above this many rows (by the planner's estimate) Postgres answers
+# total_questions from its statistics instead of counting the table
+ESTIMATE_ABOVE = 100000
+
+'''
+paginate(query, page, per_page)
+    one page of a query, with LIMIT/OFFSET in SQL; the query must be ordered
+'''
+def paginate(query, page, per_page=QUESTIONS_PER_PAGE):
+  if page < 1:
+    raise ValueError('page starts at 1')
+  return query.limit(per_page).offset((page - 1) * per_page).all()
+
+'''
+page_after(query, after, per_page)
+    the page of questions whose id is greater than after (a keyset cursor),
+    and the cursor of the next page or None. Unlike OFFSET this costs the
+    same on page 1 and page 50000: it starts from the primary key index.
+'''
+def page_after(query, after, per_page=QUESTIONS_PER_PAGE):
+  rows = query.filter(Question.id > after) \
+    .order_by(Question.id) \
+    .limit(per_page + 1) \
+    .all()
+  next_cursor = rows[per_page - 1].id if len(rows) > per_page else None
+  return rows[:per_page], next_cursor
+
+'''
+count_questions()
+    the number of questions: exact for small tables, the planner's estimate
+    on Postgres once it passes ESTIMATE_ABOVE rows
+'''
+def count_questions():
+  if db.engine.dialect.name == 'postgresql':
+    estimate = db.session.execute(
+      text('SELECT reltuples::bigint FROM pg_class WHERE relname = :table'),
+      {'table': Question.__tablename__}
+    ).scalar()
+    if estimate is not None and estimate > ESTIMATE_ABOVE:
+      return int(estimate)
+  return db.session.query(func.count(Question.id)).scalar()
+
+'''
+CachedCount
+    a count served from memory, taken again every ttl seconds and adjusted
+    for this process's own inserts and deletes in between
+'''
+class CachedCount(object):
+
+  def __init__(self, count, ttl=COUNT_TTL):
+    self.count = count
+    self.ttl = ttl
+    self.value = None
+    self.taken_at = 0
+    self.lock = threading.Lock()
+
+  def get(self):
+    with self.lock:
+      if self.value is not None and time.time() - self.taken_at < self.ttl:
+        return self.value
+    value = self.count()
+    with self.lock:
+      self.value, self.taken_at = value, time.time()
+    return value
+
+  def adjust(self, delta):
+    with self.lock:
+      if self.value is not None:
+        self.value = max(self.value + delta, 0)
+
+  def invalidate(self):
+    with self.lock:
+      self.value = None
+
+
+total_questions = CachedCount(count_questions)
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+
+from models import db, Question
+
+# Seconds the question ids are served from memory before they are read
+# again, picking up questions added or deleted by other processes
+POOL_TTL = 300
+
+# Random draws tried before falling back to listing the unseen ids. While
+# at most half of a category has been seen, all of them miss less than
+# once in 2 ** SAMPLE_TRIES quizzes.
+SAMPLE_TRIES = 8
+
+# Pool key of the "All" category
+ALL = 0
+
+'''
+IdArray
+    a set of ids that can also pick one of its members at random, all in
+    constant time: a list of the ids and every id's position in it
+'''
+class IdArray(object):
+
+  def __init__(self, ids=()):
+    self.ids = list(ids)
+    self.positions = dict((id, i) for i, id in enumerate(self.ids))
+
+  def __len__(self):
+    return len(self.ids)
+
+  def add(self, id):
+    if id not in self.positions:
+      self.positions[id] = len(self.ids)
+      self.ids.append(id)
+
+  def remove(self, id):
+    # Move the last id into the removed one's place
+    i = self.positions.pop(id, None)
+    if i is None:
+      return
+    last = self.ids.pop()
+    if i < len(self.ids):
+      self.ids[i] = last
+      self.positions[last] = i
+
+  def sample(self, seen, rng=random):
+    # A uniformly chosen id that is not in seen (a set), or None
+    if not self.ids:
+      return None
+    for _ in range(SAMPLE_TRIES):
+      id = self.ids[rng.randrange(len(self.ids))]
+      if id not in seen:
+        return id
+    # Most of it has been seen: choose among what is left
+    unseen = [id for id in self.ids if id not in seen]
+    return rng.choice(unseen) if unseen else None
+
+
+def _category_id(category):
+  # Question.category is stored as a string
+  try:
+    return int(category)
+  except (TypeError, ValueError):
+    return None
+
+'''
+QuestionPool
+    the ids of the questions of each category, and of all of them under ALL,
+    loaded on first use and kept in step with this process's inserts and
+    deletes
+'''
+class QuestionPool(object):
+
+  def __init__(self, ttl=POOL_TTL):
+    self.ttl = ttl
+    self.arrays = None
+    self.loaded_at = 0
+    self.lock = threading.Lock()
+
+  def load(self):
+    arrays = {ALL: IdArray()}
+    for id, category in db.session.query(Question.id, Question.category).order_by(Question.id):
+      arrays[ALL].add(id)
+      category_id = _category_id(category)
+      if category_id is not None:
+        arrays.setdefault(category_id, IdArray()).add(id)
+    with self.lock:
+      self.arrays, self.loaded_at = arrays, time.time()
+    return arrays
+
+  def _arrays(self):
+    arrays = self.arrays
+    if arrays is None or time.time() - self.loaded_at >= self.ttl:
+      arrays = self.load()
+    return arrays
+
+  def add(self, question):
+    with self.lock:
+      if self.arrays is None:
+        return
+      self.arrays[ALL].add(question.id)
+      category_id = _category_id(question.category)
+      if category_id is not None:
+        self.arrays.setdefault(category_id, IdArray()).add(question.id)
+
+  def remove(self, id):
+    with self.lock:
+      if self.arrays is not None:
+        for array in self.arrays.values():
+          array.remove(id)
+
+  def invalidate(self):
+    with self.lock:
+      self.arrays = None
+
+  def draw(self, category_id, length):
+    # Up to length distinct random ids of the category, in random order
+    arrays = self._arrays()
+    with self.lock:
+      array = arrays.get(category_id)
+      if array is None:
+        return []
+      return random.sample(array.ids, min(length, len(array)))
+
+  def sample(self, category_id, seen):
+    # A random question of the category (ALL for any) whose id is not in
+    # seen, fetched by primary key, or None when every one has been seen
+    while True:
+      arrays = self._arrays()
+      with self.lock:
+        array = arrays.get(category_id)
+        id = array.sample(seen) if array is not None else None
+      if id is None:
+        return None
+
+      question = db.session.query(Question).get(id)
+      if question is not None:
+        return question
+      # Deleted by another process since the ids were loaded
+      self.remove(id)
+
+
+quiz_pool = QuestionPool()
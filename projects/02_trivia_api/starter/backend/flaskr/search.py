@@ -0,0 +1,213 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import literal_column, func, text
+
+from models import db, Question
+from .pagination import QUESTIONS_PER_PAGE
+
+'''
+Full-text search over question and answer text.
+
+On Postgres the questions are matched with plainto_tsquery against a GIN
+expression index (ix_questions_search, created by ensure_index()) and
+ranked with ts_rank_cd, filtering, ordering and paginating in SQL.
+
+Elsewhere (SQLite in tests) an in-process inverted index stands in: token
+-> {question id: term frequency}, ranked with BM25. It is built on first
+use, kept in step with this process's inserts and deletes and rebuilt
+after INDEX_TTL seconds. Either way every term must match.
+
+The index stems its tokens with stem(), so that "title" finds "titles" as
+Postgres' english configuration does. That is a much lighter stemmer than
+Postgres' Snowball one, and STOPWORDS is shorter than its stopword list,
+so the two can still disagree on rarer word forms: counts and ranks on
+SQLite approximate, rather than reproduce, those on Postgres.
+'''
+
+# The indexed document; the query must use the same expression for
+# Postgres to use the index
+DOCUMENT = "to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, ''))"
+
+# Seconds before the in-process index is rebuilt from the database
+INDEX_TTL = 300
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+VOWEL = re.compile('[aeiouy]')
+
+# Words too common to search by, dropped from documents and queries alike
+STOPWORDS = frozenset('''
+a an and are as at be by for from has he in is it its of on or that the
+this to was were what which who whom whose will with
+'''.split())
+
+
+def stem(token):
+  # Strips plural, -ed and -ing endings and a final e: "titles", "titled"
+  # and "title" all become "titl"
+  if len(token) <= 3 or not token.isalpha():
+    return token
+  if token.endswith('sses'):
+    token = token[:-2]
+  elif token.endswith('ies'):
+    token = token[:-3] + 'y'
+  elif token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+    token = token[:-1]
+  for suffix in ('ing', 'ed'):
+    base = token[:-len(suffix)]
+    if token.endswith(suffix) and len(base) >= 3 and VOWEL.search(base):
+      token = base
+      # running -> run
+      if token[-1] == token[-2] and token[-1] not in 'lsz':
+        token = token[:-1]
+      break
+  if len(token) > 3 and token.endswith('e'):
+    token = token[:-1]
+  return token
+
+
+def tokenize(value):
+  return [stem(token) for token in TOKEN.findall((value or '').lower()) if token not in STOPWORDS]
+
+'''
+ensure_index()
+    creates the GIN index on Postgres if it is missing; the table may have
+    been restored from trivia.psql rather than created by create_all()
+'''
+def ensure_index():
+  if db.engine.dialect.name != 'postgresql':
+    return
+  db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING gin (%s)' % DOCUMENT))
+  db.session.commit()
+
+'''
+InvertedIndex
+    the in-process index: postings per token, and the length, category and
+    difficulty of every question
+'''
+class InvertedIndex(object):
+
+  def __init__(self, ttl=INDEX_TTL):
+    self.ttl = ttl
+    self.postings = None
+    self.documents = None
+    self.total_length = 0
+    self.loaded_at = 0
+    self.lock = threading.RLock()
+
+  def load(self):
+    with self.lock:
+      self.postings, self.documents, self.total_length = {}, {}, 0
+      rows = db.session.query(Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+      for row in rows.yield_per(1000):
+        self._add(*row)
+      self.loaded_at = time.time()
+
+  def _add(self, id, question, answer, category, difficulty):
+    tokens = tokenize(question) + tokenize(answer)
+    for token, count in Counter(tokens).items():
+      self.postings.setdefault(token, {})[id] = count
+    self.documents[id] = (len(tokens), category, difficulty, set(tokens))
+    self.total_length += len(tokens)
+
+  def add(self, question):
+    with self.lock:
+      if self.documents is not None:
+        self.remove(question.id)
+        self._add(question.id, question.question, question.answer, question.category, question.difficulty)
+
+  def remove(self, id):
+    with self.lock:
+      if self.documents is None or id not in self.documents:
+        return
+      length, _, _, tokens = self.documents.pop(id)
+      self.total_length -= length
+      for token in tokens:
+        postings = self.postings[token]
+        postings.pop(id, None)
+        if not postings:
+          del self.postings[token]
+
+  def invalidate(self):
+    with self.lock:
+      self.documents = None
+
+  def search(self, terms, category=None, difficulty=None):
+    # (score, id) of every question having all the terms, best first
+    with self.lock:
+      if self.documents is None or time.time() - self.loaded_at >= self.ttl:
+        self.load()
+
+      lists = [self.postings.get(term, {}) for term in set(terms)]
+      if not lists or not all(lists):
+        return []
+      # Intersect starting from the rarest term
+      lists.sort(key=len)
+      candidates = [id for id in lists[0] if all(id in postings for postings in lists[1:])]
+
+      count = len(self.documents)
+      average = self.total_length / float(count)
+      results = []
+      for id in candidates:
+        length, question_category, question_difficulty, _ = self.documents[id]
+        if category is not None and question_category != category:
+          continue
+        if difficulty is not None and question_difficulty != difficulty:
+          continue
+        score = 0.0
+        for postings in lists:
+          idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+          tf = postings[id]
+          score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average))
+        results.append((score, id))
+
+    results.sort(key=lambda result: (-result[0], result[1]))
+    return results
+
+
+inverted_index = InvertedIndex()
+
+'''
+search_questions(term, category, difficulty, page)
+    one page of the questions matching every word of term (every question
+    for a blank term), best match first, and how many match in all.
+    category is a category id, difficulty an int; None leaves them open.
+'''
+def search_questions(term, category=None, difficulty=None, page=1, per_page=QUESTIONS_PER_PAGE):
+  category = str(category) if category is not None else None
+  listing = not (term or '').strip()
+  terms = tokenize(term)
+  if not listing and not terms:
+    # Nothing but stopwords and punctuation
+    return [], 0
+
+  if db.engine.dialect.name == 'postgresql' or listing:
+    query = Question.query
+    if category is not None:
+      query = query.filter(Question.category == category)
+    if difficulty is not None:
+      query = query.filter(Question.difficulty == difficulty)
+
+    if listing:
+      order = [Question.id]
+    else:
+      document = literal_column(DOCUMENT)
+      tsquery = func.plainto_tsquery('english', ' '.join(terms))
+      query = query.filter(document.op('@@')(tsquery))
+      order = [func.ts_rank_cd(document, tsquery).desc(), Question.id]
+
+    total = query.order_by(None).count()
+    questions = query.order_by(*order).limit(per_page).offset((page - 1) * per_page).all()
+    return questions, total
+
+  results = inverted_index.search(terms, category, difficulty)
+  ids = [id for _, id in results[(page - 1) * per_page:page * per_page]]
+  found = dict((question.id, question) for question in Question.query.filter(Question.id.in_(ids))) if ids else {}
+  return [found[id] for id in ids if id in found], len(results)
@@ -0,0 +1,132 @@
+import os
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from .quiz import quiz_pool
+
+# Questions in a quiz unless the client asks for another number, and the
+# most it can ask for
+QUIZ_LENGTH = 5
+MAX_QUIZ_LENGTH = 1000
+
+# Seconds a session lives after its last use
+SESSION_TTL = 3600
+
+# Sessions kept by the in-process store; the least recently used go first
+MAX_SESSIONS = 10000
+
+# Bytes per question id in a packed order
+ITEMSIZE = array('I').itemsize
+
+'''
+A quiz session is the order its questions will be asked in, drawn up front
+from the in-memory id arrays (random.sample: O(length), not O(category)),
+and a position in it. The order is stored packed, ITEMSIZE bytes a question,
+so /next only moves the position and fetches one row by primary key.
+'''
+
+def draw(category_id, length=QUIZ_LENGTH):
+  # A random order of up to length question ids of the category (0: all)
+  return array('I', quiz_pool.draw(category_id, length))
+
+'''
+MemoryStore
+    sessions in this process, evicted least recently used first beyond
+    max_sessions and once idle for ttl seconds
+'''
+class MemoryStore(object):
+
+  def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+    self.max_sessions = max_sessions
+    self.ttl = ttl
+    # id -> [order, position, last used]
+    self.sessions = OrderedDict()
+    self.lock = threading.Lock()
+
+  def create(self, order):
+    id = secrets.token_urlsafe(16)
+    with self.lock:
+      self.sessions[id] = [order, 0, time.time()]
+      while len(self.sessions) > self.max_sessions:
+        self.sessions.popitem(last=False)
+    return id
+
+  def next(self, id):
+    # The next question id of the session, None when it is over; KeyError
+    # for unknown or expired sessions
+    with self.lock:
+      session = self.sessions[id]
+      if time.time() - session[2] > self.ttl:
+        del self.sessions[id]
+        raise KeyError(id)
+      self.sessions.move_to_end(id)
+      order, position, _ = session
+      session[1:] = [position + 1, time.time()]
+    return order[position] if position < len(order) else None
+
+  def remaining(self, id):
+    with self.lock:
+      order, position, _ = self.sessions[id]
+    return max(len(order) - position, 0)
+
+'''
+RedisStore
+    sessions shared by every process on a Redis-compatible client (get,
+    set, exists, incr, expire, getrange, strlen): the packed order under quiz:<id> and
+    the position under quiz:<id>:at, both expiring ttl seconds after last use
+'''
+class RedisStore(object):
+
+  def __init__(self, client, ttl=SESSION_TTL):
+    self.client = client
+    self.ttl = ttl
+
+  def create(self, order):
+    id = secrets.token_urlsafe(16)
+    self.client.set('quiz:%s' % id, order.tobytes(), ex=self.ttl)
+    self.client.set('quiz:%s:at' % id, 0, ex=self.ttl)
+    return id
+
+  def next(self, id):
+    key = 'quiz:%s' % id
+    if not self.client.exists(key + ':at'):
+      raise KeyError(id)
+    position = self.client.incr(key + ':at') - 1
+    self.client.expire(key, self.ttl)
+    self.client.expire(key + ':at', self.ttl)
+
+    start = position * ITEMSIZE
+    value = self.client.getrange(key, start, start + ITEMSIZE - 1)
+    return array('I', value)[0] if len(value) == ITEMSIZE else None
+
+  def remaining(self, id):
+    position = self.client.get('quiz:%s:at' % id)
+    if position is None:
+      raise KeyError(id)
+    return max(self.client.strlen('quiz:%s' % id) // ITEMSIZE - int(position), 0)
+
+
+def _redis_client(url):
+  try:
+    import redis
+  except ImportError:
+    raise RuntimeError('QUIZ_SESSIONS_REDIS_URL needs the redis package (pip install redis)')
+  return redis.from_url(url)
+
+'''
+session_store(test_config)
+    the store for quiz sessions: a client passed as QUIZ_SESSIONS_CLIENT
+    (e.g. a local Redis stand-in), Redis at $QUIZ_SESSIONS_REDIS_URL, or
+    this process's memory
+'''
+def session_store(test_config=None):
+  test_config = test_config or {}
+  if test_config.get('QUIZ_SESSIONS_CLIENT') is not None:
+    return RedisStore(test_config['QUIZ_SESSIONS_CLIENT'])
+  url = os.environ.get('QUIZ_SESSIONS_REDIS_URL')
+  if url:
+    return RedisStore(_redis_client(url))
+  return MemoryStore()
@@ -4,7 +4,8 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.search import inverted_index, search_questions
+from models import db, Question, Category
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,11 +13,11 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgres://postgres:root@{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        # create_app() loads the category registry, so it must see the test database
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.client = self.app.test_client
 
         # binds the app to the current context
         with self.app.app_context():
@@ -54,6 +55,85 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['questions'])
 
+    # Test that ?after= continues where the previous page stopped
+    def test_get_questions_after(self):
+        first = json.loads(self.client().get("/questions").data)
+        res = self.client().get("/questions?after={}".format(first['next_cursor']))
+        data = json.loads(res.data)
+        second = json.loads(self.client().get("/questions?page=2").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], second['questions'])
+        self.assertEqual(data['total_questions'], first['total_questions'])
+        self.assertEqual(self.client().get("/questions?page=0").status_code, 400)
+
+    # Test that unknown categories are rejected from the category registry
+    def test_unknown_category(self):
+        res = self.client().get("/categories/1000/questions")
+        self.assertEqual(res.status_code, 404)
+
+        res = self.client().post("/quizzes", json={
+                'previous_questions': [],
+                'quiz_category': {'type': 'Unknown', 'id': 1000}
+                }
+            )
+        self.assertEqual(res.status_code, 422)
+
+    # Test that a quiz over all categories (id 0) plays every question once
+    def test_play_quiz_all(self):
+        previous_questions = []
+        while True:
+            res = self.client().post("/quizzes", json={
+                    'previous_questions': previous_questions,
+                    'quiz_category': {'type': 'click', 'id': 0}
+                    }
+                )
+            question = json.loads(res.data)['question']
+            if question is None:
+                break
+            self.assertNotIn(question['id'], previous_questions)
+            previous_questions.append(question['id'])
+
+        self.assertEqual(len(previous_questions), Question.query.count())
+
+    # Test that a quiz session hands out its questions once each, then None
+    def test_quiz_session(self):
+        res = self.client().post("/quizzes/sessions", json={
+                'quiz_category': {'type': 'Science', 'id': 1},
+                'questions': 3
+                }
+            )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 201)
+
+        asked = []
+        for _ in range(data['total_questions']):
+            question = json.loads(self.client().get("/quizzes/sessions/{}/next".format(data['session_id'])).data)['question']
+            self.assertEqual(question['category'], '1')
+            asked.append(question['id'])
+        res = self.client().get("/quizzes/sessions/{}/next".format(data['session_id']))
+
+        self.assertEqual(len(set(asked)), data['total_questions'])
+        self.assertIsNone(json.loads(res.data)['question'])
+        self.assertEqual(self.client().get("/quizzes/sessions/unknown/next").status_code, 404)
+
+    # Test that search matches words of questions and answers, with filters
+    def test_search_questions(self):
+        res = self.client().post("/questions/search", json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        for question in data['questions']:
+            self.assertIn('title', (question['question'] + ' ' + question['answer']).lower())
+
+        res = self.client().post("/questions/search", json={'searchTerm': 'title', 'category': 5, 'difficulty': 3})
+        for question in json.loads(res.data)['questions']:
+            self.assertEqual((question['category'], question['difficulty']), ('5', 3))
+
+        res = self.client().post("/questions/search", json={'searchTerm': 'title', 'category': 1000})
+        self.assertEqual(res.status_code, 422)
+
     # Test the DELETE endpoint for deleting questions
     def test_delete_question(self):
         res = self.client().delete("/questions/20")
@@ -99,6 +179,43 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertTrue(res.status_code, 400)
 
+class SearchIndexTestCase(unittest.TestCase):
+    """The in-process search index, which serves search on SQLite"""
+
+    def setUp(self):
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+        self.context = self.app.app_context()
+        self.context.push()
+        self.questions = [
+            Question('Which book has the title "Titles of Titles"?', 'None', '5', 3),
+            Question('What is the title of the first film?', 'Jaws', '5', 2),
+            Question('Who titled the album?', 'Nobody', '1', 2),
+            Question('Whose autobiography is entitled "I Know Why the Caged Bird Sings"?', 'Maya Angelou', '4', 2),
+        ]
+        for question in self.questions:
+            question.insert()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    # Test that stemmed words match, ranked by BM25, with filters
+    def test_search_index(self):
+        book, film, album, _ = [question.id for question in self.questions]
+
+        # The shorter album question outranks the film one
+        questions, total = search_questions('titles')
+        self.assertEqual(([question.id for question in questions], total), ([book, album, film], 3))
+        self.assertEqual(search_questions('Title film')[1], 1)
+        self.assertEqual(search_questions('title', category=5, difficulty=2)[0], [self.questions[1]])
+        self.assertEqual(search_questions('of the'), ([], 0))
+
+        inverted_index.remove(film)
+        self.assertEqual(search_questions('film')[1], 0)
+        inverted_index.add(self.questions[1])
+        self.assertEqual(search_questions('film')[1], 1)
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file